@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+#
+# Copyright 2014-2016 CloudVelox Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Benchmark clsh commands against a local stand-in for AWS.
+
+Each (case, size) pair runs in its own process, so that the reported
+peak RSS is that of a single command. The results are written as a JSON
+report; a previous report can be given to compare against.
+
+The -w option adds a simulated network latency (in milliseconds) to
+each request.
+
+Usage:
+    clshbench.py [-c case,...] [-s size,...] [-w msecs] [-o report.json]
+                 [-C old_report.json] [-l]
+"""
+
+import getopt
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+_BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+_SRC_DIR = os.path.join(os.path.dirname(_BENCH_DIR), 'src')
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+#
+# Output lines reporting a command failure
+#
+_ERROR_LINE_RE = re.compile(r'^((\w+ )?operation failed|Unexpected exception)',
+                                                                re.IGNORECASE)
+
+#
+# The benchmark cases: (name, command line)
+#
+CASE_LIST = [
+    ('inst-list',       'inst -l -a'),
+    ('inst-extended',   'inst -x -a'),
+    ('inst-count',      'inst -k -a'),
+    ('vol-list',        'vol -l -a'),
+    ('vol-count',       'vol -k -a -s'),
+    ('snap-list',       'snap -l -a'),
+    ('snap-extended',   'snap -x -a'),
+    ('snap-count',      'snap -k -a -s'),
+    ('ami-list',        'ami -l -a'),
+    ('sg-list',         'sg -l -a'),
+    ('tag-list',        'tag -a'),
+    ('tag-stats',       'tag -S'),
+    ('elb-list',        'elb -l -a'),
+    ('rds-list',        'rds inst -l -a'),
+    ('user-list',       'user -l -a'),
+    ('vol-delete',      'vol -D -q Env=bench-delete'),
+    ('snap-delete',     'snap -D -q Env=bench-delete'),
+    ('ami-delete',      'ami -D -q Env=bench-delete'),
+    ('tag-delete',      'tag -D -w vol:tag:Env=bench-delete Owner'),
+    ('tag-create',      'tag -C -w vol:tag:Env=bench-delete Owner=bench'),
+]
+
+
+class _OutputSink(object):
+    """Discards the command output, but keeps track of the time when
+    the first row was output, of the number of bytes output, and of
+    the first error reported by the command
+    """
+    def __init__(self):
+        self.first_write_time = None
+        self.n_bytes = 0
+        self.error = None
+
+    def write(self, s):
+        if self.first_write_time is None and s.strip():
+            self.first_write_time = time.time()
+        if self.error is None and _ERROR_LINE_RE.match(s):
+            self.error = s.strip()
+        self.n_bytes += len(s)
+
+    def flush(self):
+        pass
+
+
+def _max_rss_kb():
+    """Returns the peak RSS of this process in KB
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        max_rss /= 1024
+    return max_rss
+
+
+def _run_case(case_name, size, latency):
+    """Run a single benchmark case in this process and print
+    the result (as JSON) to stdout
+    """
+    sys.path.insert(0, _SRC_DIR)
+    sys.argv = [os.path.join(_SRC_DIR, 'clsh.py')]
+    import fakeaws
+    import common
+    import clsh
+
+    cmd_line = dict(CASE_LIST)[case_name]
+    #
+    # The commands should not prompt for confirmation or start a pager
+    #
+    for module in sys.modules.values():
+        if not getattr(module, '__file__', '').startswith(_SRC_DIR):
+            continue
+        for func_name in ('confirm', 'confirm_aggr'):
+            if hasattr(module, func_name):
+                setattr(module, func_name, lambda *args, **kwargs: True)
+    common_init = common.CommandOutput.__init__
+
+    def unpaginated_init(self, paginated_output=True, output_path=None):
+        common_init(self, False, output_path)
+
+    common.CommandOutput.__init__ = unpaginated_init
+
+    account = fakeaws.FakeAccount(size)
+    fake = fakeaws.FakeAws(account, latency)
+    fake.install()
+    cred_file = tempfile.NamedTemporaryFile(delete=False)
+    cred_file.write("AWSAccessKeyId=bench\nAWSSecretKey=bench\n")
+    cred_file.close()
+    try:
+        interp = clsh._CommandInterpreter('us-east-1', cred_file.name, False)
+    finally:
+        os.unlink(cred_file.name)
+    base_rss_kb = _max_rss_kb()
+    sink = _OutputSink()
+    stdout = sys.stdout
+    sys.stdout = sink
+    start = time.time()
+    try:
+        interp.onecmd(cmd_line)
+    finally:
+        end = time.time()
+        sys.stdout = stdout
+    result = {
+        'case' : case_name,
+        'size' : size,
+        'latency_msecs' : latency * 1000,
+        'command' : cmd_line,
+        'wall_secs' : end - start,
+        'server_secs' : fake.server_time,
+        'client_secs' : end - start - fake.server_time,
+        'first_row_secs' : sink.first_write_time - start
+                        if sink.first_write_time is not None else None,
+        'api_calls' : sum(fake.call_counts.values()),
+        'api_calls_by_action' : dict(fake.call_counts),
+        'response_bytes' : fake.response_bytes,
+        'output_bytes' : sink.n_bytes,
+        'base_rss_kb' : base_rss_kb,
+        'peak_rss_kb' : _max_rss_kb(),
+        }
+    if sink.error is not None:
+        result['error'] = sink.error
+    print json.dumps(result, sort_keys=True)
+
+
+def _spawn_case(case_name, size, latency):
+    """Run a benchmark case in a child process; returns the result
+    dictionary
+    """
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                        '--run-case', case_name, str(size),
+                                        str(latency)],
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        return {
+            'case' : case_name,
+            'size' : size,
+            'command' : dict(CASE_LIST)[case_name],
+            'error' : err.strip().splitlines()[-1] if err.strip() else
+                                "exit status %d" % (proc.returncode,),
+            }
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _result_key(result):
+    return (result['case'], result['size'])
+
+
+def _print_result(result, old_result_map):
+    """Print a line summarizing a benchmark result
+    """
+    if 'error' in result:
+        print "%-14s %7d  ERROR: %s" % (result['case'], result['size'],
+                                                        result['error'])
+        return
+    first_row = result['first_row_secs']
+    line = "%-14s %7d %9.3f %9.3f %9s %7d %9d" % (
+                result['case'], result['size'],
+                result['wall_secs'], result['client_secs'],
+                "%.3f" % (first_row,) if first_row is not None else '-',
+                result['api_calls'], result['peak_rss_kb'])
+    old_result = old_result_map.get(_result_key(result))
+    if old_result is not None and 'error' not in old_result and \
+                                        old_result['client_secs'] > 0:
+        line += " %+7.1f%%" % ((result['client_secs'] /
+                                old_result['client_secs'] - 1) * 100,)
+    print line
+
+
+def _usage(msg=None):
+    if msg:
+        print >> sys.stderr, msg
+    print >> sys.stderr, __doc__
+    sys.exit(1)
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == '--run-case':
+        _run_case(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))
+        return
+    case_name_list = [case_name for case_name, _ in CASE_LIST]
+    size_list = list(DEFAULT_SIZES)
+    report_path = None
+    old_report_path = None
+    latency = 0.0
+    try:
+        opt_list, args = getopt.getopt(sys.argv[1:], "C:c:lo:s:w:")
+    except getopt.GetoptError, ge:
+        _usage(str(ge))
+    if args:
+        _usage("No arguments expected")
+    for opt in opt_list:
+        if opt[0] == '-C':
+            old_report_path = opt[1]
+        elif opt[0] == '-c':
+            case_name_list = opt[1].split(',')
+            for case_name in case_name_list:
+                if case_name not in dict(CASE_LIST):
+                    _usage("Unknown case: %s" % (case_name,))
+        elif opt[0] == '-l':
+            for case_name, cmd_line in CASE_LIST:
+                print "%-14s %s" % (case_name, cmd_line)
+            return
+        elif opt[0] == '-o':
+            report_path = opt[1]
+        elif opt[0] == '-s':
+            try:
+                size_list = [int(size) for size in opt[1].split(',')]
+            except ValueError:
+                _usage("Bad size list: %s" % (opt[1],))
+        elif opt[0] == '-w':
+            try:
+                latency = float(opt[1]) / 1000
+            except ValueError:
+                _usage("Bad latency: %s" % (opt[1],))
+    old_result_map = {}
+    if old_report_path:
+        with open(old_report_path) as old_report_file:
+            old_report = json.load(old_report_file)
+        old_result_map = dict([(_result_key(result), result)
+                                for result in old_report['results']])
+    print "%-14s %7s %9s %9s %9s %7s %9s%s" % ("CASE", "SIZE", "WALL",
+                "CLIENT", "1ST-ROW", "CALLS", "RSS-KB",
+                "   DELTA" if old_result_map else "")
+    result_list = []
+    for size in size_list:
+        for case_name in case_name_list:
+            result = _spawn_case(case_name, size, latency)
+            _print_result(result, old_result_map)
+            result_list.append(result)
+    report = {
+        'timestamp' : time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'results' : result_list,
+        }
+    if report_path:
+        with open(report_path, "w") as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
+            report_file.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1130 @@
+#
+# Copyright 2014-2016 CloudVelox Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains a local stand-in for the EC2 (and VPC), ELB, RDS
+and IAM services, used for benchmarking clsh without an AWS account.
+
+The stand-in replaces the boto method that sends HTTP requests, so
+everything above the network (request construction, XML parsing, object
+construction, clsh processing and rendering) runs unmodified.
+"""
+
+import collections
+import re
+import threading
+import time
+
+from xml.sax.saxutils import escape
+
+import boto.connection
+
+#
+# Value of the Env tag of the resources that the bulk delete benchmarks
+# operate on (every 10th resource)
+#
+DELETE_ENV = 'bench-delete'
+
+_OWNER_ID = '123456789012'
+_VPC_ID = 'vpc-0b0b0b0b'
+_ZONE_LIST = ['us-east-1a', 'us-east-1b', 'us-east-1c']
+_SUBNET_COUNT = 16
+_TIME = '2016-01-01T00:00:00.000Z'
+
+_FILTER_NAME_RE = re.compile(r'^Filter\.(\d+)\.Name$')
+_FILTER_VALUE_RE = re.compile(r'^Filter\.(\d+)\.Value\.\d+$')
+
+
+class _Response(object):
+    """What boto expects from an httplib.HTTPResponse
+    """
+    def __init__(self, status, body):
+        self.status = status
+        self.reason = 'OK' if status == 200 else 'Error'
+        self.msg = {}
+        self.__body = body
+
+    def read(self, amt=None):
+        return self.__body
+
+    def getheader(self, name, default=None):
+        return default
+
+    def getheaders(self):
+        return []
+
+
+class _ServiceError(Exception):
+    """Raised by the request handlers to return an error to the client
+    """
+    def __init__(self, code, msg, status=400):
+        Exception.__init__(self, msg)
+        self.code = code
+        self.status = status
+
+
+def _tag_set_xml(tag_dict):
+    """Returns the tagSet XML element for tag_dict
+    """
+    return '<tagSet>%s</tagSet>' % ''.join(
+                ['<item><key>%s</key><value>%s</value></item>' %
+                        (escape(key), escape(value))
+                        for key, value in sorted(tag_dict.iteritems())])
+
+
+def _param_list(params, prefix):
+    """Returns the list of values of the numbered parameters
+    prefix.1, prefix.2, ...
+    """
+    value_list = []
+    n = 1
+    while True:
+        value = params.get('%s.%d' % (prefix, n))
+        if value is None:
+            return value_list
+        value_list.append(value)
+        n += 1
+
+
+def _parse_filters(params):
+    """Returns a dictionary mapping filter names to sets of values
+    """
+    name_map = {}
+    value_map = collections.defaultdict(set)
+    for key, value in params.iteritems():
+        match = _FILTER_NAME_RE.match(key)
+        if match:
+            name_map[match.group(1)] = value
+            continue
+        match = _FILTER_VALUE_RE.match(key)
+        if match:
+            value_map[match.group(1)].add(value)
+    return dict([(name, value_map[num]) for num, name in name_map.items()])
+
+
+def _cidr_range(cidr):
+    """Returns the first and last (integer) addresses of a CIDR block
+    """
+    ip_str, len_str = cidr.split('/')
+    first = reduce(lambda addr, octet: (addr << 8) | int(octet),
+                                                    ip_str.split('.'), 0)
+    return first, first + (1 << (32 - int(len_str))) - 1
+
+
+class _Resource(object):
+    """A synthetic resource
+    """
+    def __init__(self, res_id, res_type, attr_dict, tag_dict):
+        self.id = res_id
+        self.res_type = res_type
+        #
+        # The attribute dictionary holds the attributes that may be used
+        # in filters (keyed by filter name), and anything else needed
+        # to render the resource.
+        #
+        self.attrs = attr_dict
+        self.tags = tag_dict
+
+    def matches(self, filter_map):
+        """Returns True if the resource matches all filters
+        """
+        for name, value_set in filter_map.iteritems():
+            if name.startswith('tag:'):
+                if self.tags.get(name[4:]) not in value_set:
+                    return False
+            elif name == 'tag-key':
+                if not value_set.intersection(self.tags):
+                    return False
+            elif name == 'tag-value':
+                if not value_set.intersection(self.tags.values()):
+                    return False
+            elif name == self.res_type + '-id' and name not in self.attrs:
+                if self.id not in value_set:
+                    return False
+            elif name in self.attrs:
+                if self.attrs[name] not in value_set:
+                    return False
+            else:
+                raise _ServiceError('InvalidParameterValue',
+                                "The filter '%s' is invalid" % (name,))
+        return True
+
+
+class FakeAccount(object):
+    """A synthetic AWS account holding n_resources of each resource type
+    """
+    def __init__(self, n_resources):
+        self.n_resources = n_resources
+        #
+        # Key: resource type
+        # Value: OrderedDict mapping resource ids to _Resource objects
+        #
+        self.resources = collections.defaultdict(collections.OrderedDict)
+        self.__populate(n_resources)
+
+    @staticmethod
+    def __tags(res_type, i):
+        """Returns the tags of the i-th resource of the specified type
+        """
+        return {
+                'Name' : 'bench-%s-%d' % (res_type, i),
+                'Env' : DELETE_ENV if i % 10 == 0 else
+                                        ('prod', 'test', 'dev')[i % 3],
+                'Owner' : 'team-%d' % (i % 7,),
+                }
+
+    def __add(self, res_type, res_id, attr_dict, tagged=True):
+        """Add a resource to the account
+        """
+        i = len(self.resources[res_type])
+        tag_dict = self.__tags(res_type, i) if tagged else {}
+        self.resources[res_type][res_id] = \
+                        _Resource(res_id, res_type, attr_dict, tag_dict)
+
+    def __populate(self, n):
+        """Create n resources of each type
+        """
+        for i in xrange(_SUBNET_COUNT):
+            self.__add('subnet', 'subnet-%08x' % (i,), {
+                        'vpc-id' : _VPC_ID,
+                        'cidr-block' : '10.%d.0.0/16' % (i,),
+                        'availability-zone' : _ZONE_LIST[i % len(_ZONE_LIST)],
+                        }, tagged=False)
+        for i in xrange(n):
+            zone = _ZONE_LIST[i % len(_ZONE_LIST)]
+            instance_id = 'i-%08x' % (i,)
+            volume_id = 'vol-%08x' % (i,)
+            #
+            # The address is in the subnet, after the reserved addresses;
+            # every fourth interface also has a secondary address
+            #
+            subnet_index = i % _SUBNET_COUNT
+            private_ip = '10.%d.%d.%d' % (subnet_index,
+                                        ((i + 4) >> 8) & 127, (i + 4) & 255)
+            if i % 4 == 1:
+                secondary_ip_list = ['10.%d.%d.%d' % (subnet_index,
+                                128 + (((i + 4) >> 8) & 127), (i + 4) & 255)]
+            else:
+                secondary_ip_list = []
+            self.__add('security-group', 'sg-%08x' % (i,), {
+                        'group-name' : 'bench-sg-%d' % (i,),
+                        'vpc-id' : _VPC_ID,
+                        })
+            self.__add('instance', instance_id, {
+                        'instance-state-name' :
+                                'stopped' if i % 5 == 0 else 'running',
+                        'availability-zone' : zone,
+                        'vpc-id' : _VPC_ID,
+                        'subnet-id' : 'subnet-%08x' % (subnet_index,),
+                        'private-ip-address' : private_ip,
+                        'group-id' : 'sg-%08x' % (i,),
+                        'volume-id' : volume_id,
+                        })
+            self.__add('volume', volume_id, {
+                        'status' : 'in-use' if i % 2 == 0 else 'available',
+                        'availability-zone' : zone,
+                        'size' : str(8 + i % 100),
+                        'snapshot-id' : 'snap-%08x' % (i,),
+                        'attachment.instance-id' :
+                                instance_id if i % 2 == 0 else None,
+                        })
+            self.__add('snapshot', 'snap-%08x' % (i,), {
+                        'status' : 'completed',
+                        'volume-id' : volume_id,
+                        'volume-size' : str(8 + i % 100),
+                        'owner-id' : _OWNER_ID,
+                        })
+            self.__add('image', 'ami-%08x' % (i,), {
+                        'state' : 'available',
+                        'name' : 'bench-ami-%d' % (i,),
+                        'snapshot-id' : 'snap-%08x' % (i,),
+                        'owner-id' : _OWNER_ID,
+                        })
+            self.__add('load-balancer', 'bench-elb-%d' % (i,), {
+                        'instance-id' : instance_id,
+                        }, tagged=False)
+            #
+            # Every third interface is detached; the addresses are,
+            # in turn, unassociated, or associated with an interface
+            # or (directly) with an instance
+            #
+            eni_id = 'eni-%08x' % (i,)
+            self.__add('network-interface', eni_id, {
+                        'status' : 'available' if i % 3 == 0 else 'in-use',
+                        'attachment.instance-id' :
+                                None if i % 3 == 0 else instance_id,
+                        'availability-zone' : zone,
+                        'vpc-id' : _VPC_ID,
+                        'subnet-id' : 'subnet-%08x' % (subnet_index,),
+                        'group-id' : 'sg-%08x' % (i,),
+                        'private-ip-address' : private_ip,
+                        'secondary-private-ip-addresses' : secondary_ip_list,
+                        })
+            self.__add('address', 'eipalloc-%08x' % (i,), {
+                        'public-ip' : '54.%d.%d.%d' %
+                                ((i >> 16) & 255, (i >> 8) & 255, i & 255),
+                        'network-interface-id' :
+                                eni_id if i % 4 in (1, 3) else None,
+                        'instance-id' : instance_id if i % 4 == 2 else None,
+                        }, tagged=False)
+            self.__add('db-instance', 'bench-db-%d' % (i,), {
+                        'zone' : zone,
+                        'status' : 'available',
+                        }, tagged=False)
+            self.__add('db-security-group', 'bench-dbsg-%d' % (i,), {},
+                                                                tagged=False)
+            self.__add('db-subnet-group', 'bench-dbsubnetg-%d' % (i,), {
+                        'subnet-id' : 'subnet-%08x' % (i % _SUBNET_COUNT,),
+                        }, tagged=False)
+            self.__add('user', 'bench-user-%d' % (i,), {
+                        'user-id' : 'AIDA%016X' % (i,),
+                        }, tagged=False)
+
+    def select(self, res_type, id_list, filter_map):
+        """Returns the list of resources of the specified type that have
+        one of the ids in id_list (if not empty) and match the filters
+        """
+        res_map = self.resources[res_type]
+        if id_list:
+            res_list = []
+            for res_id in id_list:
+                if res_id not in res_map:
+                    raise _ServiceError('Invalid%s.NotFound' %
+                                (res_type.title().replace('-', ''),),
+                                "The id '%s' does not exist" % (res_id,))
+                res_list.append(res_map[res_id])
+        else:
+            res_list = res_map.values()
+        if filter_map:
+            res_list = [res for res in res_list if res.matches(filter_map)]
+        return res_list
+
+    def create(self, res_type, id_prefix, attr_dict):
+        """Create a resource with the next id of its type; returns the
+        resource
+        """
+        res_id = '%s-%08x' % (id_prefix, len(self.resources[res_type]))
+        self.__add(res_type, res_id, attr_dict, tagged=False)
+        return self.resources[res_type][res_id]
+
+    def remove(self, res_type, res_id):
+        """Remove the specified resource
+        """
+        if self.resources[res_type].pop(res_id, None) is None:
+            raise _ServiceError('Invalid%s.NotFound' %
+                                (res_type.title().replace('-', ''),),
+                                "The id '%s' does not exist" % (res_id,))
+
+
+def _paginate(res_list, params, token_name='NextToken',
+                                max_name='MaxResults', default_max=None):
+    """Returns the tuple (page, next_token) for the requested page;
+    default_max is the page size used by AWS when the request does not
+    specify one
+    """
+    offset = int(params.get(token_name) or 0)
+    max_results = params.get(max_name, default_max)
+    if max_results is None:
+        return res_list[offset:], None
+    end = offset + int(max_results)
+    if end >= len(res_list):
+        return res_list[offset:], None
+    return res_list[offset:end], str(end)
+
+
+class _EC2Handlers(object):
+    """Request handlers of the EC2 (and VPC) service
+    """
+    def __init__(self, account):
+        self.__account = account
+        self.__lock = threading.Lock()
+
+    def __describe(self, res_type, params, id_prefix):
+        account = self.__account
+        return account.select(res_type, _param_list(params, id_prefix),
+                                                _parse_filters(params))
+
+    @staticmethod
+    def __wrap(action, body, next_token=None):
+        if next_token is not None:
+            body += '<nextToken>%s</nextToken>' % (next_token,)
+        return '<%sResponse><requestId>bench</requestId>%s</%sResponse>' % \
+                                                (action, body, action)
+
+    def DescribeInstances(self, params):
+        inst_list = self.__describe('instance', params, 'InstanceId')
+        page, next_token = _paginate(inst_list, params)
+        item_list = []
+        for inst in page:
+            attrs = inst.attrs
+            state = attrs['instance-state-name']
+            item_list.append(
+                '<item><reservationId>r-%s</reservationId>'
+                '<ownerId>%s</ownerId><groupSet/><instancesSet><item>'
+                '<instanceId>%s</instanceId><imageId>ami-00000000</imageId>'
+                '<instanceState><code>%d</code><name>%s</name></instanceState>'
+                '<privateDnsName>ip-%s.ec2.internal</privateDnsName>'
+                '<dnsName/><keyName>bench-key</keyName>'
+                '<amiLaunchIndex>0</amiLaunchIndex>'
+                '<instanceType>m4.large</instanceType>'
+                '<launchTime>%s</launchTime>'
+                '<placement><availabilityZone>%s</availabilityZone>'
+                '<tenancy>default</tenancy></placement>'
+                '<monitoring><state>disabled</state></monitoring>'
+                '<subnetId>%s</subnetId><vpcId>%s</vpcId>'
+                '<privateIpAddress>%s</privateIpAddress>'
+                '<sourceDestCheck>true</sourceDestCheck>'
+                '<groupSet><item><groupId>%s</groupId>'
+                '<groupName>bench-sg</groupName></item></groupSet>'
+                '<architecture>x86_64</architecture>'
+                '<rootDeviceType>ebs</rootDeviceType>'
+                '<rootDeviceName>/dev/xvda</rootDeviceName>'
+                '<blockDeviceMapping><item><deviceName>/dev/xvda</deviceName>'
+                '<ebs><volumeId>%s</volumeId><status>attached</status>'
+                '<attachTime>%s</attachTime>'
+                '<deleteOnTermination>true</deleteOnTermination></ebs>'
+                '</item></blockDeviceMapping>'
+                '<virtualizationType>hvm</virtualizationType>'
+                '<hypervisor>xen</hypervisor>%s'
+                '<ebsOptimized>false</ebsOptimized>'
+                '</item></instancesSet></item>' %
+                    (inst.id[2:], _OWNER_ID, inst.id,
+                    16 if state == 'running' else 80, state,
+                    attrs['private-ip-address'].replace('.', '-'),
+                    _TIME, attrs['availability-zone'],
+                    attrs['subnet-id'], attrs['vpc-id'],
+                    attrs['private-ip-address'], attrs['group-id'],
+                    attrs['volume-id'], _TIME, _tag_set_xml(inst.tags)))
+        return self.__wrap('DescribeInstances',
+                '<reservationSet>%s</reservationSet>' % ''.join(item_list),
+                next_token)
+
+    def DescribeVolumes(self, params):
+        vol_list = self.__describe('volume', params, 'VolumeId')
+        page, next_token = _paginate(vol_list, params)
+        item_list = []
+        for vol in page:
+            attrs = vol.attrs
+            instance_id = attrs['attachment.instance-id']
+            if instance_id:
+                attach_xml = ('<item><volumeId>%s</volumeId>'
+                        '<instanceId>%s</instanceId><device>/dev/xvda</device>'
+                        '<status>attached</status><attachTime>%s</attachTime>'
+                        '<deleteOnTermination>true</deleteOnTermination>'
+                        '</item>' % (vol.id, instance_id, _TIME))
+            else:
+                attach_xml = ''
+            item_list.append(
+                '<item><volumeId>%s</volumeId><size>%s</size>'
+                '<snapshotId>%s</snapshotId>'
+                '<availabilityZone>%s</availabilityZone>'
+                '<status>%s</status><createTime>%s</createTime>'
+                '<attachmentSet>%s</attachmentSet>%s'
+                '<volumeType>gp2</volumeType><iops>100</iops>'
+                '<encrypted>false</encrypted></item>' %
+                    (vol.id, attrs['size'], attrs['snapshot-id'],
+                    attrs['availability-zone'], attrs['status'], _TIME,
+                    attach_xml, _tag_set_xml(vol.tags)))
+        return self.__wrap('DescribeVolumes',
+                '<volumeSet>%s</volumeSet>' % ''.join(item_list), next_token)
+
+    def DescribeSnapshots(self, params):
+        snap_list = self.__describe('snapshot', params, 'SnapshotId')
+        page, next_token = _paginate(snap_list, params)
+        item_list = []
+        for snap in page:
+            attrs = snap.attrs
+            item_list.append(
+                '<item><snapshotId>%s</snapshotId><volumeId>%s</volumeId>'
+                '<status>%s</status><startTime>%s</startTime>'
+                '<progress>100%%</progress><ownerId>%s</ownerId>'
+                '<volumeSize>%s</volumeSize>'
+                '<description>Created for %s</description>'
+                '<encrypted>false</encrypted>%s</item>' %
+                    (snap.id, attrs['volume-id'], attrs['status'], _TIME,
+                    attrs['owner-id'], attrs['volume-size'],
+                    attrs['volume-id'], _tag_set_xml(snap.tags)))
+        return self.__wrap('DescribeSnapshots',
+                '<snapshotSet>%s</snapshotSet>' % ''.join(item_list),
+                next_token)
+
+    def DescribeSnapshotAttribute(self, params):
+        return self.__wrap('DescribeSnapshotAttribute',
+                '<snapshotId>%s</snapshotId>'
+                '<createVolumePermission/>' % (params.get('SnapshotId'),))
+
+    def DescribeImages(self, params):
+        image_list = self.__describe('image', params, 'ImageId')
+        item_list = []
+        for image in image_list:
+            attrs = image.attrs
+            item_list.append(
+                '<item><imageId>%s</imageId>'
+                '<imageLocation>%s/%s</imageLocation>'
+                '<imageState>%s</imageState><imageOwnerId>%s</imageOwnerId>'
+                '<creationDate>%s</creationDate>'
+                '<isPublic>false</isPublic><architecture>x86_64</architecture>'
+                '<imageType>machine</imageType><name>%s</name>'
+                '<rootDeviceType>ebs</rootDeviceType>'
+                '<rootDeviceName>/dev/xvda</rootDeviceName>'
+                '<blockDeviceMapping><item><deviceName>/dev/xvda</deviceName>'
+                '<ebs><snapshotId>%s</snapshotId><volumeSize>8</volumeSize>'
+                '<deleteOnTermination>true</deleteOnTermination>'
+                '<volumeType>gp2</volumeType></ebs></item>'
+                '</blockDeviceMapping>'
+                '<virtualizationType>hvm</virtualizationType>'
+                '<hypervisor>xen</hypervisor>%s</item>' %
+                    (image.id, _OWNER_ID, attrs['name'], attrs['state'],
+                    attrs['owner-id'], _TIME, attrs['name'],
+                    attrs['snapshot-id'], _tag_set_xml(image.tags)))
+        return self.__wrap('DescribeImages',
+                '<imagesSet>%s</imagesSet>' % ''.join(item_list))
+
+    def DescribeSecurityGroups(self, params):
+        sg_list = self.__describe('security-group', params, 'GroupId')
+        item_list = []
+        for sg in sg_list:
+            attrs = sg.attrs
+            item_list.append(
+                '<item><ownerId>%s</ownerId><groupId>%s</groupId>'
+                '<groupName>%s</groupName>'
+                '<groupDescription>Benchmark group</groupDescription>'
+                '<vpcId>%s</vpcId><ipPermissions>'
+                '<item><ipProtocol>tcp</ipProtocol><fromPort>22</fromPort>'
+                '<toPort>22</toPort><groups/><ipRanges><item>'
+                '<cidrIp>10.0.0.0/8</cidrIp></item></ipRanges></item>'
+                '<item><ipProtocol>tcp</ipProtocol><fromPort>443</fromPort>'
+                '<toPort>443</toPort><groups><item><userId>%s</userId>'
+                '<groupId>%s</groupId></item></groups><ipRanges/></item>'
+                '</ipPermissions><ipPermissionsEgress><item>'
+                '<ipProtocol>-1</ipProtocol><groups/><ipRanges><item>'
+                '<cidrIp>0.0.0.0/0</cidrIp></item></ipRanges></item>'
+                '</ipPermissionsEgress>%s</item>' %
+                    (_OWNER_ID, sg.id, attrs['group-name'], attrs['vpc-id'],
+                    _OWNER_ID, sg.id, _tag_set_xml(sg.tags)))
+        return self.__wrap('DescribeSecurityGroups',
+                '<securityGroupInfo>%s</securityGroupInfo>' %
+                                                        ''.join(item_list))
+
+    def DescribeTags(self, params):
+        filter_map = _parse_filters(params)
+        type_set = filter_map.pop('resource-type', None)
+        id_set = filter_map.pop('resource-id', None)
+        key_set = filter_map.pop('key', None)
+        value_set = filter_map.pop('value', None)
+        if filter_map:
+            raise _ServiceError('InvalidParameterValue',
+                        "The filter '%s' is invalid" % (filter_map.keys()[0],))
+        tag_list = []
+        for res_type in ('instance', 'volume', 'snapshot', 'image',
+                                                        'security-group'):
+            if type_set is not None and res_type not in type_set:
+                continue
+            for res in self.__account.resources[res_type].itervalues():
+                if id_set is not None and res.id not in id_set:
+                    continue
+                for key, value in sorted(res.tags.iteritems()):
+                    if key_set is not None and key not in key_set:
+                        continue
+                    if value_set is not None and value not in value_set:
+                        continue
+                    tag_list.append((res.id, res_type, key, value))
+        page, next_token = _paginate(tag_list, params)
+        return self.__wrap('DescribeTags', '<tagSet>%s</tagSet>' % ''.join(
+                    ['<item><resourceId>%s</resourceId>'
+                    '<resourceType>%s</resourceType><key>%s</key>'
+                    '<value>%s</value></item>' %
+                        (res_id, res_type, escape(key), escape(value))
+                        for res_id, res_type, key, value in page]),
+                    next_token)
+
+    @staticmethod
+    def __subnet_xml(subnet):
+        attrs = subnet.attrs
+        prefix_len = int(attrs['cidr-block'].split('/')[1])
+        return ('<item><subnetId>%s</subnetId>'
+                '<state>available</state><vpcId>%s</vpcId>'
+                '<cidrBlock>%s</cidrBlock>'
+                '<availableIpAddressCount>%d</availableIpAddressCount>'
+                '<availabilityZone>%s</availabilityZone>'
+                '<defaultForAz>false</defaultForAz>'
+                '<mapPublicIpOnLaunch>false</mapPublicIpOnLaunch></item>' %
+                    (subnet.id, attrs['vpc-id'], attrs['cidr-block'],
+                    (1 << (32 - prefix_len)) - 5,
+                    attrs['availability-zone']))
+
+    def DescribeSubnets(self, params):
+        subnet_list = self.__describe('subnet', params, 'SubnetId')
+        return self.__wrap('DescribeSubnets',
+                '<subnetSet>%s</subnetSet>' % ''.join(
+                    [self.__subnet_xml(subnet) for subnet in subnet_list]))
+
+    def CreateSubnet(self, params):
+        """The subnet must be in the 10.0.0.0/8 block of the VPC, and must
+        not overlap the other subnets
+        """
+        if params.get('VpcId') != _VPC_ID:
+            raise _ServiceError('InvalidVpcID.NotFound',
+                "The vpc ID '%s' does not exist" % (params.get('VpcId'),))
+        cidr = params['CidrBlock']
+        first, last = _cidr_range(cidr)
+        if first >> 24 != 10:
+            raise _ServiceError('InvalidSubnet.Range',
+                                "The CIDR '%s' is invalid." % (cidr,))
+        with self.__lock:
+            for subnet in self.__account.resources['subnet'].itervalues():
+                net_first, net_last = _cidr_range(subnet.attrs['cidr-block'])
+                if first <= net_last and net_first <= last:
+                    raise _ServiceError('InvalidSubnet.Conflict',
+                                "The CIDR '%s' conflicts with another "
+                                "subnet" % (cidr,))
+            subnet = self.__account.create('subnet', 'subnet', {
+                        'vpc-id' : _VPC_ID,
+                        'cidr-block' : cidr,
+                        'availability-zone' : params.get('AvailabilityZone',
+                                                                _ZONE_LIST[0]),
+                        })
+        return self.__wrap('CreateSubnet',
+                '<subnet>%s</subnet>' % (self.__subnet_xml(subnet)[6:-7],))
+
+    def DescribeVpcs(self, params):
+        for vpc_id in _param_list(params, 'VpcId'):
+            if vpc_id != _VPC_ID:
+                raise _ServiceError('InvalidVpcID.NotFound',
+                            "The vpc ID '%s' does not exist" % (vpc_id,))
+        return self.__wrap('DescribeVpcs',
+                '<vpcSet><item><vpcId>%s</vpcId><state>available</state>'
+                '<cidrBlock>10.0.0.0/8</cidrBlock>'
+                '<dhcpOptionsId>dopt-00000000</dhcpOptionsId>'
+                '<instanceTenancy>default</instanceTenancy>'
+                '<isDefault>false</isDefault></item></vpcSet>' % (_VPC_ID,))
+
+    def DescribeNetworkInterfaces(self, params):
+        eni_list = self.__describe('network-interface', params,
+                                                    'NetworkInterfaceId')
+        item_list = []
+        for eni in eni_list:
+            attrs = eni.attrs
+            instance_id = attrs['attachment.instance-id']
+            if instance_id:
+                attachment_xml = ('<attachment><attachmentId>eni-attach-%s'
+                        '</attachmentId><instanceId>%s</instanceId>'
+                        '<instanceOwnerId>%s</instanceOwnerId>'
+                        '<deviceIndex>0</deviceIndex><status>attached'
+                        '</status><attachTime>%s</attachTime>'
+                        '<deleteOnTermination>true</deleteOnTermination>'
+                        '</attachment>' %
+                            (eni.id[4:], instance_id, _OWNER_ID, _TIME))
+            else:
+                attachment_xml = ''
+            item_list.append(
+                '<item><networkInterfaceId>%s</networkInterfaceId>'
+                '<subnetId>%s</subnetId><vpcId>%s</vpcId>'
+                '<availabilityZone>%s</availabilityZone><description/>'
+                '<ownerId>%s</ownerId><requesterManaged>false'
+                '</requesterManaged><status>%s</status>'
+                '<macAddress>02:00:00:00:00:00</macAddress>'
+                '<privateIpAddress>%s</privateIpAddress>'
+                '<sourceDestCheck>true</sourceDestCheck>'
+                '<groupSet><item><groupId>%s</groupId>'
+                '<groupName>bench-sg</groupName></item></groupSet>%s'
+                '<tagSet/><privateIpAddressesSet>%s</privateIpAddressesSet>'
+                '</item>' %
+                    (eni.id, attrs['subnet-id'], attrs['vpc-id'],
+                    attrs['availability-zone'], _OWNER_ID, attrs['status'],
+                    attrs['private-ip-address'], attrs['group-id'],
+                    attachment_xml, ''.join(
+                        ['<item><privateIpAddress>%s</privateIpAddress>'
+                        '<primary>%s</primary></item>' %
+                            (private_ip, 'true' if primary else 'false')
+                            for private_ip, primary in
+                                [(attrs['private-ip-address'], True)] +
+                                [(secondary_ip, False) for secondary_ip in
+                                    attrs['secondary-private-ip-addresses']]
+                        ])))
+        return self.__wrap('DescribeNetworkInterfaces',
+                '<networkInterfaceSet>%s</networkInterfaceSet>' %
+                                                        (''.join(item_list),))
+
+    def DescribeAddresses(self, params):
+        address_list = self.__describe('address', params, 'AllocationId')
+        public_ip_list = _param_list(params, 'PublicIp')
+        if public_ip_list:
+            address_list = [address for address in address_list
+                            if address.attrs['public-ip'] in public_ip_list]
+        item_list = []
+        for address in address_list:
+            attrs = address.attrs
+            eni_id = attrs['network-interface-id']
+            instance_id = attrs['instance-id']
+            if eni_id is not None:
+                #
+                # AWS reports the instance of an attached interface
+                #
+                eni = self.__account.resources['network-interface'][eni_id]
+                instance_id = eni.attrs['attachment.instance-id']
+            association_xml = ''
+            if eni_id or instance_id:
+                association_xml = ('<associationId>eipassoc-%s'
+                                        '</associationId>' % (address.id[9:],))
+            if instance_id:
+                association_xml += '<instanceId>%s</instanceId>' % \
+                                                            (instance_id,)
+            if eni_id:
+                association_xml += ('<networkInterfaceId>%s'
+                        '</networkInterfaceId><networkInterfaceOwnerId>%s'
+                        '</networkInterfaceOwnerId>' % (eni_id, _OWNER_ID))
+            item_list.append('<item><publicIp>%s</publicIp>'
+                '<allocationId>%s</allocationId><domain>vpc</domain>%s'
+                '</item>' % (attrs['public-ip'], address.id, association_xml))
+        return self.__wrap('DescribeAddresses',
+                '<addressesSet>%s</addressesSet>' % (''.join(item_list),))
+
+    def DescribeRouteTables(self, params):
+        """There are two route tables: the main one, routing to an
+        internet gateway, and one for the second half of the subnets,
+        routing through a NAT instance
+        """
+        def route_xml(cidr, target_tag, target_id):
+            return ('<item><destinationCidrBlock>%s</destinationCidrBlock>'
+                    '<%s>%s</%s><state>active</state>'
+                    '<origin>CreateRoute</origin></item>' %
+                            (cidr, target_tag, target_id, target_tag))
+
+        main_xml = ('<item><routeTableId>rtb-00000000</routeTableId>'
+                    '<vpcId>%s</vpcId><routeSet>%s%s</routeSet>'
+                    '<associationSet><item><routeTableAssociationId>'
+                    'rtbassoc-00000000</routeTableAssociationId>'
+                    '<routeTableId>rtb-00000000</routeTableId><main>true'
+                    '</main></item></associationSet><tagSet/></item>' %
+                    (_VPC_ID, route_xml('10.0.0.0/8', 'gatewayId', 'local'),
+                    route_xml('0.0.0.0/0', 'gatewayId', 'igw-00000000')))
+        assoc_list = ['<item><routeTableAssociationId>rtbassoc-%08x'
+                    '</routeTableAssociationId><routeTableId>rtb-00000001'
+                    '</routeTableId><subnetId>subnet-%08x</subnetId>'
+                    '<main>false</main></item>' % (i, i)
+                        for i in xrange(_SUBNET_COUNT / 2, _SUBNET_COUNT)]
+        private_xml = ('<item><routeTableId>rtb-00000001</routeTableId>'
+                    '<vpcId>%s</vpcId><routeSet>%s%s%s%s</routeSet>'
+                    '<associationSet>%s</associationSet><tagSet/></item>' %
+                    (_VPC_ID, route_xml('10.0.0.0/8', 'gatewayId', 'local'),
+                    route_xml('0.0.0.0/0', 'instanceId', 'i-00000001'),
+                    route_xml('192.168.0.0/16', 'vpcPeeringConnectionId',
+                                                        'pcx-00000000'),
+                    route_xml('192.168.4.0/24', 'networkInterfaceId',
+                                                        'eni-00000004'),
+                    ''.join(assoc_list)))
+        return self.__wrap('DescribeRouteTables',
+                '<routeTableSet>%s%s</routeTableSet>' %
+                                                    (main_xml, private_xml))
+
+    def DescribeNetworkAcls(self, params):
+        """There are two network ACLs: the default one, allowing all
+        traffic, and a restrictive one for the last quarter of the subnets
+        """
+        def entry_xml(rule_number, egress, proto, port_range, action, cidr):
+            if port_range is not None:
+                port_xml = '<portRange><from>%d</from><to>%d</to>' \
+                                        '</portRange>' % port_range
+            else:
+                port_xml = ''
+            return ('<item><ruleNumber>%d</ruleNumber>'
+                    '<protocol>%s</protocol><ruleAction>%s</ruleAction>'
+                    '<egress>%s</egress><cidrBlock>%s</cidrBlock>%s</item>' %
+                        (rule_number, proto, action,
+                        'true' if egress else 'false', cidr, port_xml))
+
+        def nacl_xml(nacl_id, default, entry_list, subnet_range):
+            return ('<item><networkAclId>%s</networkAclId><vpcId>%s</vpcId>'
+                    '<default>%s</default><entrySet>%s</entrySet>'
+                    '<associationSet>%s</associationSet><tagSet/></item>' %
+                        (nacl_id, _VPC_ID, default, ''.join(entry_list),
+                        ''.join(['<item><networkAclAssociationId>'
+                            'aclassoc-%08x</networkAclAssociationId>'
+                            '<networkAclId>%s</networkAclId>'
+                            '<subnetId>subnet-%08x</subnetId></item>' %
+                                (i, nacl_id, i) for i in subnet_range])))
+
+        default_entry_list = []
+        for egress in (False, True):
+            default_entry_list.append(entry_xml(100, egress, '-1', None,
+                                                    'allow', '0.0.0.0/0'))
+            default_entry_list.append(entry_xml(32767, egress, '-1', None,
+                                                    'deny', '0.0.0.0/0'))
+        private_entry_list = [
+            entry_xml(100, False, '6', (443, 443), 'allow', '10.0.0.0/8'),
+            entry_xml(110, False, '6', (22, 22), 'deny', '10.0.0.0/8'),
+            entry_xml(120, False, '6', (1024, 65535), 'allow', '0.0.0.0/0'),
+            entry_xml(32767, False, '-1', None, 'deny', '0.0.0.0/0'),
+            entry_xml(100, True, '6', (1024, 65535), 'allow', '10.0.0.0/8'),
+            entry_xml(110, True, '6', (443, 443), 'allow', '0.0.0.0/0'),
+            entry_xml(32767, True, '-1', None, 'deny', '0.0.0.0/0'),
+            ]
+        private_start = _SUBNET_COUNT * 3 / 4
+        nacl_map = {
+            'acl-00000000' : nacl_xml('acl-00000000', 'true',
+                            default_entry_list, xrange(private_start)),
+            'acl-00000001' : nacl_xml('acl-00000001', 'false',
+                            private_entry_list,
+                            xrange(private_start, _SUBNET_COUNT)),
+            }
+        nacl_id_list = _param_list(params, 'NetworkAclId') or \
+                                                        sorted(nacl_map)
+        return self.__wrap('DescribeNetworkAcls',
+                '<networkAclSet>%s</networkAclSet>' % ''.join(
+                    [nacl_map[nacl_id] for nacl_id in nacl_id_list
+                                                if nacl_id in nacl_map]))
+
+    #
+    # There are no resources of the following types
+    #
+    def DescribeInternetGateways(self, params):
+        return self.__wrap('DescribeInternetGateways',
+                                '<internetGatewaySet/>')
+
+    def DescribeAvailabilityZones(self, params):
+        return self.__wrap('DescribeAvailabilityZones',
+                '<availabilityZoneInfo>%s</availabilityZoneInfo>' % ''.join(
+                    ['<item><zoneName>%s</zoneName>'
+                    '<zoneState>available</zoneState>'
+                    '<regionName>us-east-1</regionName><messageSet/></item>' %
+                        (zone,) for zone in _ZONE_LIST]))
+
+    def __tag_update(self, action, params, create):
+        res_id_list = _param_list(params, 'ResourceId')
+        tag_dict = {}
+        n = 1
+        while ('Tag.%d.Key' % (n,)) in params:
+            tag_dict[params['Tag.%d.Key' % (n,)]] = \
+                                params.get('Tag.%d.Value' % (n,))
+            n += 1
+        res_map = {}
+        for res_type_map in self.__account.resources.itervalues():
+            for res_id in res_id_list:
+                if res_id in res_type_map:
+                    res_map[res_id] = res_type_map[res_id]
+        for res_id in res_id_list:
+            res = res_map.get(res_id)
+            if res is None:
+                continue
+            for key, value in tag_dict.iteritems():
+                if create:
+                    res.tags[key] = value or ''
+                elif value is None or res.tags.get(key) == value:
+                    res.tags.pop(key, None)
+        return self.__wrap(action, '<return>true</return>')
+
+    def CreateTags(self, params):
+        return self.__tag_update('CreateTags', params, True)
+
+    def DeleteTags(self, params):
+        return self.__tag_update('DeleteTags', params, False)
+
+    def DeleteVolume(self, params):
+        self.__account.remove('volume', params.get('VolumeId'))
+        return self.__wrap('DeleteVolume', '<return>true</return>')
+
+    def DeleteSnapshot(self, params):
+        self.__account.remove('snapshot', params.get('SnapshotId'))
+        return self.__wrap('DeleteSnapshot', '<return>true</return>')
+
+    def DeregisterImage(self, params):
+        self.__account.remove('image', params.get('ImageId'))
+        return self.__wrap('DeregisterImage', '<return>true</return>')
+
+    def TerminateInstances(self, params):
+        item_list = []
+        for instance_id in _param_list(params, 'InstanceId'):
+            self.__account.remove('instance', instance_id)
+            item_list.append('<item><instanceId>%s</instanceId>'
+                '<currentState><code>32</code><name>shutting-down</name>'
+                '</currentState><previousState><code>16</code>'
+                '<name>running</name></previousState></item>' %
+                                                        (instance_id,))
+        return self.__wrap('TerminateInstances',
+                '<instancesSet>%s</instancesSet>' % ''.join(item_list))
+
+
+class _ELBHandlers(object):
+    """Request handlers of the ELB service
+    """
+    def __init__(self, account):
+        self.__account = account
+
+    def DescribeLoadBalancers(self, params):
+        elb_list = self.__account.select('load-balancer',
+                        _param_list(params, 'LoadBalancerNames.member'), None)
+        page, next_marker = _paginate(elb_list, params,
+                                        'Marker', 'PageSize', 400)
+        member_list = []
+        for elb in page:
+            member_list.append(
+                '<member><LoadBalancerName>%s</LoadBalancerName>'
+                '<DNSName>%s.us-east-1.elb.amazonaws.com</DNSName>'
+                '<CanonicalHostedZoneName>%s.us-east-1.elb.amazonaws.com'
+                '</CanonicalHostedZoneName><CreatedTime>%s</CreatedTime>'
+                '<ListenerDescriptions><member><Listener>'
+                '<Protocol>HTTP</Protocol><LoadBalancerPort>80'
+                '</LoadBalancerPort><InstanceProtocol>HTTP</InstanceProtocol>'
+                '<InstancePort>80</InstancePort></Listener><PolicyNames/>'
+                '</member></ListenerDescriptions>'
+                '<Policies><AppCookieStickinessPolicies/>'
+                '<LBCookieStickinessPolicies/><OtherPolicies/></Policies>'
+                '<SourceSecurityGroup><OwnerAlias>%s</OwnerAlias>'
+                '<GroupName>default</GroupName></SourceSecurityGroup>'
+                '<VPCId>%s</VPCId><Subnets><member>subnet-00000000</member>'
+                '</Subnets><AvailabilityZones><member>%s</member>'
+                '</AvailabilityZones><HealthCheck><Interval>30</Interval>'
+                '<Target>HTTP:80/</Target><HealthyThreshold>2'
+                '</HealthyThreshold><Timeout>5</Timeout><UnhealthyThreshold>2'
+                '</UnhealthyThreshold></HealthCheck>'
+                '<Instances><member><InstanceId>%s</InstanceId></member>'
+                '</Instances><Scheme>internet-facing</Scheme></member>' %
+                    (elb.id, elb.id, elb.id, _TIME, _OWNER_ID, _VPC_ID,
+                    _ZONE_LIST[0], elb.attrs['instance-id']))
+        marker_xml = '<NextMarker>%s</NextMarker>' % (next_marker,) \
+                                        if next_marker is not None else ''
+        return ('<DescribeLoadBalancersResponse><DescribeLoadBalancersResult>'
+                '<LoadBalancerDescriptions>%s</LoadBalancerDescriptions>%s'
+                '</DescribeLoadBalancersResult></DescribeLoadBalancersResponse>'
+                % (''.join(member_list), marker_xml))
+
+    def DescribeInstanceHealth(self, params):
+        elb_name = params.get('LoadBalancerName')
+        elb = self.__account.resources['load-balancer'].get(elb_name)
+        if elb is None:
+            raise _ServiceError('LoadBalancerNotFound',
+                        "There is no ACTIVE Load Balancer named '%s'" %
+                                                                (elb_name,))
+        instance_id = elb.attrs['instance-id']
+        instance = self.__account.resources['instance'].get(instance_id)
+        if instance is not None and \
+                    instance.attrs['instance-state-name'] == 'running':
+            state, reason, description = 'InService', 'N/A', 'N/A'
+        else:
+            state, reason, description = ('OutOfService', 'Instance',
+                        'Instance is in stopped state.')
+        return ('<DescribeInstanceHealthResponse>'
+                '<DescribeInstanceHealthResult><InstanceStates><member>'
+                '<InstanceId>%s</InstanceId><State>%s</State>'
+                '<ReasonCode>%s</ReasonCode><Description>%s</Description>'
+                '</member></InstanceStates>'
+                '</DescribeInstanceHealthResult>'
+                '</DescribeInstanceHealthResponse>' %
+                    (instance_id, state, reason, description))
+
+
+class _RDSHandlers(object):
+    """Request handlers of the RDS service
+    """
+    def __init__(self, account):
+        self.__account = account
+
+    def __select(self, res_type, res_name, not_found_code):
+        """Returns the list of resources of res_type named res_name,
+        or all of them if res_name is None
+        """
+        res_map = self.__account.resources[res_type]
+        if res_name is None:
+            return res_map.values()
+        if res_name not in res_map:
+            raise _ServiceError(not_found_code,
+                                "%s not found" % (res_name,), 404)
+        return [res_map[res_name]]
+
+    @staticmethod
+    def __wrap(action, body, next_marker):
+        marker_xml = '<Marker>%s</Marker>' % (next_marker,) \
+                                        if next_marker is not None else ''
+        return '<%sResponse><%sResult>%s%s</%sResult></%sResponse>' % \
+                            (action, action, body, marker_xml, action, action)
+
+    def DescribeDBInstances(self, params):
+        db_list = self.__select('db-instance',
+                                    params.get('DBInstanceIdentifier'),
+                                    'DBInstanceNotFound')
+        page, next_marker = _paginate(db_list, params, 'Marker', 'MaxRecords',
+                                                                        100)
+        member_list = []
+        for db in page:
+            member_list.append(
+                '<DBInstance><DBInstanceIdentifier>%s</DBInstanceIdentifier>'
+                '<DBInstanceStatus>%s</DBInstanceStatus>'
+                '<DBInstanceClass>db.m4.large</DBInstanceClass>'
+                '<Engine>mysql</Engine><AllocatedStorage>100'
+                '</AllocatedStorage><InstanceCreateTime>%s'
+                '</InstanceCreateTime><Endpoint><Address>'
+                '%s.rds.amazonaws.com</Address><Port>3306</Port></Endpoint>'
+                '<MultiAZ>false</MultiAZ><AvailabilityZone>%s'
+                '</AvailabilityZone><DBSecurityGroups><DBSecurityGroup>'
+                '<DBSecurityGroupName>default</DBSecurityGroupName>'
+                '<Status>active</Status></DBSecurityGroup></DBSecurityGroups>'
+                '</DBInstance>' % (db.id, db.attrs['status'], _TIME, db.id,
+                                                        db.attrs['zone']))
+            #
+            # A deleted instance is reported once as 'deleting'
+            #
+            if db.attrs['status'] == 'deleting':
+                self.__account.remove('db-instance', db.id)
+        return self.__wrap('DescribeDBInstances',
+                '<DBInstances>%s</DBInstances>' % (''.join(member_list),),
+                next_marker)
+
+    def DescribeDBSecurityGroups(self, params):
+        dbsg_list = self.__select('db-security-group',
+                                    params.get('DBSecurityGroupName'),
+                                    'DBSecurityGroupNotFound')
+        page, next_marker = _paginate(dbsg_list, params, 'Marker',
+                                                        'MaxRecords', 100)
+        member_list = ['<DBSecurityGroup><DBSecurityGroupName>%s'
+                        '</DBSecurityGroupName><DBSecurityGroupDescription>'
+                        'bench</DBSecurityGroupDescription><OwnerId>%s'
+                        '</OwnerId><EC2SecurityGroups/><IPRanges/>'
+                        '</DBSecurityGroup>' % (dbsg.id, _OWNER_ID)
+                                                        for dbsg in page]
+        return self.__wrap('DescribeDBSecurityGroups',
+                '<DBSecurityGroups>%s</DBSecurityGroups>' %
+                                                (''.join(member_list),),
+                next_marker)
+
+    def DescribeDBSubnetGroups(self, params):
+        subnetg_list = self.__select('db-subnet-group',
+                                    params.get('DBSubnetGroupName'),
+                                    'DBSubnetGroupNotFoundFault')
+        page, next_marker = _paginate(subnetg_list, params, 'Marker',
+                                                        'MaxRecords', 100)
+        member_list = ['<DBSubnetGroup><DBSubnetGroupName>%s'
+                        '</DBSubnetGroupName><DBSubnetGroupDescription>bench'
+                        '</DBSubnetGroupDescription><VpcId>%s</VpcId>'
+                        '<SubnetGroupStatus>Complete</SubnetGroupStatus>'
+                        '<Subnets><Subnet><SubnetIdentifier>%s'
+                        '</SubnetIdentifier><SubnetStatus>Active'
+                        '</SubnetStatus></Subnet></Subnets></DBSubnetGroup>' %
+                            (subnetg.id, _VPC_ID, subnetg.attrs['subnet-id'])
+                                                    for subnetg in page]
+        return self.__wrap('DescribeDBSubnetGroups',
+                '<DBSubnetGroups>%s</DBSubnetGroups>' %
+                                                (''.join(member_list),),
+                next_marker)
+
+    def DeleteDBInstance(self, params):
+        db_id = params.get('DBInstanceIdentifier')
+        db = self.__select('db-instance', db_id, 'DBInstanceNotFound')[0]
+        if db.attrs['status'] == 'deleting':
+            raise _ServiceError('InvalidDBInstanceState',
+                            "Instance %s is already being deleted" % (db_id,))
+        db.attrs['status'] = 'deleting'
+        return ('<DeleteDBInstanceResponse><DeleteDBInstanceResult>'
+                '<DBInstance><DBInstanceIdentifier>%s</DBInstanceIdentifier>'
+                '<DBInstanceStatus>deleting</DBInstanceStatus></DBInstance>'
+                '</DeleteDBInstanceResult></DeleteDBInstanceResponse>' %
+                                                                (db_id,))
+
+
+class _IAMHandlers(object):
+    """Request handlers of the IAM service
+    """
+    def __init__(self, account):
+        self.__account = account
+
+    def ListUsers(self, params):
+        user_list = self.__account.select('user', [], None)
+        page, next_marker = _paginate(user_list, params,
+                                        'Marker', 'MaxItems', 100)
+        member_list = ['<member><UserName>%s</UserName><UserId>%s</UserId>'
+                '<Path>/</Path><Arn>arn:aws:iam::%s:user/%s</Arn>'
+                '<CreateDate>%s</CreateDate></member>' %
+                    (user.id, user.attrs['user-id'], _OWNER_ID, user.id,
+                    _TIME) for user in page]
+        if next_marker is None:
+            trunc_xml = '<IsTruncated>false</IsTruncated>'
+        else:
+            trunc_xml = '<IsTruncated>true</IsTruncated>' \
+                                '<Marker>%s</Marker>' % (next_marker,)
+        return ('<ListUsersResponse><ListUsersResult><Users>%s</Users>%s'
+                '</ListUsersResult></ListUsersResponse>' %
+                                        (''.join(member_list), trunc_xml))
+
+
+class FakeAws(object):
+    """Serves the requests of all boto connections from a FakeAccount.
+    It keeps track of the number of requests per action, the number
+    of response bytes, and the time spent generating responses.
+    Each response is delayed by latency seconds, to simulate the
+    network round-trip.
+    """
+    def __init__(self, account, latency=0.0):
+        self.account = account
+        self.latency = latency
+        self.__handler_map = [
+                ('ec2.', _EC2Handlers(account)),
+                ('elasticloadbalancing.', _ELBHandlers(account)),
+                ('rds.', _RDSHandlers(account)),
+                ('iam.', _IAMHandlers(account)),
+                ]
+        self.call_counts = collections.defaultdict(int)
+        self.response_bytes = 0
+        self.server_time = 0.0
+        self.__saved_mexe = None
+
+    def __serve(self, http_request):
+        """Returns a _Response for http_request
+        """
+        start = time.time()
+        params = http_request.params
+        action = params.get('Action')
+        self.call_counts[action] += 1
+        for host_prefix, handlers in self.__handler_map:
+            if http_request.host.startswith(host_prefix):
+                break
+        else:
+            handlers = None
+        handler = getattr(handlers, action, None)
+        try:
+            if handler is None:
+                raise _ServiceError('InvalidAction',
+                        "%s is not supported by the stand-in" % (action,))
+            response = _Response(200, handler(params))
+        except _ServiceError, svc_err:
+            response = _Response(svc_err.status,
+                '<Response><Errors><Error><Code>%s</Code>'
+                '<Message>%s</Message></Error></Errors>'
+                '<RequestID>bench</RequestID></Response>' %
+                                (svc_err.code, escape(str(svc_err))))
+        self.response_bytes += len(response.read())
+        if self.latency:
+            time.sleep(self.latency)
+        self.server_time += time.time() - start
+        return response
+
+    def install(self):
+        """Arrange for all boto requests to be served by this object
+        """
+        fake = self
+
+        def fake_mexe(conn, http_request, *args, **kwargs):
+            return fake.__serve(http_request)
+
+        conn_class = boto.connection.AWSAuthConnection
+        self.__saved_mexe = conn_class._mexe
+        conn_class._mexe = fake_mexe
+
+    def uninstall(self):
+        """Undo install()
+        """
+        if self.__saved_mexe is not None:
+            boto.connection.AWSAuthConnection._mexe = self.__saved_mexe
+            self.__saved_mexe = None
@@ -24,11 +24,16 @@ from boto.ec2.blockdevicemapping import BlockDeviceMapping, BlockDeviceType
 
 import common
 
+from columns import get_projection
 from common import CommandError
 from common import confirm_aggr
 from common import DisplayOptions
 from common import CommandOutput
 from common import ResourceSelector
+from common import describe_ids
+from common import use_describe_ids
+from fastparse import count_images
+from fastparse import get_image_records
 
 _VALID_ARCH = ['i386', 'x86_64']
 
@@ -48,7 +53,7 @@ class AMICommand(common.BaseCommand):
     """
 
     def __ami_display(self, ami, disp, pg, region):
-        """Display AMI info
+        """Display AMI info; ami is an ImageRecord
         """
         if disp.display == DisplayOptions.LONG:
             if disp.display_name:
@@ -79,12 +84,9 @@ class AMICommand(common.BaseCommand):
             pg.prt("%15s : %-12s %s", "Root",
                                         ami.root_device_name,
                                         ami.root_device_type)
-            bdev_list = ami.block_device_mapping.keys()
-            bdev_list.sort()
-            for bdev in bdev_list:
-                bdev_info = ami.block_device_mapping[bdev]
+            for bdev_info in ami.block_devices:
                 pg.prt("%15s : %-12s %12s dot=%s",
-                        "Device", bdev,
+                        "Device", bdev_info.device,
                         bdev_info.snapshot_id if bdev_info.snapshot_id else
                                 bdev_info.ephemeral_name,
                         bdev_info.delete_on_termination)
@@ -93,24 +95,50 @@ class AMICommand(common.BaseCommand):
         else:
             pg.prt("%s", ami.id)
             if disp.display_tags:
-                common.display_tags(ami.tags)
+                common.display_tags(ami.tags, pg)
 
     def __ami_list_cmd(self, region, selector, disp, owner_list):
         """Implements the list function of the ami command
         """
+        if not self.pipe_select(region, 'image', selector):
+            return
         if not selector.has_selection():
             return
-        ec2_conn = self.get_ec2_conn(region)
-        if selector.resource_id_list:
-            owner_list = None
-        elif not owner_list:
-            owner_list = ['self']
-        ami_list = ec2_conn.get_all_images(
+        ami_list = self.pipe_records('image', selector)
+        if ami_list is None and use_describe_ids(selector):
+            ec2_conn = self.get_ec2_conn(region)
+            ami_list = describe_ids(
+                        lambda filter_dict: get_image_records(ec2_conn,
+                                                    filters=filter_dict),
+                        'image-id', selector)
+            self.cache_insert(region, [ami.id for ami in ami_list])
+        elif ami_list is None:
+            ec2_conn = self.get_ec2_conn(region)
+            if selector.resource_id_list:
+                owner_list = None
+            elif not owner_list:
+                owner_list = ['self']
+            if disp.display_count and not self.output_is_piped():
+                n_images = count_images(ec2_conn,
+                                        image_ids=selector.resource_id_list,
+                                        owners=owner_list,
+                                        filters=selector.get_filter_dict())
+                print "AMI count: %d" % (n_images,)
+                return
+            ami_list = get_image_records(ec2_conn,
                                         image_ids=selector.resource_id_list,
                                         owners=owner_list,
                                         filters=selector.get_filter_dict())
-        self.cache_insert(region, [ami.id for ami in ami_list])
+            self.cache_insert(region, [ami.id for ami in ami_list])
+        if self.pipe_output(region, 'image', ami_list):
+            return
+        if disp.display_count:
+            print "AMI count: %d" % (len(ami_list),)
+            return
         with CommandOutput() as pg:
+            if disp.columns is not None:
+                disp.columns.display(ami_list, pg)
+                return
             disp_ami_list = _preprocess(ami_list, disp)
             for ami in disp_ami_list:
                 self.__ami_display(ami, disp, pg, region)
@@ -124,7 +152,7 @@ class AMICommand(common.BaseCommand):
         if selector.is_explicit():
             ami_id_list = selector.resource_id_list
         else:
-            ami_list = ec2_conn.get_all_images(
+            ami_list = get_image_records(ec2_conn,
                                 owners=['self'],
                                 filters=selector.get_filter_dict())
             ami_id_list = [ami.id for ami in ami_list]
@@ -306,7 +334,7 @@ class AMICommand(common.BaseCommand):
         disp = DisplayOptions()
         region = None
         owner_list = []
-        opt_list, args = getopt.getopt(argv, "aCd:Df:lnq:r:tU:v:x")
+        opt_list, args = getopt.getopt(argv, "aCd:Df:I:klLnq:r:tU:v:xy:")
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
@@ -319,8 +347,14 @@ class AMICommand(common.BaseCommand):
                     cmd_delete = True
                 elif opt[0] == '-f':
                     selector.add_filter_spec(opt[1])
+                elif opt[0] == '-I':
+                    selector.id_input_path = opt[1]
+                elif opt[0] == '-k':
+                    disp.display_count = True
                 elif opt[0] == '-l':
                     disp.display = DisplayOptions.LONG
+                elif opt[0] == '-L':
+                    self.use_offline_inventory()
                 elif opt[0] == '-n':
                     disp.display_name = True
                 elif opt[0] == '-q':
@@ -335,6 +369,10 @@ class AMICommand(common.BaseCommand):
                     virtualization_type = opt[1]
                 elif opt[0] == '-x':
                     disp.display = DisplayOptions.EXTENDED
+                elif opt[0] == '-y':
+                    disp.columns = get_projection('image', opt[1])
+        if selector.id_input_path and (cmd_delete or cmd_create):
+            raise CommandError("-I can only be used when listing AMIs")
         if cmd_delete:
             selector.resource_id_list = args
             self.__ami_delete(region, selector)
@@ -352,10 +390,17 @@ Options:
     -C          : create a new AMI
     -D          : delete an existing AMI
     -d desc     : AMI description (when creating a new AMI)
+    -I file     : list the AMIs with the ids in file ('-' for the
+                  standard input); the ids are described in batches
+    -k          : displays the AMI count
     -U owner    : list AMIs owned by 'owner'; possible values are 'self',
                   'amazon', 'aws-marketplace'; option may be specified
                   multiple times
     -v virt_type: virtualization type (default is PV)
+    -y columns  : display only the specified columns; columns is a
+                  comma-separated list of column names (tag:<key> is the
+                  value of a tag), or @name for a saved template
+                  (see 'help columns')
 
 When creating a new AMI, the argument list may include:
         i-<id>          : the instance-id from which to create an image
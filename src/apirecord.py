@@ -0,0 +1,240 @@
+#
+# Copyright 2014-2016 CloudVelox Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains the recording and replaying of API responses
+used by the 'record' and 'replay' commands.
+
+A recording is a gzip-compressed file with one JSON object per line;
+each object holds the request (service, region, action, parameters)
+and the raw response (status, reason, headers, body).
+"""
+
+import gzip
+import json
+import threading
+
+from common import CommandError
+
+
+def _request_key(service, region, action, params):
+    """Returns the key used to match requests against the recording
+    """
+    param_list = sorted(params.items()) if params else []
+    return (service, region, action, tuple(param_list))
+
+
+class _RecordedResponse(object):
+    """Replayed response; it provides what boto uses from
+    an httplib.HTTPResponse
+    """
+    def __init__(self, status, reason, header_list, body):
+        self.status = status
+        self.reason = reason
+        self.__header_map = dict([(name.lower(), value)
+                                        for name, value in header_list])
+        self.__header_list = header_list
+        self.__body = body
+        self.__offset = 0
+
+    def read(self, amt=None):
+        """Without amt, returns the whole body (on every call, like the
+        boto response, which caches it); otherwise returns the next
+        amt bytes of the body, or '' at the end of the body
+        """
+        if amt is None:
+            return self.__body
+        data = self.__body[self.__offset:self.__offset + amt]
+        self.__offset += len(data)
+        return data
+
+    def getheader(self, name, default=None):
+        return self.__header_map.get(name.lower(), default)
+
+    def getheaders(self):
+        return self.__header_list
+
+
+class ApiRecorder(object):
+    """Records the API requests/responses made through the instrumented
+    boto connections, or replays previously recorded responses (in which
+    case no requests are sent to AWS).
+    """
+
+    OFF = 0
+    RECORD = 1
+    REPLAY = 2
+
+    def __init__(self):
+        self.mode = self.OFF
+        self.__lock = threading.Lock()
+        self.__path = None
+        self.__record_file = None
+        self.__strict = True
+        self.__n_exchanges = 0
+        #
+        # Key: request key
+        # Value: list of recorded (status, reason, header_list, body) tuples;
+        #        a new _RecordedResponse is created from the tuple every
+        #        time it is replayed, since reading the response body
+        #        advances its offset
+        #
+        self.__response_map = {}
+        #
+        # Key: request key
+        # Value: index of next response to replay
+        #
+        self.__next_response = {}
+        #
+        # Key: (service, region, action)
+        # Value: list of recorded (status, reason, header_list, body) tuples
+        #
+        self.__action_response_map = {}
+
+    def get_path(self):
+        """Returns the path of the recording in use
+        """
+        return self.__path
+
+    def get_exchange_count(self):
+        """Returns the number of exchanges recorded (when recording)
+        or loaded (when replaying)
+        """
+        return self.__n_exchanges
+
+    def stop(self):
+        """Stop recording or replaying
+        """
+        with self.__lock:
+            if self.__record_file is not None:
+                self.__record_file.close()
+                self.__record_file = None
+            self.__response_map = {}
+            self.__next_response = {}
+            self.__action_response_map = {}
+            self.__path = None
+            self.__n_exchanges = 0
+            self.mode = self.OFF
+
+    def start_recording(self, record_path, append):
+        """Start recording to the specified file
+        """
+        self.stop()
+        self.__record_file = gzip.open(record_path, "ab" if append else "wb")
+        self.__path = record_path
+        self.mode = self.RECORD
+
+    def start_replaying(self, record_path, strict):
+        """Start replaying the responses in the specified file. When strict
+        is False, a request that does not match any recorded request
+        (including its parameters) is served the first recorded response
+        for the same action.
+        """
+        self.stop()
+        response_map = {}
+        action_response_map = {}
+        n_exchanges = 0
+        with gzip.open(record_path, "rb") as record_file:
+            for ln in record_file:
+                exchange = json.loads(ln)
+                response_tuple = (exchange['status'],
+                                exchange['reason'],
+                                [(str(name), str(value))
+                                    for name, value in exchange['headers']],
+                                exchange['body'].encode('utf-8'))
+                key = _request_key(exchange['service'], exchange['region'],
+                                        exchange['action'], exchange['params'])
+                response_map.setdefault(key, []).append(response_tuple)
+                action_response_map.setdefault(key[:3],
+                                                []).append(response_tuple)
+                n_exchanges += 1
+        self.__response_map = response_map
+        self.__action_response_map = action_response_map
+        self.__strict = strict
+        self.__path = record_path
+        self.__n_exchanges = n_exchanges
+        self.mode = self.REPLAY
+
+    def __replay(self, service, region, action, params):
+        """Returns a new response object holding the recorded response
+        for the specified request. Identical requests are served the
+        recorded responses in order; the last one is repeated once they
+        are exhausted.
+        """
+        key = _request_key(service, region, action, params)
+        with self.__lock:
+            response_list = self.__response_map.get(key)
+            if response_list is not None:
+                index = self.__next_response.get(key, 0)
+                if index + 1 < len(response_list):
+                    self.__next_response[key] = index + 1
+                return _RecordedResponse(*response_list[index])
+            if not self.__strict:
+                response_list = self.__action_response_map.get(key[:3])
+                if response_list is not None:
+                    return _RecordedResponse(*response_list[0])
+        raise CommandError("No recorded response for %s %s in %s" %
+                                        (service, action, region))
+
+    def __record(self, service, region, action, params, response, body):
+        """Append an exchange to the recording
+        """
+        exchange = {
+                'service' : service,
+                'region' : region,
+                'action' : action,
+                'params' : params,
+                'status' : response.status,
+                'reason' : response.reason,
+                'headers' : response.getheaders(),
+                'body' : body,
+                }
+        ln = json.dumps(exchange)
+        with self.__lock:
+            if self.__record_file is not None:
+                self.__record_file.write(ln)
+                self.__record_file.write('\n')
+                self.__n_exchanges += 1
+
+    def instrument(self, conn, service, region):
+        """Arrange for the requests made through the boto connection conn
+        to be recorded or replayed (depending on the mode). Returns conn.
+        """
+        make_request = conn.make_request
+
+        def recorded_make_request(action, params=None, *args, **kwargs):
+            """Wrapper of the connection's make_request() method
+            """
+            if self.mode == self.OFF:
+                return make_request(action, params, *args, **kwargs)
+            #
+            # Copy the parameters before boto adds the authentication
+            # information to them
+            #
+            param_copy = dict(params) if params else {}
+            if self.mode == self.REPLAY:
+                return self.__replay(service, region, action, param_copy)
+            response = make_request(action, params, *args, **kwargs)
+            #
+            # boto caches the response body, so reading it here does not
+            # interfere with its later processing by the caller.
+            #
+            self.__record(service, region, action, param_copy,
+                                                response, response.read())
+            return response
+
+        conn.make_request = recorded_make_request
+        return conn
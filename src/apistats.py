@@ -0,0 +1,304 @@
+#
+# Copyright 2014-2016 CloudVelox Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains the API call instrumentation used by the
+'stats' command
+"""
+
+import json
+import re
+import threading
+import time
+
+import boto.connection
+
+from common import is_throttle_error
+
+#
+# Upper bounds (in milliseconds) of the latency histogram buckets;
+# the last bucket holds everything above the last bound.
+#
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_ERROR_CODE_RE = re.compile(r'<Code>([^<]+)</Code>')
+
+#
+# Request parameters whose values are included in the slow call log;
+# the values of all other parameters (e.g. UserData, passwords, policy
+# documents) are replaced by _REDACTED.
+#
+_LOGGED_PARAM_RE = re.compile(r'^(Filter\.\d+\.(Name|Value\.\d+)|'
+                                r'MaxResults|MaxRecords|NextToken|Marker|'
+                                r'[A-Za-z]*(Id|Name|Type)(\.\d+)?)$')
+_REDACTED = '<redacted>'
+
+
+def _loggable_params(params):
+    """Returns a copy of params where the values of the parameters
+    that may hold secrets are redacted
+    """
+    return dict([(key, value if _LOGGED_PARAM_RE.match(key) else _REDACTED)
+                                for key, value in params.iteritems()])
+
+
+class _ErrorCode(object):
+    """Minimal stand-in for a boto exception, so that we can use
+    is_throttle_error() on the error code of a response
+    """
+    def __init__(self, error_code):
+        self.error_code = error_code
+
+
+class _CallStats(object):
+    """Statistics for a (service, action, region) triple
+    """
+    def __init__(self):
+        self.n_calls = 0
+        self.n_errors = 0
+        self.n_throttled = 0
+        self.n_bytes = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, elapsed, n_bytes, error, throttled):
+        """Account for a call that took elapsed seconds
+        """
+        self.n_calls += 1
+        self.n_bytes += n_bytes
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if error:
+            self.n_errors += 1
+        if throttled:
+            self.n_throttled += 1
+        elapsed_ms = elapsed * 1000
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed_ms <= bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+    def percentile(self, pct):
+        """Returns the upper bound (in milliseconds) of the histogram bucket
+        containing the pct-th percentile; None for the last bucket.
+        """
+        threshold = self.n_calls * pct / 100.0
+        count = 0
+        for i, bucket_count in enumerate(self.histogram):
+            count += bucket_count
+            if count >= threshold:
+                break
+        if i < len(LATENCY_BUCKETS):
+            return LATENCY_BUCKETS[i]
+        return None
+
+
+class ApiStats(object):
+    """Collects statistics about the API calls made through
+    instrumented boto connections.
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        #
+        # Key: (service, action, region)
+        # Value: _CallStats
+        #
+        self.__stats_map = {}
+        self.__slow_log_file = None
+        self.__slow_log_path = None
+        self.slow_threshold = 1.0       # seconds
+
+    def clear(self):
+        """Forget all statistics
+        """
+        with self.__lock:
+            self.__stats_map = {}
+
+    def set_slow_log(self, log_path):
+        """Log calls that take longer than the slow_threshold to the
+        specified file (in JSONL format); a log_path of None disables
+        logging.
+        """
+        with self.__lock:
+            if self.__slow_log_file is not None:
+                self.__slow_log_file.close()
+                self.__slow_log_file = None
+                self.__slow_log_path = None
+            if log_path is not None:
+                self.__slow_log_file = open(log_path, "a")
+                self.__slow_log_path = log_path
+
+    def get_slow_log(self):
+        """Returns the path of the slow call log, or None
+        """
+        return self.__slow_log_path
+
+    def __record(self, key, elapsed, n_bytes, status, error_code, params):
+        """Record the outcome of a call
+        """
+        throttled = error_code is not None and \
+                                is_throttle_error(_ErrorCode(error_code))
+        error = error_code is not None or status is None or status >= 400
+        with self.__lock:
+            call_stats = self.__stats_map.get(key)
+            if call_stats is None:
+                call_stats = _CallStats()
+                self.__stats_map[key] = call_stats
+            call_stats.add(elapsed, n_bytes, error, throttled)
+            if self.__slow_log_file is not None and \
+                                        elapsed >= self.slow_threshold:
+                service, action, region = key
+                entry = {
+                        'time' : time.strftime("%Y-%m-%dT%H:%M:%S",
+                                                time.localtime()),
+                        'service' : service,
+                        'action' : action,
+                        'region' : region,
+                        'elapsed_ms' : int(elapsed * 1000),
+                        'bytes' : n_bytes,
+                        'status' : status,
+                        'error_code' : error_code,
+                        'params' : _loggable_params(params),
+                        }
+                self.__slow_log_file.write(json.dumps(entry, sort_keys=True))
+                self.__slow_log_file.write('\n')
+                self.__slow_log_file.flush()
+
+    def __record_on_read(self, key, response, elapsed, params):
+        """Arrange for a successful call to be recorded once the caller
+        has read the body of its response, so that the body can still
+        be parsed as it arrives (see fastparse.py). The recorded time
+        is the time until the response headers were received plus the
+        time spent reading the body.
+        """
+        read = response.read
+        read_state = {'elapsed' : elapsed, 'n_bytes' : 0, 'done' : False}
+
+        def counting_read(amt=None):
+            """Wrapper of the response's read() method
+            """
+            start = time.time()
+            data = read(amt)
+            if read_state['done']:
+                return data
+            read_state['elapsed'] += time.time() - start
+            read_state['n_bytes'] += len(data)
+            if amt is None or not data:
+                read_state['done'] = True
+                self.__record(key, read_state['elapsed'],
+                                read_state['n_bytes'], response.status,
+                                None, params)
+            return data
+
+        response.read = counting_read
+
+    def instrument(self, conn, service, region):
+        """Arrange for all requests made through the boto connection conn
+        to be accounted for. Returns conn.
+        """
+        make_request = conn.make_request
+
+        def instrumented_make_request(action, params=None, *args, **kwargs):
+            """Wrapper of the connection's make_request() method
+            """
+            #
+            # Copy the parameters before boto adds the authentication
+            # information to them
+            #
+            param_copy = dict(params) if params else {}
+            key = (service, action, region)
+            start = time.time()
+            try:
+                response = make_request(action, params, *args, **kwargs)
+            except Exception:
+                self.__record(key, time.time() - start, 0, None, None,
+                                                                param_copy)
+                raise
+            if response.status < 400 and \
+                    isinstance(response, boto.connection.HTTPResponse) and \
+                    not response._cached_response:
+                self.__record_on_read(key, response, time.time() - start,
+                                                                param_copy)
+                return response
+            #
+            # boto caches the response body, so reading it here does not
+            # interfere with its later processing by the caller.
+            #
+            body = response.read()
+            elapsed = time.time() - start
+            error_code = None
+            if response.status >= 400:
+                match = _ERROR_CODE_RE.search(body)
+                if match:
+                    error_code = match.group(1)
+            self.__record(key, elapsed, len(body), response.status,
+                                                error_code, param_copy)
+            return response
+
+        conn.make_request = instrumented_make_request
+        return conn
+
+    def totals(self):
+        """Returns the tuple (calls, errors, throttled, bytes, time)
+        aggregated over all actions
+        """
+        n_calls = n_errors = n_throttled = n_bytes = 0
+        total_time = 0.0
+        with self.__lock:
+            for call_stats in self.__stats_map.itervalues():
+                n_calls += call_stats.n_calls
+                n_errors += call_stats.n_errors
+                n_throttled += call_stats.n_throttled
+                n_bytes += call_stats.n_bytes
+                total_time += call_stats.total_time
+        return n_calls, n_errors, n_throttled, n_bytes, total_time
+
+    def display(self, pg, show_histogram):
+        """Display the collected statistics
+        """
+        with self.__lock:
+            stats_list = sorted(self.__stats_map.items())
+        if not stats_list:
+            return
+        pg.prt("%-5s %-34s %-14s %6s %5s %5s %10s %7s %7s %7s",
+                "SVC", "ACTION", "REGION", "CALLS", "ERR", "THR",
+                "BYTES", "AVG-MS", "P90-MS", "MAX-MS")
+        for key, call_stats in stats_list:
+            service, action, region = key
+            p90 = call_stats.percentile(90)
+            pg.prt("%-5s %-34s %-14s %6d %5d %5d %10d %7d %7s %7d",
+                    service, action, region,
+                    call_stats.n_calls, call_stats.n_errors,
+                    call_stats.n_throttled, call_stats.n_bytes,
+                    call_stats.total_time * 1000 / call_stats.n_calls,
+                    "<=%d" % (p90,) if p90 is not None else
+                                        ">%d" % (LATENCY_BUCKETS[-1],),
+                    call_stats.max_time * 1000)
+            if show_histogram:
+                bucket_list = []
+                for i, bucket_count in enumerate(call_stats.histogram):
+                    if not bucket_count:
+                        continue
+                    if i < len(LATENCY_BUCKETS):
+                        label = "<=%d" % (LATENCY_BUCKETS[i],)
+                    else:
+                        label = ">%d" % (LATENCY_BUCKETS[-1],)
+                    bucket_list.append("%s:%d" % (label, bucket_count))
+                pg.prt("%6s %s", "", " ".join(bucket_list))
@@ -30,6 +30,7 @@ import os
 import readline
 import shlex
 import sys
+import time
 import traceback
 
 try:
@@ -59,8 +60,11 @@ sys.path.insert(0, os.path.dirname(sys.argv[0]))
 
 import akicmd
 import amicmd
+import apirecord
+import apistats
 import aricmd
 import certcmd
+import columns
 import consolecmd
 import dhcpcmd
 import eipcmd
@@ -68,11 +72,16 @@ import elbcmd
 import enicmd
 import igwcmd
 import instcmd
+import inventory
 import keycmd
 import keypaircmd
 import mfacmd
 import naclcmd
+import pipeline
+import prefetch
+import profiling
 import rdscmd
+import reachcmd
 import rtbcmd
 import sgcmd
 import snapcmd
@@ -83,6 +92,7 @@ import volcmd
 import vpccmd
 
 from common import CommandError
+from common import CommandOutput
 from common import DisplayOptions
 
 _PROGRAM = "clsh"
@@ -252,6 +262,76 @@ class _ResourceCache(object):
                 pass
 
 
+class _NameIndex(object):
+    """An object of this class maps values of the Name tag to resource ids,
+    per region and resource type. The index is populated as a side-effect
+    of resource listings, and it is refreshed from the tags API when a
+    name cannot be resolved locally.
+    """
+
+    #
+    # Entries older than this (in seconds) are not used to resolve names
+    #
+    MAX_ENTRY_AGE = 600
+
+    def __init__(self):
+        #
+        # Key: (region, resource-type) where resource-type is the
+        #       type used by the tags API (ex. 'instance', 'volume')
+        # Value: dictionary with key: resource-id,
+        #                        value: (name, time-of-insertion)
+        #
+        self.__contents = { }
+
+    def clear(self):
+        """Clear the index
+        """
+        self.__contents.clear()
+
+    def insert(self, region, res_type, id_name_list):
+        """Add the (resource-id, name) tuples in id_name_list to the index.
+        A name of None indicates a resource without a Name tag.
+        """
+        now = time.time()
+        try:
+            id_map = self.__contents[(region, res_type)]
+        except KeyError:
+            id_map = self.__contents[(region, res_type)] = { }
+        for res_id, name in id_name_list:
+            id_map[res_id] = (name, now)
+
+    def evict(self, region, res_type, name_list):
+        """Remove the entries for the names in name_list
+        """
+        id_map = self.__contents.get((region, res_type), { })
+        name_set = set(name_list)
+        for res_id, (name, _) in id_map.items():
+            if name in name_set:
+                del id_map[res_id]
+
+    def lookup(self, region, res_type, name_list):
+        """Returns the tuple (res_id_list, unresolved_name_list)
+        """
+        id_map = self.__contents.get((region, res_type), { })
+        min_time = time.time() - self.MAX_ENTRY_AGE
+        #
+        # Key: name
+        # Value: list of resource ids
+        #
+        name_map = dict([(name, []) for name in name_list])
+        for res_id, (name, insert_time) in id_map.iteritems():
+            if name in name_map and insert_time >= min_time:
+                name_map[name].append(res_id)
+        res_id_list = []
+        unresolved_name_list = []
+        for name in name_list:
+            if name_map[name]:
+                res_id_list.extend(name_map[name])
+            else:
+                unresolved_name_list.append(name)
+        return res_id_list, unresolved_name_list
+
+
 class _CommandInterpreter(cmd.Cmd):
     """The AWS shell command interpreter
 
@@ -315,6 +395,7 @@ class _CommandInterpreter(cmd.Cmd):
                         'mfa' : mfacmd.MFACommand(self),
                         'nacl' : naclcmd.NACLCommand(self),
                         'rds' : rdscmd.RDSCommand(self),
+                        'reach' : reachcmd.ReachCommand(self),
                         'rtb' : rtbcmd.RTBCommand(self),
                         'sg' : sgcmd.SGCommand(self),
                         'snap' : snapcmd.SnapCommand(self),
@@ -339,6 +420,18 @@ class _CommandInterpreter(cmd.Cmd):
         #
         self.__zone_cache = { }
         self.__cache = _ResourceCache()
+        self.__name_index = _NameIndex()
+        self.__api_stats = apistats.ApiStats()
+        self.__api_recorder = apirecord.ApiRecorder()
+        self.__inventory = inventory.Inventory()
+        self.__inventory.set_account(self.__creds.aws_key_id)
+        self.__prefetcher = None
+        self.__profiler = None
+        #
+        # The pipeline.Pipe of the command being executed, if that command
+        # is part of a pipeline
+        #
+        self.__pipe = None
 
     def __find_regions(self):
         """Returns list of AWS region names.
@@ -350,6 +443,15 @@ class _CommandInterpreter(cmd.Cmd):
             self.__connmap[region_info.name] = _ConnectionHolder()
         self.__have_region_names = True
 
+    def __instrument_conn(self, conn, service, region):
+        """Arrange for the requests made through the new connection conn
+        to be persisted in (or served from) the inventory, recorded/replayed,
+        and accounted for
+        """
+        self.__inventory.instrument(conn, service, region)
+        self.__api_recorder.instrument(conn, service, region)
+        self.__api_stats.instrument(conn, service, region)
+
     def __get_conn(self, region, conn_type):
         """Returns a connection object. The region argument identifies the
         region to use. The connection to the particular region is established
@@ -368,24 +470,28 @@ class _CommandInterpreter(cmd.Cmd):
                 holder.vpc_connection = boto.vpc.connect_to_region(region,
                                 aws_access_key_id=self.__creds.aws_key_id,
                                 aws_secret_access_key=self.__creds.aws_key_val)
+                self.__instrument_conn(holder.vpc_connection, 'ec2', region)
             return holder.vpc_connection
         elif conn_type == self.__EC2_CONN:
             if holder.ec2_connection is None:
                 holder.ec2_connection = boto.ec2.connect_to_region(region,
                                 aws_access_key_id=self.__creds.aws_key_id,
                                 aws_secret_access_key=self.__creds.aws_key_val)
+                self.__instrument_conn(holder.ec2_connection, 'ec2', region)
             return holder.ec2_connection
         elif conn_type == self.__RDS_CONN:
             if holder.rds_connection is None:
                 holder.rds_connection = boto.rds.connect_to_region(region,
                                 aws_access_key_id=self.__creds.aws_key_id,
                                 aws_secret_access_key=self.__creds.aws_key_val)
+                self.__instrument_conn(holder.rds_connection, 'rds', region)
             return holder.rds_connection
         elif conn_type == self.__ELB_CONN:
             if holder.elb_connection is None:
                 holder.elb_connection = boto.ec2.elb.connect_to_region(region,
                                 aws_access_key_id=self.__creds.aws_key_id,
                                 aws_secret_access_key=self.__creds.aws_key_val)
+                self.__instrument_conn(holder.elb_connection, 'elb', region)
             return holder.elb_connection
         elif conn_type == self.__IAM_CONN:
             if holder.iam_connection is None:
@@ -393,6 +499,7 @@ class _CommandInterpreter(cmd.Cmd):
                                 self.IAM_REGION_NAME,
                                 aws_access_key_id=self.__creds.aws_key_id,
                                 aws_secret_access_key=self.__creds.aws_key_val)
+                self.__instrument_conn(holder.iam_connection, 'iam', region)
             return holder.iam_connection
         else:
             raise CommandError("Bad connection type: %s" % (conn_type,))
@@ -438,6 +545,155 @@ class _CommandInterpreter(cmd.Cmd):
     def cache_remove(self, res_id_list):
         return self.__cache.remove(res_id_list)
 
+    def name_index_insert(self, region, res_type, resource_list):
+        """Add the names of the resources in resource_list to the
+        name index
+        """
+        if region is None:
+            region = self.__region
+        self.__name_index.insert(region, res_type,
+                [(res.id, res.tags.get('Name')) for res in resource_list])
+
+    def name_index_refresh(self, region, res_type, name_list=None):
+        """Refresh the name index for the specified resource type using a
+        single call to the tags API. If name_list is specified, only
+        the entries for those names are refreshed.
+        """
+        if region is None:
+            region = self.__region
+        filter_dict = {
+                        'resource-type' : res_type,
+                        'key' : 'Name',
+                        }
+        if name_list:
+            filter_dict['value'] = name_list
+        ec2_conn = self.get_ec2_conn(region)
+        tag_list = ec2_conn.get_all_tags(filters=filter_dict)
+        self.__name_index.insert(region, res_type,
+                                [(tag.res_id, tag.value) for tag in tag_list])
+
+    def name_index_evict(self, region, res_type, name_list):
+        """Remove the names in name_list from the name index, so that
+        they are resolved again with the tags API
+        """
+        if region is None:
+            region = self.__region
+        self.__name_index.evict(region, res_type, name_list)
+
+    def name_index_resolve(self, region, res_type, name_list):
+        """Resolve the names in name_list to resource ids of the specified
+        resource type. Names that are not in the index are resolved
+        with a single call to the tags API.
+        Returns the tuple (res_id_list, unresolved_name_list)
+        """
+        if region is None:
+            region = self.__region
+        res_id_list, unresolved_name_list = self.__name_index.lookup(
+                                                region, res_type, name_list)
+        if unresolved_name_list:
+            self.name_index_refresh(region, res_type, unresolved_name_list)
+            more_res_id_list, unresolved_name_list = self.__name_index.lookup(
+                                    region, res_type, unresolved_name_list)
+            res_id_list.extend(more_res_id_list)
+        return res_id_list, unresolved_name_list
+
+    def output_is_piped(self):
+        """Returns True if the current command is followed by another
+        command in a pipeline
+        """
+        return self.__pipe is not None and self.__pipe.has_next
+
+    def pipe_output(self, region, res_type, record_list):
+        """Pass the resources in record_list to the next command of the
+        pipeline. Returns False if the current command is not followed
+        by another command (and therefore should display the resources).
+        """
+        if not self.output_is_piped():
+            return False
+        if region is None:
+            region = self.__region
+        self.__pipe.output = pipeline.PipeData(res_type, region,
+                                                        list(record_list))
+        return True
+
+    def pipe_select(self, region, res_type, selector):
+        """Select the resources of type res_type that are related to the
+        resources passed by the previous command of the pipeline (if any).
+        Returns False if there are no such resources.
+        """
+        pipe = self.__pipe
+        if pipe is None or pipe.input is None:
+            return True
+        if region is not None and region != pipe.input.region:
+            raise CommandError("Piped resources are in %s, not in %s" %
+                                                (pipe.input.region, region))
+        return pipe.input.select(res_type, selector)
+
+    def pipe_records(self, res_type, selector):
+        """Returns the resources passed by the previous command of the
+        pipeline if they are exactly those selected by selector,
+        otherwise None
+        """
+        pipe = self.__pipe
+        if pipe is None or pipe.input is None:
+            return None
+        return pipe.input.get_records(res_type, selector)
+
+    def __pipeline(self, stage_list):
+        """Execute the commands of a pipeline
+        """
+        try:
+            pipeline.check_pipeline(stage_list)
+        except CommandError as cmderr:
+            print "%s" % cmderr
+            return self.CONTINUE
+        #
+        # The commands following the first one use the region of
+        # the resources passed to them
+        #
+        saved_region = self.__region
+        pipe_input = None
+        try:
+            for i, stage in enumerate(stage_list):
+                has_next = i + 1 < len(stage_list)
+                self.__pipe = pipeline.Pipe(pipe_input, has_next)
+                if pipe_input is not None:
+                    self.__region = pipe_input.region
+                stop = cmd.Cmd.onecmd(self, stage)
+                if stop or not has_next:
+                    return stop
+                pipe_input = self.__pipe.output
+                if pipe_input is None:
+                    #
+                    # The command failed, or it did not list resources
+                    #
+                    print "Nothing to pass from '%s' to the next command" % \
+                                                                (stage,)
+                    return self.CONTINUE
+        finally:
+            self.__pipe = None
+            self.__region = saved_region
+
+    def onecmd(self, ln):
+        """Execute the command line ln, which may be a pipeline
+        """
+        stage_list = pipeline.split_pipeline(ln)
+        if len(stage_list) == 1:
+            return cmd.Cmd.onecmd(self, ln)
+        return self.__pipeline(stage_list)
+
+    def use_offline_inventory(self):
+        """Serve the API requests of the current command from the
+        offline inventory
+        """
+        self.__inventory.offline_command = True
+
+    def needs_complete_lists(self):
+        """Returns True if list requests should not be paginated
+        (because of the offline inventory)
+        """
+        return self.__inventory.needs_complete_lists()
+
     def __find_zones(self, region):
         ec2_conn = self.get_ec2_conn(region)
         self.__zone_cache[region] = ec2_conn.get_all_zones()
@@ -458,6 +714,12 @@ class _CommandInterpreter(cmd.Cmd):
             self.__find_zones(region)
         return [zone.name for zone in self.__zone_cache[region]]
 
+    def get_region_names(self):
+        """Returns the (sorted) list of AWS region names
+        """
+        self.__find_regions()
+        return sorted(self.__connmap)
+
     def dispatch(self, meth, ln):
         """This method breaks the remaining arguments in the input line
         into an argv list suitable for passing to getopt.
@@ -465,6 +727,20 @@ class _CommandInterpreter(cmd.Cmd):
         Dispatched methods may raise one of the explicitly caught exceptions
         listed here.
         """
+        if self.__profiler is None:
+            self.__dispatch(meth, ln)
+        else:
+            #
+            # Use the unmangled method name (e.g. vol_cmd) as the label
+            #
+            self.__profiler.run(meth.__name__.split('__')[-1],
+                                                self.__dispatch, meth, ln)
+
+    def __dispatch(self, meth, ln):
+        """Invoke meth with the argv list derived from ln, and report
+        any errors
+        """
+        start_totals = self.__api_stats.totals()
         try:
             #
             # Note that 'meth' is a bound method (i.e. it already
@@ -495,6 +771,22 @@ class _CommandInterpreter(cmd.Cmd):
         except Exception, ex:
             print "Unexpected exception: %s" % (ex,)
             print traceback.format_exc()
+        finally:
+            self.__inventory.end_command()
+        if self.__debug:
+            self.__api_stats_report(start_totals)
+
+    def __api_stats_report(self, start_totals):
+        """Report the API calls made since the time when the API
+        call totals were start_totals
+        """
+        end_totals = self.__api_stats.totals()
+        n_calls, n_errors, n_throttled, n_bytes, elapsed = \
+                [end - start for start, end in zip(start_totals, end_totals)]
+        if n_calls > 0:
+            print "API calls: %d (errors: %d, throttled: %d), " \
+                        "%d bytes, %.3f secs" % \
+                        (n_calls, n_errors, n_throttled, n_bytes, elapsed)
 
     def do_aki(self, ln):
         """aki command
@@ -520,6 +812,73 @@ class _CommandInterpreter(cmd.Cmd):
         self.__command['cert'].do_cert(ln)
         return self.CONTINUE
 
+    def __columns_cmd(self, argv):
+        """Implements the columns command
+        """
+        cmd_save = False
+        cmd_delete = False
+        opt_list, args = getopt.getopt(argv, "CD")
+        for opt in opt_list:
+            if opt[0] == '-C':
+                cmd_save = True
+            elif opt[0] == '-D':
+                cmd_delete = True
+        templates = columns.ColumnTemplates()
+        if cmd_save:
+            if len(args) != 3:
+                print "Expecting arguments: res_type name column_spec"
+                return
+            templates.save(args[0], args[1], args[2])
+            return
+        if cmd_delete:
+            if len(args) != 2:
+                print "Expecting arguments: res_type name"
+                return
+            if not templates.delete(args[0], args[1]):
+                raise CommandError("No %s column template named %s" %
+                                                        (args[0], args[1]))
+            return
+        res_type_list = args or columns.get_resource_types()
+        template_map = templates.load()
+        for res_type in res_type_list:
+            if res_type not in columns.get_resource_types():
+                raise CommandError(
+                        "Bad resource type: %s; available types: %s" %
+                        (res_type, ", ".join(columns.get_resource_types())))
+            print "%s:" % (res_type,)
+            print "    columns   : %s" % \
+                        (",".join(columns.get_column_names(res_type)),)
+            for template_res_type, name in sorted(template_map):
+                if template_res_type == res_type:
+                    print "    @%-8s : %s" % (name,
+                                        template_map[(res_type, name)])
+
+    def do_columns(self, ln):
+        """
+        columns [res_type] ...
+        columns -C res_type name column_spec
+        columns -D res_type name
+
+The -y option of the inst, vol, snap and ami commands displays only the
+specified columns, one resource per line. The column_spec is a
+comma-separated list of column names; a column tag:<key> displays the value
+of the tag with that key. For example:
+        inst -a -y id,state,type,tag:Name,private_ip
+
+Column specs may be saved as named templates (in ~/.clsh/columns) and
+used as -y @name. The resource types are: instance (inst), volume (vol),
+snapshot (snap) and image (ami).
+
+Without options, the available columns and the saved templates of the
+specified resource types (default: all) are listed.
+
+Options:
+    -C          : save (or replace) a template
+    -D          : delete a template
+        """
+        self.dispatch(self.__columns_cmd, ln)
+        return self.CONTINUE
+
     def do_console(self, ln):
         """console command
         """
@@ -583,6 +942,10 @@ class _CommandInterpreter(cmd.Cmd):
         self.__connmap = {}
         self.__have_region_names = False
         self.__cache.clear()
+        self.__name_index.clear()
+        self.__inventory.set_account(self.__creds.aws_key_id)
+        if self.__prefetcher is not None:
+            self.__prefetcher.reset()
 
     def __cred_cmd(self, argv):
         """Implements the cred command
@@ -720,12 +1083,114 @@ Options:
         self.dispatch(self.__region_cmd, ln)
         return self.CONTINUE
 
+    def __record_cmd(self, argv):
+        """Implements the record command
+        """
+        append = False
+        opt_list, args = getopt.getopt(argv, "a")
+        for opt in opt_list:
+            if opt[0] == '-a':
+                append = True
+        recorder = self.__api_recorder
+        if not args:
+            if recorder.mode == recorder.RECORD:
+                print "Recording to %s (%d requests)" % \
+                        (recorder.get_path(), recorder.get_exchange_count())
+            else:
+                print "Recording: off"
+            return
+        if len(args) != 1:
+            print "Expecting a single file name or 'off'"
+            return
+        if args[0] == 'off':
+            if recorder.mode == recorder.RECORD:
+                recorder.stop()
+            return
+        record_path = os.path.expandvars(os.path.expanduser(args[0]))
+        try:
+            recorder.start_recording(record_path, append)
+        except IOError, ioe:
+            raise CommandError("Unable to open %s: %s" % (record_path, ioe))
+
+    def do_record(self, ln):
+        """
+        record [-a] file|off
+
+Record the AWS API requests and their responses to the specified file
+(a gzip-compressed file with one JSON object per line), until recording
+is turned off. The recording can be replayed with the 'replay' command.
+Note that the recording contains the full responses, so it may include
+sensitive information.
+
+Options:
+    -a          : append to the file instead of overwriting it
+        """
+        self.dispatch(self.__record_cmd, ln)
+        return self.CONTINUE
+
+    def __replay_cmd(self, argv):
+        """Implements the replay command
+        """
+        strict = True
+        opt_list, args = getopt.getopt(argv, "l")
+        for opt in opt_list:
+            if opt[0] == '-l':
+                strict = False
+        recorder = self.__api_recorder
+        if not args:
+            if recorder.mode == recorder.REPLAY:
+                print "Replaying %s (%d requests)" % \
+                        (recorder.get_path(), recorder.get_exchange_count())
+            else:
+                print "Replay: off"
+            return
+        if len(args) != 1:
+            print "Expecting a single file name or 'off'"
+            return
+        if args[0] == 'off':
+            if recorder.mode == recorder.REPLAY:
+                recorder.stop()
+            return
+        record_path = os.path.expandvars(os.path.expanduser(args[0]))
+        try:
+            recorder.start_replaying(record_path, strict)
+        except (IOError, ValueError, KeyError), ex:
+            raise CommandError("Unable to load %s: %s" % (record_path, ex))
+        #
+        # Cached state may not be consistent with the recording
+        #
+        self.__cache.clear()
+        self.__name_index.clear()
+        self.__zone_cache = {}
+
+    def do_replay(self, ln):
+        """
+        replay [-l] file|off
+
+Serve the AWS API requests from a recording made with the 'record'
+command, instead of sending them to AWS. Identical requests are served
+the recorded responses in the order they were recorded. A request that
+was not recorded fails.
+
+Options:
+    -l          : loose matching; a request that was not recorded is
+                  served the first recorded response of the same API action
+        """
+        self.dispatch(self.__replay_cmd, ln)
+        return self.CONTINUE
+
     def do_rds(self, ln):
         """rds command
         """
         self.__command['rds'].do_rds(ln)
         return self.CONTINUE
 
+    def do_reach(self, ln):
+        """reach command
+        """
+        self.__command['reach'].do_reach(ln)
+        return self.CONTINUE
+
     def do_rtb(self, ln):
         """rtb command
         """
@@ -744,6 +1209,80 @@ Options:
         self.__command['snap'].do_snap(ln)
         return self.CONTINUE
 
+    def __stats_cmd(self, argv):
+        """Implements the stats command
+        """
+        clear_stats = False
+        show_histogram = False
+        output_path = None
+        log_path = None
+        threshold = None
+        opt_list, args = getopt.getopt(argv, "cg:O:t:x")
+        for opt in opt_list:
+            if opt[0] == '-c':
+                clear_stats = True
+            elif opt[0] == '-g':
+                log_path = opt[1]
+            elif opt[0] == '-O':
+                output_path = opt[1]
+            elif opt[0] == '-t':
+                try:
+                    threshold = int(opt[1])
+                except ValueError:
+                    raise CommandError("Bad threshold: %s" % (opt[1],))
+            elif opt[0] == '-x':
+                show_histogram = True
+        if args:
+            print "No arguments expected"
+            return
+        if threshold is not None:
+            self.__api_stats.slow_threshold = threshold / 1000.0
+        if log_path == 'off':
+            self.__api_stats.set_slow_log(None)
+        elif log_path is not None:
+            log_path = os.path.expandvars(os.path.expanduser(log_path))
+            try:
+                self.__api_stats.set_slow_log(log_path)
+            except IOError, ioe:
+                raise CommandError("Unable to open %s: %s" % (log_path, ioe))
+        if clear_stats:
+            self.__api_stats.clear()
+        if clear_stats or log_path is not None or threshold is not None:
+            return
+        with CommandOutput(output_path=output_path) as pg:
+            self.__api_stats.display(pg, show_histogram)
+            slow_log_path = self.__api_stats.get_slow_log()
+            if slow_log_path:
+                pg.prt("Slow calls (>= %d msecs) logged to %s",
+                        self.__api_stats.slow_threshold * 1000,
+                        slow_log_path)
+
+    def do_stats(self, ln):
+        """
+        stats [-c] [-x] [-O output_path] [-g log_file|off] [-t msecs]
+
+Display statistics about the AWS API calls made so far, per
+(service, action, region): number of calls, errors, throttled calls,
+response bytes, and latency (average, 90th percentile, maximum).
+The 90th percentile is reported as the upper bound of its histogram bucket.
+
+Options:
+    -c          : clear the statistics
+    -x          : also display the latency histogram
+    -O path     : write the output to the specified file
+    -g log_file : log calls slower than the threshold to log_file (one JSON
+                  object per line); use 'off' to stop logging. Only the
+                  values of id, name, type, filter and paging parameters
+                  are logged; the other values (e.g. UserData) are
+                  redacted
+    -t msecs    : set the slow call threshold (default: 1000 msecs)
+
+When debug is on, the number of API calls made by each command is
+reported after the command completes.
+        """
+        self.dispatch(self.__stats_cmd, ln)
+        return self.CONTINUE
+
     def do_subnet(self, ln):
         """subnet command
         """
@@ -832,6 +1371,291 @@ Options:
         self.dispatch(self.__zone_cmd, ln)
         return self.CONTINUE
 
+    def __offline_cmd(self, argv):
+        """Implements the offline command
+        """
+        all_regions = False
+        clear_inventory = False
+        list_inventory = False
+        region = None
+        save = None
+        opt_list, args = getopt.getopt(argv, "aclr:s:")
+        for opt in opt_list:
+            if opt[0] == '-a':
+                all_regions = True
+            elif opt[0] == '-c':
+                clear_inventory = True
+            elif opt[0] == '-l':
+                list_inventory = True
+            elif opt[0] == '-r':
+                region = opt[1]
+            elif opt[0] == '-s':
+                if opt[1] not in ('on', 'off'):
+                    raise CommandError("Expecting 'on' or 'off' for -s")
+                save = opt[1] == 'on'
+        if save is not None:
+            self.__inventory.save = save
+        if clear_inventory:
+            self.__inventory.clear()
+        elif list_inventory:
+            if all_regions:
+                self.__find_regions()
+                region_list = sorted(self.__connmap.keys())
+            else:
+                region_list = [region or self.__region]
+            self.__inventory.display(region_list +
+                                        [self.IAM_REGION_NAME])
+        if not args:
+            if not opt_list:
+                print "Offline: %s, saving: %s" % (
+                                'on' if self.__inventory.offline else 'off',
+                                'on' if self.__inventory.save else 'off')
+            return
+        if len(args) != 1 or args[0] not in ('on', 'off'):
+            print "Expecting a single 'on' or 'off' argument"
+            return
+        self.__inventory.offline = args[0] == 'on'
+
+    def do_offline(self, ln):
+        """
+        offline [-l [-a|-r region]] [-c] [-s on|off] [on|off]
+
+When saving is on (-s on), the complete resource lists obtained by the
+list commands (e.g. 'vol -a', but not 'vol -q Name=x') are saved in a
+local inventory (in ~/.clsh/inventory); saving is off by default, and
+saved lists are removed after a week. No responses other than complete
+EC2 resource lists are saved. When offline, the requests of the
+list commands are answered from that inventory, without any AWS requests:
+filters and resource ids are applied locally to the last complete listing
+of each resource type (e.g. the last 'vol -a'), so filtering, ordering and
+counting (-k) work as usual. Each answer is preceded by a banner showing
+the age of the inventory used. Commands that modify AWS state fail
+when offline.
+
+The list commands also accept the -L option to answer just that command
+from the inventory.
+
+Options:
+    -l          : list the inventory of the current region
+    -a          : (with -l) list the inventory of all regions
+    -r region   : (with -l) list the inventory of the specified region
+    -c          : clear the inventory
+    -s on|off   : start/stop saving complete resource lists
+        """
+        self.dispatch(self.__offline_cmd, ln)
+        return self.CONTINUE
+
+    def __profile_cmd(self, argv):
+        """Implements the profile command
+        """
+        top_count = profiling.DEFAULT_TOP_COUNT
+        dump_dir = None
+        opt_list, args = getopt.getopt(argv, "d:n:")
+        for opt in opt_list:
+            if opt[0] == '-d':
+                dump_dir = os.path.expandvars(os.path.expanduser(opt[1]))
+                if not os.path.isdir(dump_dir):
+                    raise CommandError("Not a directory: %s" % (dump_dir,))
+            elif opt[0] == '-n':
+                try:
+                    top_count = int(opt[1])
+                except ValueError:
+                    raise CommandError("Bad count: %s" % (opt[1],))
+        if not args:
+            print "Profile: %s" % ('on' if self.__profiler else 'off',)
+            return
+        action = args[0].lower()
+        if action in ('on', 'off') and len(args) != 1:
+            print "No arguments expected after '%s'" % (action,)
+            return
+        if action == 'on':
+            if self.__profiler is None:
+                self.__profiler = profiling.CommandProfiler()
+            self.__profiler.top_count = top_count
+            self.__profiler.dump_dir = dump_dir
+        elif action == 'off':
+            self.__profiler = None
+        elif action == 'dump':
+            if len(args) != 2:
+                print "Expecting a file name"
+                return
+            if self.__profiler is None:
+                print "Profiling is off"
+                return
+            dump_path = os.path.expandvars(os.path.expanduser(args[1]))
+            if not self.__profiler.dump(dump_path):
+                print "No profiled commands"
+        else:
+            print "Expecting one of 'on', 'off', 'dump'"
+
+    def __new_prefetch_conn(self, region):
+        """Returns a new connection for the idle prefetcher; its requests
+        are not recorded or accounted for
+        """
+        conn = boto.vpc.connect_to_region(region,
+                                aws_access_key_id=self.__creds.aws_key_id,
+                                aws_secret_access_key=self.__creds.aws_key_val)
+        if conn is None:
+            raise CommandError("%s is not a valid region name" % (region,))
+        return self.__inventory.instrument(conn, 'ec2', region, prefetch=True)
+
+    def __prefetch_display(self):
+        """Display the prefetch settings, plan and last idle period
+        """
+        prefetcher = self.__prefetcher
+        if prefetcher is None:
+            print "Prefetch: off"
+            return
+        print "Prefetch: on (budget=%d calls, idle=%d secs, max-age=%d secs)" \
+                % (prefetcher.budget, prefetcher.idle_secs, prefetcher.max_age)
+        for command, region in prefetcher.get_plan():
+            age = self.__inventory.get_fresh_age('ec2', region,
+                                                *prefetch.get_listing(command))
+            print "    %-8s %-16s %s" % (command, region,
+                    "-" if age is None else "%d secs old" % (age,))
+        print "Prefetch API calls: %d, lists refreshed: %d" % \
+                                (prefetcher.n_calls, prefetcher.n_refreshed)
+        if prefetcher.last_error:
+            print "Last error: %s" % (prefetcher.last_error,)
+        print "Requests served from prefetched lists: %d" % \
+                                        (self.__inventory.fresh_serve_count,)
+
+    def __prefetch_cmd(self, argv):
+        """Implements the prefetch command
+        """
+        budget = None
+        idle_secs = None
+        max_age = None
+        opt_list, args = getopt.getopt(argv, "b:i:m:")
+        for opt in opt_list:
+            try:
+                value = int(opt[1])
+            except ValueError:
+                raise CommandError("Bad number: %s" % (opt[1],))
+            if value < 0:
+                raise CommandError("Bad number: %s" % (opt[1],))
+            if opt[0] == '-b':
+                budget = value
+            elif opt[0] == '-i':
+                idle_secs = value
+            elif opt[0] == '-m':
+                max_age = value
+        if len(args) > 1 or (args and args[0] not in ('on', 'off')):
+            print "Expecting a single 'on' or 'off' argument"
+            return
+        if args and args[0] == 'off':
+            if self.__prefetcher is not None:
+                self.__prefetcher.pause()
+                self.__prefetcher = None
+            self.__inventory.fresh_max_age = None
+            return
+        if args and self.__prefetcher is None:
+            self.__prefetcher = prefetch.IdlePrefetcher(self.__inventory,
+                                                self.__new_prefetch_conn)
+        prefetcher = self.__prefetcher
+        if prefetcher is None:
+            if opt_list:
+                print "Prefetch is off"
+            else:
+                self.__prefetch_display()
+            return
+        if budget is not None:
+            prefetcher.budget = budget
+        if idle_secs is not None:
+            prefetcher.idle_secs = idle_secs
+        if max_age is not None:
+            prefetcher.max_age = max_age
+        self.__inventory.fresh_max_age = prefetcher.max_age
+        if not args and not opt_list:
+            self.__prefetch_display()
+
+    def do_prefetch(self, ln):
+        """
+        prefetch [-b budget] [-i secs] [-m secs] [on|off]
+
+When prefetch is on, the shell uses the time it spends waiting for input
+to refresh the inventory (see 'help offline') with the complete lists of
+the resources most frequently listed according to the command history
+(e.g. the instances of the region used by the most 'inst' commands).
+The list commands that follow are answered from a refreshed list while
+it is younger than the maximum age, without any AWS requests; a command
+that modifies AWS state discards the refreshed lists of its region.
+Without arguments, the settings and the prefetch plan are displayed.
+
+Prefetching is suspended while offline, recording or replaying.
+
+Options:
+    -b budget   : maximum number of API calls per idle period (default: 10)
+    -i secs     : idle time before prefetching starts (default: 2)
+    -m secs     : maximum age of the lists used to answer commands
+                  (default: 60)
+        """
+        self.dispatch(self.__prefetch_cmd, ln)
+        return self.CONTINUE
+
+    def do_profile(self, ln):
+        """
+        profile [-n count] [-d dir] on
+        profile off
+        profile dump file
+
+Profile the execution of commands. When profiling is on, the time spent
+by each command is reported, broken down into the following categories:
+    network     : network I/O (including waiting for AWS responses)
+    xml-parse   : parsing of the XML responses
+    objects     : construction of the boto objects
+    rendering   : clsh code, including the output of the results
+    other       : everything else
+
+followed by the functions where most of the time was spent.
+
+Options:
+    -n count    : number of functions to report (default: 10)
+    -d dir      : also save the profile of each command in the specified
+                  directory, in pstats format
+
+The 'dump' argument saves the profile of the last profiled command
+in the specified file, in pstats format.
+        """
+        #
+        # The profile command itself is never profiled
+        #
+        self.__dispatch(self.__profile_cmd, ln)
+        return self.CONTINUE
+
+    def __prefetch_history(self):
+        """Returns the command history (oldest first)
+        """
+        return [readline.get_history_item(i) or '' for i in
+                        xrange(1, readline.get_current_history_length() + 1)]
+
+    def __prefetch_resume(self):
+        """Start an idle period of the prefetcher (if enabled)
+        """
+        if self.__prefetcher is None or self.__inventory.offline or \
+                self.__api_recorder.mode != apirecord.ApiRecorder.OFF:
+            return
+        self.__prefetcher.resume(self.__prefetch_history(), self.__region)
+
+    def preloop(self):
+        """Invoked before the first prompt
+        """
+        self.__prefetch_resume()
+
+    def precmd(self, ln):
+        """Invoked when a command line is entered
+        """
+        if self.__prefetcher is not None:
+            self.__prefetcher.pause()
+        return ln
+
+    def postcmd(self, stop, ln):
+        """Invoked after a command is executed, before the next prompt
+        """
+        if not stop:
+            self.__prefetch_resume()
+        return stop
+
     def do_quit(self, ln):
         """quit
         Exits the CLI
@@ -857,7 +1681,11 @@ The list-options are:
     -a          : all resources
     -f spec     : resources matching the specified filter spec; the spec
                   has the form: key=value
+    -I file     : resources with the ids in the specified file ('-' for
+                  the standard input); the ids are separated by whitespace
+                  or commas (inst, vol, snap, ami only)
     -l          : long listing
+    -L          : answer from the offline inventory (see 'help offline')
     -O file     : send output to file (in addition to stdout)
     -q tag_spec : resources matching the specified tag_spec; the tag_spec
                   has the form key[=value] or =value
@@ -871,6 +1699,38 @@ The list-options are:
         print
 
 
+    def help_pipelines(self):
+        """Provide help information on pipelines
+        """
+        _ = self      # quiesce pylint
+        print """
+        command [args] | command [args] [| ...]
+
+The list commands can be combined in pipelines. Each command passes the
+resources it selected (instead of displaying them) to the next command,
+which lists the resources related to them; for example
+    inst -a -z stopped | vol -l
+lists the volumes of the stopped instances, and
+    vol -a -z available | snap -l
+lists the snapshots of the unattached volumes. The resources are related
+as follows:
+    inst    : ami, eni, elb, inst, sg, subnet, vol, vpc
+    ami     : ami, inst, snap
+    elb     : elb, inst
+    eni     : eni, inst, sg, subnet
+    sg      : eni, inst, sg
+    snap    : ami, snap, vol
+    subnet  : eni, inst, subnet, vpc
+    vol     : inst, snap, vol
+    vpc     : eni, inst, sg, subnet, vpc
+The resources passed to a command of the same type (e.g. inst -a | inst -l)
+are not described again unless the command has filters. The commands
+following the first one use the region of the first command.
+A '|' separates commands when it is preceded by a space or followed by
+one of the commands above; otherwise (e.g. snap -m 'a|b' or snap -m a|b)
+it is part of an argument.
+"""
+
     def do_exit(self, ln):
         """exit
         Exits the CLI
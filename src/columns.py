@@ -0,0 +1,296 @@
+#
+# Copyright 2014-2016 CloudVelox Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains the column projections used by the -y option
+of the listing commands, and the saved column templates managed by the
+'columns' command.
+
+A column spec is a comma-separated list of column names, for example
+    id,state,type,tag:Name,private_ip
+The available columns of each resource type are defined by an accessor
+table; only the requested fields are extracted and formatted.
+"""
+
+import os
+import tempfile
+
+from common import amazon2localtime
+from common import CommandError
+
+_DEFAULT_TEMPLATE_FILE = os.path.join(os.environ.get('HOME', '/'),
+                                                ".clsh", "columns")
+
+_TAG_COLUMN_PREFIX = 'tag:'
+
+
+def _value(attr):
+    """Returns an accessor for the specified record attribute
+    """
+    return lambda record: getattr(record, attr)
+
+
+def _time(attr):
+    """Returns an accessor for the specified (Amazon-formatted) time
+    attribute of a record; the time is displayed in local time
+    """
+    def accessor(record):
+        value = getattr(record, attr)
+        return amazon2localtime(value) if value else None
+    return accessor
+
+
+def _join(attr):
+    """Returns an accessor for a record attribute holding a list
+    """
+    return lambda record: ",".join(getattr(record, attr)) or None
+
+
+#
+# Key: resource type
+# Value: list of (column-name, accessor) tuples; the accessor returns
+#        the column value given a record
+#
+_COLUMN_TABLE_MAP = {
+    'instance' : [
+        ('id', _value('id')),
+        ('state', _value('state')),
+        ('zone', _value('placement')),
+        ('type', _value('instance_type')),
+        ('launch_time', _time('launch_time')),
+        ('arch', _value('architecture')),
+        ('virt', _value('virtualization_type')),
+        ('hypervisor', _value('hypervisor')),
+        ('platform', _value('platform')),
+        ('image', _value('image_id')),
+        ('kernel', _value('kernel')),
+        ('ramdisk', _value('ramdisk')),
+        ('root_device', _value('root_device_name')),
+        ('root_type', _value('root_device_type')),
+        ('ebs_optimized', _value('ebs_optimized')),
+        ('vpc', _value('vpc_id')),
+        ('subnet', _value('subnet_id')),
+        ('public_ip', _value('ip_address')),
+        ('private_ip', _value('private_ip_address')),
+        ('groups', _join('group_ids')),
+        ('volumes', lambda inst: ",".join([bdev.volume_id
+                                for bdev in inst.block_devices]) or None),
+        ],
+    'volume' : [
+        ('id', _value('id')),
+        ('status', _value('status')),
+        ('zone', _value('zone')),
+        ('size', _value('size')),
+        ('type', _value('type')),
+        ('iops', _value('iops')),
+        ('snapshot', _value('snapshot_id')),
+        ('create_time', _time('create_time')),
+        ('instance', _value('attach_instance_id')),
+        ('device', _value('attach_device')),
+        ('attach_status', _value('attach_status')),
+        ('attach_time', _time('attach_time')),
+        ],
+    'snapshot' : [
+        ('id', _value('id')),
+        ('status', _value('status')),
+        ('progress', _value('progress')),
+        ('start_time', _time('start_time')),
+        ('size', _value('volume_size')),
+        ('volume', _value('volume_id')),
+        ('description', _value('description')),
+        ],
+    'image' : [
+        ('id', _value('id')),
+        ('state', _value('state')),
+        ('name', _value('name')),
+        ('description', _value('description')),
+        ('location', _value('location')),
+        ('public', _value('is_public')),
+        ('owner', _value('owner_id')),
+        ('arch', _value('architecture')),
+        ('virt', _value('virtualization_type')),
+        ('hypervisor', _value('hypervisor')),
+        ('platform', _value('platform')),
+        ('kernel', _value('kernel_id')),
+        ('ramdisk', _value('ramdisk_id')),
+        ('root_device', _value('root_device_name')),
+        ('root_type', _value('root_device_type')),
+        ('snapshots', lambda ami: ",".join([bdev.snapshot_id
+                                for bdev in ami.block_devices
+                                    if bdev.snapshot_id]) or None),
+        ],
+    }
+
+
+def get_resource_types():
+    """Returns the list of resource types that support column projections
+    """
+    return sorted(_COLUMN_TABLE_MAP)
+
+
+def get_column_names(res_type):
+    """Returns the list of column names available for res_type
+    """
+    return [name for name, _ in _COLUMN_TABLE_MAP[res_type]]
+
+
+class ColumnProjection(object):
+    """A list of columns to display for resources of a particular type
+    """
+    def __init__(self, res_type, column_spec):
+        accessor_map = dict(_COLUMN_TABLE_MAP[res_type])
+        #
+        # List of (header, accessor) tuples
+        #
+        self.__column_list = []
+        for name in column_spec.split(','):
+            name = name.strip()
+            if not name:
+                continue
+            if name.startswith(_TAG_COLUMN_PREFIX):
+                tag_key = name[len(_TAG_COLUMN_PREFIX):]
+                if not tag_key:
+                    raise CommandError("Missing tag key in column: %s" %
+                                                                (name,))
+                header = tag_key
+                accessor = lambda record, key=tag_key: record.tags.get(key)
+            elif name in accessor_map:
+                header = name.upper()
+                accessor = accessor_map[name]
+            else:
+                raise CommandError(
+                        "Unknown %s column: %s; available columns: %s" %
+                        (res_type, name,
+                            ", ".join(get_column_names(res_type) +
+                                        [_TAG_COLUMN_PREFIX + "<key>"])))
+            self.__column_list.append((header, accessor))
+        if not self.__column_list:
+            raise CommandError("No columns specified")
+
+    def display(self, record_list, pg):
+        """Display the records in record_list, one per line. The column
+        widths are those of the widest value of each column.
+        """
+        row_list = []
+        for record in record_list:
+            row = []
+            for _, accessor in self.__column_list:
+                value = accessor(record)
+                if value is None or value == '':
+                    value = '-'
+                elif not isinstance(value, basestring):
+                    value = str(value)
+                row.append(value)
+            row_list.append(row)
+        header = [header for header, _ in self.__column_list]
+        width_list = [len(column_header) for column_header in header]
+        for row in row_list:
+            for i, cell in enumerate(row):
+                if len(cell) > width_list[i]:
+                    width_list[i] = len(cell)
+        #
+        # The last column is not padded
+        #
+        fmt = " ".join(["%%-%ds" % (width,) for width in width_list[:-1]] +
+                                                                        ["%s"])
+        pg.prt(fmt, *header)
+        for row in row_list:
+            pg.prt(fmt, *row)
+
+
+class ColumnTemplates(object):
+    """The saved column templates. A template is a named column spec for
+    a particular resource type. The templates are stored in a file,
+    one per line, as
+        res_type name column_spec
+    """
+    def __init__(self, template_path=_DEFAULT_TEMPLATE_FILE):
+        self.__template_path = template_path
+
+    def load(self):
+        """Returns a dictionary with key (res_type, name) and value
+        the column spec
+        """
+        template_map = {}
+        try:
+            with open(self.__template_path) as template_file:
+                for ln in template_file:
+                    fields = ln.split()
+                    if len(fields) == 3 and fields[0] in _COLUMN_TABLE_MAP:
+                        template_map[(fields[0], fields[1])] = fields[2]
+        except IOError:
+            pass
+        return template_map
+
+    def __store(self, template_map):
+        """Atomically replace the template file with the templates in
+        template_map
+        """
+        template_dir = os.path.dirname(self.__template_path)
+        if not os.path.isdir(template_dir):
+            os.makedirs(template_dir, 0700)
+        fd, tmp_path = tempfile.mkstemp(dir=template_dir)
+        try:
+            with os.fdopen(fd, "w") as tmp_file:
+                for res_type, name in sorted(template_map):
+                    tmp_file.write("%s %s %s\n" % (res_type, name,
+                                        template_map[(res_type, name)]))
+            os.rename(tmp_path, self.__template_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def save(self, res_type, name, column_spec):
+        """Save a template; the column spec is validated first
+        """
+        if res_type not in _COLUMN_TABLE_MAP:
+            raise CommandError("Bad resource type: %s; available types: %s" %
+                                (res_type, ", ".join(get_resource_types())))
+        if not name or name.startswith('@'):
+            raise CommandError("Bad template name: %s" % (name,))
+        column_spec = column_spec.replace(' ', '')
+        ColumnProjection(res_type, column_spec)
+        template_map = self.load()
+        template_map[(res_type, name)] = column_spec
+        self.__store(template_map)
+
+    def delete(self, res_type, name):
+        """Delete a template; returns False if it does not exist
+        """
+        template_map = self.load()
+        if template_map.pop((res_type, name), None) is None:
+            return False
+        self.__store(template_map)
+        return True
+
+    def get_projection(self, res_type, spec):
+        """Returns the ColumnProjection for spec, which is either a column
+        spec or @name, where name identifies a saved template
+        """
+        if spec.startswith('@'):
+            template_map = self.load()
+            column_spec = template_map.get((res_type, spec[1:]))
+            if column_spec is None:
+                raise CommandError("No %s column template named %s" %
+                                                        (res_type, spec[1:]))
+            spec = column_spec
+        return ColumnProjection(res_type, spec)
+
+
+def get_projection(res_type, spec):
+    """Returns the ColumnProjection for the spec of a -y option
+    """
+    return ColumnTemplates().get_projection(res_type, spec)
@@ -21,11 +21,48 @@
 import calendar
 import itertools
 import os
+import Queue
+import random
 import re
 import subprocess
 import sys
+import threading
 import time
 
+#
+# Maximum number of threads used when issuing API requests concurrently
+#
+DEFAULT_MAX_THREADS = 8
+
+#
+# AWS error codes indicating that a request was throttled
+#
+_THROTTLE_ERROR_CODES = frozenset([
+                        'RequestLimitExceeded',
+                        'Throttling',
+                        'ThrottlingException',
+                        ])
+_THROTTLE_MAX_RETRIES = 8
+_THROTTLE_INITIAL_DELAY = 0.5   # seconds
+_THROTTLE_MAX_DELAY = 20.0      # seconds
+
+#
+# Maximum number of pages fetched ahead of the page being processed
+#
+DEFAULT_PREFETCH_PAGES = 2
+
+#
+# Maximum number of resource ids per Describe request when describing
+# long lists of resources (this is also the AWS limit on the number of
+# values of a filter)
+#
+DESCRIBE_CHUNK_SIZE = 200
+
+#
+# Maximum number of missing resource ids reported by describe_ids()
+#
+_MAX_REPORTED_MISSING_IDS = 10
+
 class CommandError(Exception):
     """This exception is raised when a command fails
     """
@@ -152,6 +189,339 @@ def read_file_contents(path, description):
         return None
 
 
+def is_throttle_error(ex):
+    """Returns True if the exception ex was caused by AWS throttling
+    our requests
+    """
+    return getattr(ex, 'error_code', None) in _THROTTLE_ERROR_CODES
+
+
+def is_not_found_error(ex):
+    """Returns True if the exception ex was caused by a request for
+    a resource that does not exist (e.g. InvalidVolume.NotFound)
+    """
+    return (getattr(ex, 'error_code', None) or '').endswith('.NotFound')
+
+
+def retry_throttled(func, *args, **kwargs):
+    """Invoke func(*args, **kwargs) and return its result. If the invocation
+    fails because the request was throttled, retry it using exponential
+    backoff (with jitter).
+    """
+    delay = _THROTTLE_INITIAL_DELAY
+    for _ in xrange(_THROTTLE_MAX_RETRIES):
+        try:
+            return func(*args, **kwargs)
+        except Exception, ex:
+            if not is_throttle_error(ex):
+                raise
+        time.sleep(delay + random.uniform(0, delay))
+        delay = min(delay * 2, _THROTTLE_MAX_DELAY)
+    return func(*args, **kwargs)
+
+
+def chunk_list(item_list, chunk_size):
+    """Returns a list of lists, each containing up to chunk_size
+    consecutive items of item_list
+    """
+    return [item_list[i:i+chunk_size]
+                        for i in xrange(0, len(item_list), chunk_size)]
+
+
+def concurrent_map(func, arg_list, max_threads=DEFAULT_MAX_THREADS):
+    """Invoke func on each element of arg_list, using up to max_threads
+    threads, and return the list of results (in arg_list order).
+    If any of the invocations raises an exception, no further invocations
+    are started and the first exception is re-raised once the running
+    invocations complete.
+    """
+    n_threads = min(max_threads, len(arg_list))
+    if n_threads <= 1:
+        return [func(arg) for arg in arg_list]
+    result_list = [None] * len(arg_list)
+    exc_info_list = []
+    work_queue = Queue.Queue()
+    for work_item in enumerate(arg_list):
+        work_queue.put(work_item)
+
+    def worker():
+        """Process work items until there are none left
+        """
+        while not exc_info_list:
+            try:
+                index, arg = work_queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                result_list[index] = func(arg)
+            except Exception:
+                exc_info_list.append(sys.exc_info())
+
+    thread_list = [threading.Thread(target=worker) for _ in xrange(n_threads)]
+    for thread in thread_list:
+        thread.daemon = True
+        thread.start()
+    for thread in thread_list:
+        #
+        # Join with a timeout so that the main thread remains
+        # responsive to KeyboardInterrupt
+        #
+        while thread.is_alive():
+            thread.join(0.5)
+    if exc_info_list:
+        exc_type, exc_value, exc_tb = exc_info_list[0]
+        raise exc_type, exc_value, exc_tb
+    return result_list
+
+
+def concurrent_chunk_map(func, item_iter, chunk_size,
+                                        max_threads=DEFAULT_MAX_THREADS):
+    """Invoke func on consecutive chunks (lists) of up to chunk_size items
+    of item_iter, using up to max_threads threads, and return the list of
+    (chunk, result) tuples in item_iter order. The items are consumed
+    incrementally: the first chunks are processed while the rest of the
+    items are being read. Exceptions are handled as in concurrent_map().
+    """
+    result_list = []
+    exc_info_list = []
+    #
+    # The queue is bounded so that we do not read the items much faster
+    # than they are processed
+    #
+    work_queue = Queue.Queue(max_threads * 2)
+    thread_list = []
+
+    def worker():
+        """Process work items until the end-of-work marker (None)
+        """
+        while True:
+            work_item = work_queue.get()
+            if work_item is None:
+                return
+            index, chunk = work_item
+            if exc_info_list:
+                continue
+            try:
+                result_list[index] = (chunk, func(chunk))
+            except Exception:
+                exc_info_list.append(sys.exc_info())
+
+    def put(work_item):
+        """Queue a work item, starting a new thread if all are busy
+        """
+        if len(thread_list) < max_threads and \
+                        (work_queue.qsize() > 0 or not thread_list):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            thread_list.append(thread)
+        while True:
+            try:
+                work_queue.put(work_item, timeout=0.5)
+                return
+            except Queue.Full:
+                pass
+
+    chunk = []
+    try:
+        for item in item_iter:
+            chunk.append(item)
+            if len(chunk) == chunk_size:
+                result_list.append(None)
+                put((len(result_list) - 1, chunk))
+                chunk = []
+                if exc_info_list:
+                    break
+        if chunk and not exc_info_list:
+            result_list.append(None)
+            put((len(result_list) - 1, chunk))
+    finally:
+        for _ in thread_list:
+            put(None)
+        for thread in thread_list:
+            #
+            # Join with a timeout so that the main thread remains
+            # responsive to KeyboardInterrupt
+            #
+            while thread.is_alive():
+                thread.join(0.5)
+    if exc_info_list:
+        exc_type, exc_value, exc_tb = exc_info_list[0]
+        raise exc_type, exc_value, exc_tb
+    return result_list
+
+
+def read_resource_ids(path):
+    """Generator that returns the resource ids in the file at path
+    ('-' for the standard input). The ids are separated by whitespace
+    or commas; text following a '#' is ignored. The file is read one
+    line at a time.
+    """
+    if path == '-':
+        id_file = sys.stdin
+    else:
+        try:
+            id_file = open(os.path.expanduser(path))
+        except IOError, ioe:
+            raise CommandError("Unable to read %s: %s" % (path, ioe))
+    try:
+        for ln in iter(id_file.readline, ''):
+            for res_id in ln.split('#', 1)[0].replace(',', ' ').split():
+                yield res_id
+    finally:
+        if id_file is not sys.stdin:
+            id_file.close()
+
+
+def describe_ids(describe, id_filter_name, selector):
+    """Describe the resources with the ids in the selector's
+    resource_id_list and id input file, in chunks of DESCRIBE_CHUNK_SIZE
+    ids issued concurrently. The ids are passed as values of the
+    filter id_filter_name (e.g. volume-id), so that unknown ids do not
+    fail the request; the other filters of the selector also apply.
+    describe is invoked with a filter dictionary and returns a list of
+    records. Returns the list of records in id order; missing ids are
+    reported.
+    """
+    filter_dict = selector.get_filter_dict() or {}
+    seen_id_set = set()
+
+    def iter_ids():
+        """Generator returning the selected ids without duplicates
+        """
+        id_iter = selector.resource_id_list or []
+        if selector.id_input_path:
+            id_iter = itertools.chain(id_iter,
+                                    read_resource_ids(selector.id_input_path))
+        for res_id in id_iter:
+            if res_id not in seen_id_set:
+                seen_id_set.add(res_id)
+                yield res_id
+
+    def describe_chunk(id_list):
+        chunk_filter_dict = dict(filter_dict)
+        chunk_filter_dict[id_filter_name] = id_list
+        return describe(chunk_filter_dict)
+
+    record_list = []
+    missing_id_list = []
+    for id_list, chunk_record_list in concurrent_chunk_map(describe_chunk,
+                                            iter_ids(), DESCRIBE_CHUNK_SIZE):
+        record_map = dict([(record.id, record)
+                                        for record in chunk_record_list])
+        for res_id in id_list:
+            record = record_map.get(res_id)
+            if record is not None:
+                record_list.append(record)
+            elif not filter_dict:
+                missing_id_list.append(res_id)
+    if missing_id_list:
+        print "%d id(s) not found: %s%s" % (len(missing_id_list),
+                    ", ".join(missing_id_list[:_MAX_REPORTED_MISSING_IDS]),
+                    ", ..." if len(missing_id_list) >
+                                    _MAX_REPORTED_MISSING_IDS else "")
+    return record_list
+
+
+def use_describe_ids(selector):
+    """Returns True if the resources selected by selector should be
+    described via describe_ids()
+    """
+    return bool(selector.id_input_path) or \
+                len(selector.resource_id_list or []) > DESCRIBE_CHUNK_SIZE
+
+
+class PagePrefetcher(object):
+    """Iterates over the pages of a paginated listing. The pages are
+    fetched by a background thread, so that the request for the next page
+    is in progress while the caller processes (e.g. displays) the current
+    one; at most max_pages_ahead pages are fetched ahead.
+
+    fetch_page(token) returns the tuple (page, next_token); it is first
+    invoked with a token of None, and the listing ends when next_token
+    is empty. An exception raised by fetch_page is re-raised in the
+    iterating thread.
+
+    The prefetcher should be used as a context manager, so that the
+    background thread stops if the iteration is abandoned (for example,
+    because the user quit the pager).
+    """
+
+    __END = object()
+
+    def __init__(self, fetch_page, max_pages_ahead=DEFAULT_PREFETCH_PAGES):
+        self.__fetch_page = fetch_page
+        self.__queue = Queue.Queue(max_pages_ahead)
+        self.__cancelled = threading.Event()
+        self.__thread = None
+
+    def __put(self, item):
+        """Add item to the queue; returns False if the prefetcher
+        was cancelled while waiting for space in the queue
+        """
+        while not self.__cancelled.is_set():
+            try:
+                self.__queue.put(item, timeout=0.5)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def __fetch_pages(self):
+        """Fetch the pages until there are no more, or until cancelled
+        """
+        token = None
+        try:
+            while not self.__cancelled.is_set():
+                page, token = self.__fetch_page(token)
+                if not self.__put((page, None)):
+                    return
+                if not token:
+                    break
+        except Exception:
+            self.__put((None, sys.exc_info()))
+            return
+        self.__put(self.__END)
+
+    def __iter__(self):
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__fetch_pages)
+            self.__thread.daemon = True
+            self.__thread.start()
+        while True:
+            #
+            # Wait with a timeout so that the main thread remains
+            # responsive to KeyboardInterrupt
+            #
+            try:
+                item = self.__queue.get(timeout=0.5)
+            except Queue.Empty:
+                continue
+            if item is self.__END:
+                return
+            page, exc_info = item
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            yield page
+
+    def cancel(self):
+        """Stop fetching pages
+        """
+        self.__cancelled.set()
+        try:
+            while True:
+                self.__queue.get_nowait()
+        except Queue.Empty:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, trcbk):
+        self.cancel()
+        return False
+
+
 class CommandOutput(object):
     """Process command output
     """
@@ -246,29 +616,42 @@ class ResourceSelector(object):
         self.__filter_dict = {}
         self.select_all = False
         self.resource_id_list = None
+        self.resource_name_list = None
         self.match_pattern = None
+        # id_input_path is the path of a file with the ids of the
+        # selected resources ('-' for the standard input)
+        self.id_input_path = None
+        # The names resolved to ids by BaseCommand.resolve_resource_names,
+        # and the ids obtained from them
+        self.resolved_name_list = None
+        self.resolved_id_set = None
 
     def has_selection(self):
         return self.select_all or self.resource_id_list or \
+                self.resource_name_list or self.id_input_path or \
                 self.__filter_dict or self.match_pattern
 
     def is_explicit(self):
-        return bool(self.resource_id_list)
+        return bool(self.resource_id_list or self.resource_name_list)
 
     def set_resource_ids(self, res_id_list, res_prefix=None):
         """When we want information for particular resources (say
         instances) which are specified explicitly, allow the user
         to specify either the resource id, or the value of the
         'Name' tag. Effectively, this allows one to list resources
-        by name.
+        by name. The names are kept in resource_name_list until
+        they are resolved to resource ids (see
+        BaseCommand.resolve_resource_names)
         """
         resource_id_list = []
+        resource_name_list = []
         for res_id in res_id_list:
             if res_prefix and res_id.startswith(res_prefix):
                 resource_id_list.append(res_id)
             else:
-                self.add_tag_filter_spec('Name=' + res_id)
+                resource_name_list.append(res_id)
         self.resource_id_list = resource_id_list
+        self.resource_name_list = resource_name_list
 
     def add_filter(self, key, value):
         """Add a filter
@@ -365,6 +748,9 @@ class DisplayOptions(object):
         self.display_count = False
         self.filter_dict = {}
         self.custom = None
+        # columns is a columns.ColumnProjection; when set, it is used
+        # instead of the standard layouts
+        self.columns = None
         # __display_order_list is a list of (callable, boolean) tuples.
         # The callable is suitable to be used as the 'key' argument to
         # list.sort and the boolean sets the 'reverse' argument of list.sort;
@@ -442,6 +828,131 @@ class BaseCommand(object):
         """
         self.__interp.cache_remove(res_id_list)
 
+    def name_index_insert(self, region, res_type, resource_list):
+        """Record the Name tags of the resources in resource_list;
+        res_type is the resource type used by the tags API (for
+        example, 'instance')
+        """
+        self.__interp.name_index_insert(region, res_type, resource_list)
+
+    def resolve_resource_names(self, region, res_type, selector):
+        """Resolve the resource names in the selector to resource ids
+        (which are added to the selector's resource_id_list).
+        Returns False if names were specified but none of them could
+        be resolved and there are no resource ids in the selector,
+        i.e. when there is nothing to select.
+        """
+        name_list = selector.resource_name_list
+        if not name_list:
+            return True
+        res_id_list, unresolved_name_list = \
+                self.__interp.name_index_resolve(region, res_type, name_list)
+        if unresolved_name_list:
+            print "Unknown %s name(s): %s" % (res_type,
+                                        ", ".join(unresolved_name_list))
+        selector.resource_name_list = None
+        if selector.resource_id_list is None:
+            selector.resource_id_list = []
+        selected_id_set = set(selector.resource_id_list)
+        selector.resolved_name_list = name_list
+        selector.resolved_id_set = set()
+        for res_id in res_id_list:
+            if res_id not in selected_id_set:
+                selected_id_set.add(res_id)
+                selector.resolved_id_set.add(res_id)
+                selector.resource_id_list.append(res_id)
+        return bool(selector.resource_id_list)
+
+    @staticmethod
+    def __has_stale_names(selector, record_list):
+        """Returns True if record_list shows that some of the ids
+        resolved from names in the selector are stale: a resource
+        no longer has the name, or (when nothing else may exclude it)
+        it is missing
+        """
+        name_set = set(selector.resolved_name_list)
+        found_id_set = set()
+        for record in record_list:
+            if record.id in selector.resolved_id_set:
+                if record.tags.get('Name') not in name_set:
+                    return True
+                found_id_set.add(record.id)
+        if selector.get_filter_dict() or selector.match_pattern:
+            return False
+        return found_id_set != selector.resolved_id_set
+
+    def describe_named(self, region, res_type, selector, describe):
+        """Returns the result of describe(), which describes the resources
+        selected by selector. The ids that resolve_resource_names obtained
+        from the name index may be stale, if the resources were deleted or
+        renamed since they were indexed. When describe() fails with a
+        NotFound error, or returns a list of records showing stale ids,
+        the names are resolved again with the tags API and describe()
+        is retried once.
+        """
+        if not selector.resolved_name_list:
+            return describe()
+        try:
+            result = describe()
+            if result is None or \
+                            not self.__has_stale_names(selector, result):
+                return result
+        except Exception, ex:
+            if not is_not_found_error(ex):
+                raise
+        name_list = selector.resolved_name_list
+        selector.resource_id_list = [res_id
+                        for res_id in selector.resource_id_list
+                            if res_id not in selector.resolved_id_set]
+        selector.resource_name_list = name_list
+        selector.resolved_name_list = None
+        selector.resolved_id_set = None
+        self.__interp.name_index_evict(region, res_type, name_list)
+        if not self.resolve_resource_names(region, res_type, selector):
+            return []
+        return describe()
+
+    def output_is_piped(self):
+        """Returns True if the command passes its resources to the
+        next command of a pipeline
+        """
+        return self.__interp.output_is_piped()
+
+    def pipe_output(self, region, res_type, record_list):
+        """Pass the resources in record_list to the next command of the
+        pipeline; res_type is the resource type used by the tags API.
+        Returns True if the resources were passed, in which case they
+        should not be displayed.
+        """
+        return self.__interp.pipe_output(region, res_type, record_list)
+
+    def pipe_select(self, region, res_type, selector):
+        """Add to the selector the resources of type res_type related to
+        the resources passed by the previous command of the pipeline.
+        Returns False if there is nothing to select.
+        """
+        return self.__interp.pipe_select(region, res_type, selector)
+
+    def pipe_records(self, res_type, selector):
+        """Returns the resources passed by the previous command of the
+        pipeline if they are those selected by selector (so that they do
+        not need to be described again), otherwise None
+        """
+        return self.__interp.pipe_records(res_type, selector)
+
+    def use_offline_inventory(self):
+        """Serve the API requests of the current command from the
+        offline inventory
+        """
+        self.__interp.use_offline_inventory()
+
+    def needs_complete_lists(self):
+        """Returns True if list requests should ask for the complete
+        list instead of a page of it, so that they can be saved to, or
+        served from, the offline inventory
+        """
+        return self.__interp.needs_complete_lists()
+
     def is_valid_zone(self, region, zone_name):
         """Returns True if zone_name is a valid zone name for the specified
         region
@@ -453,6 +964,11 @@ class BaseCommand(object):
         """
         return self.__interp.get_valid_zone_names(region)
 
+    def get_region_names(self):
+        """Returns the list of AWS region names
+        """
+        return self.__interp.get_region_names()
+
     def do_help(self, argv):
         """Displays help information
         """
@@ -19,29 +19,126 @@
 """
 
 import getopt
+import httplib
+import Queue
+import threading
+
+from boto.exception import BotoServerError
 
 import common
 
+from common import CommandError
 from common import CommandOutput
 
+#
+# Polling intervals (in seconds) used in follow mode; the interval
+# doubles every time the console output of an instance is found unchanged,
+# up to the maximum, and it is reset to the minimum when new output appears.
+#
+_FOLLOW_MIN_INTERVAL = 2.0
+_FOLLOW_MAX_INTERVAL = 60.0
+
+#
+# Length of the tail of the already-seen output that we look for
+# in new output
+#
+_OVERLAP_LENGTH = 256
+
+
+def _new_console_text(seen_text, cur_text):
+    """Returns the part of cur_text that follows seen_text. The console
+    output reported by EC2 is a sliding window over the instance's
+    console output, so the head of seen_text may have scrolled out of
+    cur_text.
+    """
+    if not seen_text:
+        return cur_text
+    if cur_text.startswith(seen_text):
+        return cur_text[len(seen_text):]
+    tail = seen_text[-_OVERLAP_LENGTH:]
+    index = cur_text.rfind(tail)
+    if index < 0:
+        # No overlap; either the instance produced a lot of output
+        # between polls, or it was restarted.
+        return cur_text
+    return cur_text[index+len(tail):]
+
+
+class _ConsoleFollower(threading.Thread):
+    """Poll the console output of an instance, and place the new
+    lines in a queue (as (instance-id, line) tuples)
+    """
+    def __init__(self, ec2_conn, instance_id, line_queue, stop_event):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.__ec2_conn = ec2_conn
+        self.__instance_id = instance_id
+        self.__line_queue = line_queue
+        self.__stop_event = stop_event
+        #
+        # The most recently retrieved console output, up to the last line
+        # we reported; it always ends at a newline since a partial line
+        # may be extended by subsequent output.
+        #
+        self.__seen_text = ''
+
+    def __poll(self):
+        """Returns True if new console output was found
+        """
+        output_obj = common.retry_throttled(self.__ec2_conn.get_console_output,
+                                                self.__instance_id)
+        cur_text = output_obj.output
+        if not cur_text:
+            return False
+        new_text = _new_console_text(self.__seen_text, cur_text)
+        eol_index = new_text.rfind('\n')
+        if eol_index < 0:
+            return False
+        self.__seen_text = cur_text[:len(cur_text)-len(new_text)+eol_index+1]
+        new_text = new_text[:eol_index+1]
+        for ln in new_text.split('\n'):
+            if ln:
+                self.__line_queue.put((self.__instance_id, ln.rstrip()))
+        return True
+
+    @staticmethod
+    def __is_transient_error(ex):
+        """Returns True if ex is an error that may go away if we try
+        again later: a throttled request, an AWS server-side error,
+        or a network error
+        """
+        if isinstance(ex, BotoServerError):
+            return common.is_throttle_error(ex) or ex.status >= 500
+        return isinstance(ex, (IOError, httplib.HTTPException))
+
+    def run(self):
+        """Poll the console output until we are told to stop, or until
+        an unrecoverable error (e.g. InvalidInstanceID.NotFound) occurs;
+        after a transient error, we back off and keep polling.
+        """
+        interval = _FOLLOW_MIN_INTERVAL
+        while not self.__stop_event.is_set():
+            try:
+                if self.__poll():
+                    interval = _FOLLOW_MIN_INTERVAL
+                else:
+                    interval = min(interval * 2, _FOLLOW_MAX_INTERVAL)
+            except Exception, ex:
+                if self.__is_transient_error(ex):
+                    interval = min(interval * 2, _FOLLOW_MAX_INTERVAL)
+                    self.__stop_event.wait(interval)
+                    continue
+                self.__line_queue.put((self.__instance_id,
+                                "Failed to get console output: %s" % (ex,)))
+                return
+            self.__stop_event.wait(interval)
+
 
 class ConsoleCommand(common.BaseCommand):
-    def __console_cmd(self, argv):
-        """Implements the console command
+
+    def __console_display(self, region, instance_id, output_file):
+        """Display the console output of the specified instance
         """
-        region = None
-        output_file = None
-        opt_list, _ = getopt.getopt(argv, "O:r:")
-        if opt_list:
-            for opt in opt_list:
-                if opt[0] == '-O':
-                    output_file = opt[1]
-                elif opt[0] == '-r':
-                    region = opt[1]
-        if len(argv) != 1:
-            print "Expecting a single instance-id"
-            return
-        instance_id = argv[0]
         ec2_conn = self.get_ec2_conn(region)
         output_obj = ec2_conn.get_console_output(instance_id)
         self.cache_insert(region, [instance_id])
@@ -55,10 +152,78 @@ class ConsoleCommand(common.BaseCommand):
                 if ln:
                     pg.prt("%s", ln.rstrip())
 
+    def __console_follow(self, region, instance_id_list, output_file):
+        """Poll the console output of the specified instances concurrently,
+        and display new lines (prefixed by the instance-id) as they
+        appear; this continues until the user hits ^C, or until the
+        console output of none of the instances can be retrieved.
+        """
+        ec2_conn = self.get_ec2_conn(region)
+        self.cache_insert(region, instance_id_list)
+        line_queue = Queue.Queue()
+        stop_event = threading.Event()
+        follower_list = [_ConsoleFollower(ec2_conn, instance_id,
+                                                line_queue, stop_event)
+                                for instance_id in instance_id_list]
+        for follower in follower_list:
+            follower.start()
+        with CommandOutput(paginated_output=False,
+                                        output_path=output_file) as pg:
+            try:
+                while True:
+                    try:
+                        instance_id, ln = line_queue.get(timeout=0.5)
+                    except Queue.Empty:
+                        #
+                        # A follower that stops (because of an error)
+                        # queues its last line before exiting
+                        #
+                        if not [follower for follower in follower_list
+                                                if follower.is_alive()]:
+                            print "No console output left to follow"
+                            break
+                        continue
+                    pg.prt("%s: %s", instance_id, ln)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                stop_event.set()
+
+    def __console_cmd(self, argv):
+        """Implements the console command
+        """
+        region = None
+        output_file = None
+        follow = False
+        opt_list, args = getopt.getopt(argv, "fO:r:")
+        if opt_list:
+            for opt in opt_list:
+                if opt[0] == '-f':
+                    follow = True
+                elif opt[0] == '-O':
+                    output_file = opt[1]
+                elif opt[0] == '-r':
+                    region = opt[1]
+        if follow:
+            if not args:
+                raise CommandError("Expecting one or more instance-ids")
+            self.__console_follow(region, args, output_file)
+        else:
+            if len(args) != 1:
+                print "Expecting a single instance-id"
+                return
+            self.__console_display(region, args[0], output_file)
+
     def do_console(self, ln):
-        """console [std-options] instance-id
+        """console [std-options] [-f] instance-id ...
 
         Retrieve the console output of the specified instance
+
+Options:
+    -f          : follow the console output of the specified instance(s);
+                  new output lines are displayed as they appear, prefixed by
+                  the instance-id (hit ^C to stop); following stops if
+                  the console output of none of the instances can be
+                  retrieved
         """
         self.dispatch(self.__console_cmd, ln)
-
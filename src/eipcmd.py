@@ -20,19 +20,37 @@
 
 import getopt
 
+import boto
+
 import common
 
 from common import CommandError
 from common import DisplayOptions
 from common import CommandOutput
 from common import ResourceSelector
+from common import concurrent_map
 from common import optional
+from common import retry_throttled
+from records import instance_records
 
 
 class EIPCommand(common.BaseCommand):
     """Implements the 'eip' command
     """
 
+    #
+    # Usage report findings, in display order
+    #
+    IDLE = 'idle'
+    DETACHED_ENI = 'detached-eni'
+    STOPPED_INSTANCE = 'stopped-instance'
+    FINDING_LIST = [IDLE, DETACHED_ENI, STOPPED_INSTANCE]
+
+    #
+    # States of an instance that does not use its addresses
+    #
+    STOPPED_INSTANCE_STATES = ['stopping', 'stopped']
+
     @staticmethod
     def __eip_display(address, disp, pg):
         """Display info about the specified address
@@ -73,6 +91,115 @@ class EIPCommand(common.BaseCommand):
             for address in address_list:
                 self.__eip_display(address, disp, pg)
 
+    def __eip_fetch_usage_data(self, region_list):
+        """Returns a dictionary with key a region name and value the
+        tuple (address_list, eni_list, stopped_instance_list); the
+        requests for all regions are issued concurrently. Regions where
+        the requests fail are reported and omitted.
+        """
+        #
+        # The connections are created before we start any threads
+        #
+        conn_map = dict([(region, (self.get_ec2_conn(region),
+                                        self.get_vpc_conn(region)))
+                                            for region in region_list])
+
+        def fetch(work_item):
+            """Returns the tuple (result, error-message)
+            """
+            region, res_type = work_item
+            ec2_conn, vpc_conn = conn_map[region]
+            try:
+                if res_type == 'address':
+                    result = retry_throttled(ec2_conn.get_all_addresses)
+                elif res_type == 'network-interface':
+                    result = retry_throttled(
+                                    vpc_conn.get_all_network_interfaces)
+                else:
+                    result = instance_records(retry_throttled(
+                            ec2_conn.get_all_instances,
+                            filters={'instance-state-name' :
+                                        self.STOPPED_INSTANCE_STATES}))
+                return result, None
+            except boto.exception.BotoServerError, serverr:
+                return None, serverr.error_code or str(serverr.status)
+
+        work_list = [(region, res_type) for region in region_list
+                        for res_type in ('address', 'network-interface',
+                                                                'instance')]
+        result_map = {}
+        error_map = {}
+        for (region, _), (result, errmsg) in zip(work_list,
+                                        concurrent_map(fetch, work_list)):
+            if errmsg is not None:
+                error_map[region] = errmsg
+            else:
+                result_map.setdefault(region, []).append(result)
+        if error_map:
+            print "Skipped region(s): %s" % (", ".join(
+                        ["%s (%s)" % (region, error_map[region])
+                                        for region in sorted(error_map)]),)
+        return dict([(region, tuple(result_list))
+                        for region, result_list in result_map.iteritems()
+                            if region not in error_map])
+
+    def __eip_usage_cmd(self, region_list):
+        """Report the addresses that are not in use: idle addresses,
+        addresses associated with stopped instances, and addresses of
+        detached network interfaces
+        """
+        report_list = []
+        n_addresses = 0
+        usage_data_map = self.__eip_fetch_usage_data(region_list)
+        for region, (address_list, eni_list, instance_list) in \
+                                                usage_data_map.iteritems():
+            n_addresses += len(address_list)
+            eni_map = dict([(eni.id, eni) for eni in eni_list])
+            stopped_instance_map = dict([(instance.id, instance)
+                                            for instance in instance_list])
+            for address in address_list:
+                eni = eni_map.get(address.network_interface_id)
+                instance_id = address.instance_id
+                if not instance_id and eni is not None and eni.attachment:
+                    instance_id = eni.attachment.instance_id
+                if not (address.association_id or instance_id or
+                                        address.network_interface_id):
+                    finding = self.IDLE
+                elif instance_id in stopped_instance_map:
+                    finding = self.STOPPED_INSTANCE
+                #
+                # The interfaces of NAT gateways, load balancers, etc.
+                # are in use although they are not attached to an instance
+                #
+                elif eni is not None and (eni.attachment is None or
+                                                eni.status != 'in-use'):
+                    finding = self.DETACHED_ENI
+                else:
+                    continue
+                report_list.append((self.FINDING_LIST.index(finding),
+                                        region, address.public_ip, finding,
+                                        instance_id,
+                                        address.network_interface_id,
+                                        address.allocation_id))
+        report_list.sort()
+        with CommandOutput() as pg:
+            for _, region, public_ip, finding, instance_id, eni_id, \
+                                            allocation_id in report_list:
+                pg.prt("%-14s %-16s %-16s %-12s %-12s %s",
+                        region, public_ip, finding,
+                        optional(instance_id),
+                        optional(eni_id),
+                        optional(allocation_id))
+            count_map = {}
+            for report in report_list:
+                count_map[report[3]] = count_map.get(report[3], 0) + 1
+            pg.prt("%d address(es) in %d region(s): %d idle, "
+                    "%d on stopped instances, %d on detached ENIs",
+                    n_addresses, len(usage_data_map),
+                    count_map.get(self.IDLE, 0),
+                    count_map.get(self.STOPPED_INSTANCE, 0),
+                    count_map.get(self.DETACHED_ENI, 0))
+
     def __eip_allocate(self, region, in_vpc, eip_list):
         """Implements the EIP allocation functionality
         """
@@ -168,11 +295,12 @@ class EIPCommand(common.BaseCommand):
         cmd_release = False
         cmd_associate = False
         cmd_disassociate = False
+        cmd_usage = False
         move_address = False
         disp = DisplayOptions()
         selector = ResourceSelector()
         region = None
-        opt_list, args = getopt.getopt(argv, "Aaf:lmRr:StXxV")
+        opt_list, args = getopt.getopt(argv, "Aaf:lLmRr:StUXxV")
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
@@ -183,6 +311,8 @@ class EIPCommand(common.BaseCommand):
                     selector.add_filter_spec(opt[1])
                 elif opt[0] == '-l':
                     disp.display = DisplayOptions.LONG
+                elif opt[0] == '-L':
+                    self.use_offline_inventory()
                 elif opt[0] == '-m':
                     move_address = True
                 elif opt[0] == '-R':
@@ -193,6 +323,8 @@ class EIPCommand(common.BaseCommand):
                     cmd_associate = True
                 elif opt[0] == '-t':
                     disp.display_tags = True
+                elif opt[0] == '-U':
+                    cmd_usage = True
                 elif opt[0] == '-X':
                     cmd_disassociate = True
                 elif opt[0] == '-x':
@@ -207,6 +339,13 @@ class EIPCommand(common.BaseCommand):
             self.__eip_associate(region, move_address, args)
         elif cmd_disassociate:
             self.__eip_disassociate(region, args)
+        elif cmd_usage:
+            if selector.select_all:
+                region_list = self.get_region_names()
+            else:
+                region_list = [region or
+                                self.get_ec2_conn(region).region.name]
+            self.__eip_usage_cmd(region_list)
         else:
             selector.resource_id_list = args
             self.__eip_list_cmd(region, selector, disp)
@@ -219,6 +358,10 @@ Options:
     -A          : allocate an elastic IP address
     -R          : release an elastic IP address
     -S          : associate an IP address with an instance
+    -U          : report the addresses that are not in use: idle addresses,
+                  addresses of stopped instances, and addresses of
+                  detached network interfaces; with -a, report on all
+                  regions
     -X          : disassociate an IP address from an instance
     -m          : move an EIP between the instance's interfaces
     -v          : allocate VPC-suitable address
@@ -19,6 +19,7 @@
 """
 
 import getopt
+import time
 
 import boto
 
@@ -27,8 +28,15 @@ import common
 from common import CommandError
 from common import DisplayOptions
 from common import CommandOutput
+from common import PagePrefetcher
+from common import ResourceSelector
 from common import optional
 from common import amazon2localtime
+from common import chunk_list
+from common import concurrent_map
+from common import retry_throttled
+from common import DESCRIBE_CHUNK_SIZE
+from records import instance_records
 
 
 def _boto_min_version(vers):
@@ -47,6 +55,13 @@ def _boto_min_version(vers):
 
 
 class ELBCommand(common.BaseCommand):
+
+    #
+    # Display order of the instance health states; unknown states
+    # are displayed with 'Unknown'
+    #
+    HEALTH_STATE_ORDER = {'OutOfService' : 0, 'Unknown' : 1, 'InService' : 2}
+
     def __elb_display(self, elb, disp, pg, region):
         """Display information about the specified ELB.
         """
@@ -122,15 +137,44 @@ class ELBCommand(common.BaseCommand):
         else:
             pg.prt("%s", elb.name)
 
-    def __elb_list_cmd(self, region, elb_names, disp):
-        """Implement the list functionality of the elb command
+    def __elb_list_cmd(self, region, elb_names, disp, instance_id_list=None):
+        """Implement the list functionality of the elb command. If
+        instance_id_list is specified, only the load balancers of those
+        instances are listed.
         """
         elb_conn = self.get_elb_conn(region)
-        elb_list = elb_conn.get_all_load_balancers(
-                                        load_balancer_names=elb_names)
-        with CommandOutput() as pg:
-            for elb in elb_list:
-                self.__elb_display(elb, disp, pg, region)
+
+        def fetch_page(marker):
+            """Returns the tuple (elb_list, next_marker)
+            """
+            elb_list = elb_conn.get_all_load_balancers(
+                                        load_balancer_names=elb_names,
+                                        marker=marker)
+            return elb_list, elb_list.next_marker
+
+        instance_id_set = set(instance_id_list or [])
+
+        def select(elb_list):
+            """Returns the load balancers to list in elb_list
+            """
+            if not instance_id_set:
+                return elb_list
+            return [elb for elb in elb_list
+                        if instance_id_set.intersection(
+                            [instance_info.id
+                                for instance_info in elb.instances])]
+
+        if self.output_is_piped():
+            piped_elb_list = []
+            with PagePrefetcher(fetch_page) as pages:
+                for elb_list in pages:
+                    piped_elb_list.extend(select(elb_list))
+            self.pipe_output(region, 'load-balancer', piped_elb_list)
+            return
+        with CommandOutput() as pg, PagePrefetcher(fetch_page) as pages:
+            for elb_list in pages:
+                for elb in select(elb_list):
+                    self.__elb_display(elb, disp, pg, region)
 
     @staticmethod
     def __elb_parse_listeners(listener_spec_list):
@@ -267,6 +311,152 @@ class ELBCommand(common.BaseCommand):
                 instance_state.description,)
             self.cache_insert(region, [instance_state.instance_id])
 
+    def __elb_get_names(self, region):
+        """Returns the list of the names of all load balancers
+        """
+        elb_conn = self.get_elb_conn(region)
+
+        def fetch_page(marker):
+            """Returns the tuple (elb_list, next_marker)
+            """
+            elb_list = elb_conn.get_all_load_balancers(marker=marker)
+            return elb_list, elb_list.next_marker
+
+        elb_name_list = []
+        with PagePrefetcher(fetch_page) as pages:
+            for elb_list in pages:
+                elb_name_list.extend([elb.name for elb in elb_list])
+        return elb_name_list
+
+    def __elb_get_health(self, region, elb_name_list):
+        """Returns a dictionary with key the tuple (elb-name, instance-id)
+        and value the InstanceState of the instance; the health of the
+        instances of the load balancers in elb_name_list is requested
+        concurrently.
+        """
+        elb_conn = self.get_elb_conn(region)
+
+        def get_health(elb_name):
+            try:
+                return retry_throttled(elb_conn.describe_instance_health,
+                                                                elb_name)
+            except boto.exception.BotoServerError, serverr:
+                #
+                # The load balancer was deleted after we listed it
+                #
+                if serverr.error_code == 'LoadBalancerNotFound':
+                    return []
+                raise
+
+        health_map = {}
+        for elb_name, instance_state_list in zip(elb_name_list,
+                            concurrent_map(get_health, elb_name_list)):
+            for instance_state in instance_state_list:
+                health_map[(elb_name, instance_state.instance_id)] = \
+                                                            instance_state
+        return health_map
+
+    def __elb_get_instances(self, region, instance_id_list):
+        """Returns a dictionary with key an instance-id of instance_id_list
+        and value the instance record; the instances are described in
+        concurrent batches. Instances that no longer exist are omitted.
+        """
+        ec2_conn = self.get_ec2_conn(region)
+
+        def describe(id_list):
+            return instance_records(retry_throttled(
+                                ec2_conn.get_all_instances,
+                                filters={'instance-id' : id_list}))
+
+        instance_map = {}
+        for instance_list in concurrent_map(describe,
+                        chunk_list(instance_id_list, DESCRIBE_CHUNK_SIZE)):
+            for instance in instance_list:
+                instance_map[instance.id] = instance
+        return instance_map
+
+    def __elb_health_display(self, health_map, instance_map, key_list, pg):
+        """Display the health of the (elb-name, instance-id) pairs
+        in key_list, instances that are not in service first
+        """
+        def sort_key(key):
+            return (self.HEALTH_STATE_ORDER.get(health_map[key].state, 1),
+                                                                        key)
+
+        for key in sorted(key_list, key=sort_key):
+            elb_name, instance_id = key
+            instance_state = health_map[key]
+            instance = instance_map.get(instance_id)
+            pg.prt("%-20s %-12s %-12s %-10s %-12s %-8s '%s'",
+                    elb_name,
+                    instance_id,
+                    instance_state.state,
+                    instance.state if instance else "-",
+                    optional(instance.placement if instance else None),
+                    optional(instance_state.reason_code),
+                    instance_state.description)
+
+    @staticmethod
+    def __elb_health_summary(health_map, elb_name_list, pg):
+        n_unhealthy = len([instance_state
+                            for instance_state in health_map.itervalues()
+                                if instance_state.state != 'InService'])
+        pg.prt("%d instance(s) behind %d ELB(s), %d not in service",
+                    len(health_map), len(elb_name_list), n_unhealthy)
+
+    def __elb_fleet_health(self, region, elb_name_list, watch_interval):
+        """Report the health of the instances of the load balancers in
+        elb_name_list (all load balancers if None), joined with the
+        instance state and availability zone. In watch mode, the health
+        is checked every watch_interval seconds and only the changes are
+        reported, until interrupted.
+        """
+        if elb_name_list is None:
+            elb_name_list = self.__elb_get_names(region)
+        health_map = self.__elb_get_health(region, elb_name_list)
+        instance_id_list = list(set([instance_id
+                                    for _, instance_id in health_map]))
+        instance_map = self.__elb_get_instances(region, instance_id_list)
+        self.cache_insert(region, instance_id_list)
+        with CommandOutput(paginated_output=not watch_interval) as pg:
+            self.__elb_health_display(health_map, instance_map,
+                                                    health_map.keys(), pg)
+            self.__elb_health_summary(health_map, elb_name_list, pg)
+            if not watch_interval:
+                return
+            try:
+                while True:
+                    time.sleep(watch_interval)
+                    new_health_map = self.__elb_get_health(region,
+                                                            elb_name_list)
+                    changed_key_list = [key for key in new_health_map
+                            if key not in health_map or
+                                health_map[key].state !=
+                                    new_health_map[key].state or
+                                health_map[key].reason_code !=
+                                    new_health_map[key].reason_code]
+                    removed_key_list = [key for key in health_map
+                                            if key not in new_health_map]
+                    health_map = new_health_map
+                    if not changed_key_list and not removed_key_list:
+                        continue
+                    #
+                    # Only the instances whose health changed are
+                    # described again
+                    #
+                    instance_map.update(self.__elb_get_instances(region,
+                        list(set([instance_id
+                                    for _, instance_id in changed_key_list]))))
+                    pg.prt("--- %s", time.strftime("%H:%M:%S"))
+                    self.__elb_health_display(health_map, instance_map,
+                                                    changed_key_list, pg)
+                    for elb_name, instance_id in sorted(removed_key_list):
+                        pg.prt("%-20s %-12s %s", elb_name, instance_id,
+                                                            "(removed)")
+                    self.__elb_health_summary(health_map, elb_name_list, pg)
+            except KeyboardInterrupt:
+                pass
+
     @staticmethod
     def __parse_healthcheck(healthcheck_spec):
         """Parse a healthcheck specification and return a HealthCheck object.
@@ -405,7 +595,8 @@ class ELBCommand(common.BaseCommand):
         listener_list = []
         sg_id_list = []
         instance_id_list = []
-        opt_list, args = getopt.getopt(argv, "AaCDg:H:hi:L:lpP:Rr:s:x")
+        watch_interval = None
+        opt_list, args = getopt.getopt(argv, "AaCDg:H:hi:L:lpP:Rr:s:w:x")
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
@@ -439,6 +630,15 @@ class ELBCommand(common.BaseCommand):
                     region = opt[1]
                 elif opt[0] == '-s':
                     subnet_list.extend(opt[1].split(','))
+                elif opt[0] == '-w':
+                    try:
+                        watch_interval = float(opt[1])
+                    except ValueError:
+                        raise CommandError("Bad watch interval: %s" %
+                                                                (opt[1],))
+                    if watch_interval <= 0:
+                        raise CommandError("Bad watch interval: %s" %
+                                                                (opt[1],))
                 elif opt[0] == '-x':
                     disp.display = DisplayOptions.EXTENDED
         if cmd_create_elb:
@@ -463,12 +663,31 @@ class ELBCommand(common.BaseCommand):
         elif cmd_config_healthcheck:
             self.__elb_config_healthcheck(region, healthcheck_spec, args)
         elif cmd_query_instance_health:
-            self.__elb_instance_health(region, args)
+            if all_elbs or len(args) > 1 or watch_interval:
+                if not all_elbs and not args:
+                    raise CommandError("No ELB specified")
+                self.__elb_fleet_health(region,
+                                        None if all_elbs else args,
+                                        watch_interval)
+            else:
+                self.__elb_instance_health(region, args)
         else:
-            if all_elbs or args:
+            #
+            # When used in a pipeline, we select the load balancers by name
+            # or by instance (the ELB API has no filters)
+            #
+            selector = ResourceSelector()
+            selector.resource_id_list = args
+            if not self.pipe_select(region, 'load-balancer', selector):
+                return
+            filter_dict = selector.get_filter_dict() or {}
+            elb_names = selector.resource_id_list
+            instance_id_list = filter_dict.get('instance-id')
+            if all_elbs or elb_names or instance_id_list:
                 self.__elb_list_cmd(region,
-                                    None if all_elbs else args,
-                                    disp)
+                                    None if all_elbs or not elb_names
+                                        else elb_names,
+                                    disp, instance_id_list)
 
     def do_elb(self, ln):
         """
@@ -487,7 +706,10 @@ Options:
                         ht  : healthy threshold
                         ut  : unhealthy threshold
                         l   : link
-    -h          : query instance health
+    -h          : query instance health; with -a, or with several ELBs,
+                  the health of the instances of all (specified) ELBs is
+                  reported along with the instance state and zone,
+                  instances that are not in service first
     -i list     : a comma-separated instance-id list to add/remove to the ELB
                   (action depends on -A/-R option)
     -L spec     : specify a listener; form lbport,instport,lbproto,instproto[,arn]
@@ -496,6 +718,8 @@ Options:
     -p          : display policies associated with the specified ELB
     -R          : remove a subnet/sg/instance/listener/policy from an ELB
     -s sn,sn,.. : attach ELB to the specified subnet(s)
+    -w secs     : with -h, check the instance health every secs seconds
+                  and report the changes, until interrupted
     -x          : extended output
 
 When creating an ELB, the following information must be provided:
@@ -80,6 +80,8 @@ class ENICommand(common.BaseCommand):
     def __eni_list_cmd(self, region, selector, disp):
         """Implements the list function of the eni command
         """
+        if not self.pipe_select(region, 'network-interface', selector):
+            return
         if not selector.has_selection():
             return
         ec2_conn = self.get_ec2_conn(region)
@@ -91,6 +93,8 @@ class ENICommand(common.BaseCommand):
                                 if eni.id in selector.resource_id_list]
         else:
             disp_eni_list = eni_list
+        if self.pipe_output(region, 'network-interface', disp_eni_list):
+            return
         with CommandOutput() as pg:
             for eni in disp_eni_list:
                 self.__eni_display(eni, disp, pg)
@@ -218,7 +222,7 @@ class ENICommand(common.BaseCommand):
         disp = DisplayOptions()
         selector = ResourceSelector()
         region = None
-        opt_list, args = getopt.getopt(argv, "aBCDd:f:i:lPq:r:StXx")
+        opt_list, args = getopt.getopt(argv, "aBCDd:f:i:lLPq:r:StXx")
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
@@ -238,6 +242,8 @@ class ENICommand(common.BaseCommand):
                     selector.add_filter("attachment.instance-id", opt[1])
                 elif opt[0] == '-l':
                     disp.display = DisplayOptions.LONG
+                elif opt[0] == '-L':
+                    self.use_offline_inventory()
                 elif opt[0] == '-P':
                     cmd_source_dest_check = True
                     source_dest_check = False
@@ -0,0 +1,304 @@
+#
+# Copyright 2014-2016 CloudVelox Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains a fast parser for the responses of the
+DescribeSnapshots and DescribeImages actions.
+
+boto builds its result objects through a (pure Python) SAX handler,
+which dominates the CPU time of large listings. Here the response body
+is parsed with cElementTree's iterparse as it is read from the
+connection, and each item is turned into a record (see records.py) as
+soon as its end tag is seen; the parsed elements are then discarded.
+The count functions only count the items.
+"""
+
+import cStringIO
+
+from xml.etree import cElementTree as ElementTree
+
+import boto.connection
+
+from records import ImageBlockDeviceRecord
+from records import ImageRecord
+from records import SnapshotRecord
+
+#
+# Depth of the items in the response: Response/itemSet/item
+#
+_ITEM_DEPTH = 3
+
+#
+# Shared (and never modified) tag dictionary of untagged resources
+#
+_NO_TAGS = {}
+
+
+def _local_name(tag):
+    """Returns the tag without its namespace
+    """
+    return tag[tag.rfind('}') + 1:]
+
+
+def _text(elem):
+    return elem.text
+
+
+def _interned(elem):
+    text = elem.text
+    if type(text) is str:
+        return intern(text)
+    return text
+
+
+def _int(elem):
+    return int(elem.text) if elem.text else None
+
+
+def _bool(elem):
+    return elem.text == 'true'
+
+
+def _tags(elem):
+    """Returns the tags in a tagSet element as a dictionary
+    """
+    tag_dict = {}
+    for item in elem:
+        key = value = None
+        for child in item:
+            name = _local_name(child.tag)
+            if name == 'key':
+                key = _interned(child)
+            elif name == 'value':
+                value = _interned(child) or ''
+        tag_dict[key] = value
+    return tag_dict or _NO_TAGS
+
+
+def _image_block_devices(elem):
+    """Returns a tuple of ImageBlockDeviceRecord's for the items in
+    a blockDeviceMapping element, ordered by device
+    """
+    bdev_list = []
+    for item in elem:
+        device = snapshot_id = ephemeral_name = None
+        delete_on_termination = False
+        for child in item:
+            name = _local_name(child.tag)
+            if name == 'deviceName':
+                device = _interned(child)
+            elif name == 'virtualName':
+                ephemeral_name = _interned(child)
+            elif name == 'ebs':
+                for ebs_child in child:
+                    ebs_name = _local_name(ebs_child.tag)
+                    if ebs_name == 'snapshotId':
+                        snapshot_id = _text(ebs_child)
+                    elif ebs_name == 'deleteOnTermination':
+                        delete_on_termination = _bool(ebs_child)
+        bdev_list.append(ImageBlockDeviceRecord(device, snapshot_id,
+                                ephemeral_name, delete_on_termination))
+    bdev_list.sort()
+    return tuple(bdev_list)
+
+
+class _ItemSpec(object):
+    """Describes how to turn the items of a Describe response into
+    records
+    """
+    def __init__(self, set_tag, record_class, field_map):
+        #
+        # Tag of the element holding the items
+        #
+        self.set_tag = set_tag
+        self.record_class = record_class
+        #
+        # Key: tag of a child element of an item
+        # Value: (record field, converter) tuple; the converter returns
+        #        the field value given the child element
+        #
+        self.field_map = field_map
+
+    def make_record(self, item):
+        """Returns the record for the item element
+        """
+        field_map = self.field_map
+        record_fields = {'tags' : _NO_TAGS}
+        for child in item:
+            field_spec = field_map.get(_local_name(child.tag))
+            if field_spec is not None:
+                field, converter = field_spec
+                record_fields[field] = converter(child)
+        return self.record_class(**record_fields)
+
+
+_SNAPSHOT_SPEC = _ItemSpec('snapshotSet', SnapshotRecord, {
+        'snapshotId' : ('id', _text),
+        'status' : ('status', _interned),
+        'progress' : ('progress', _interned),
+        'description' : ('description', _text),
+        'startTime' : ('start_time', _text),
+        'volumeSize' : ('volume_size', _int),
+        'volumeId' : ('volume_id', _text),
+        'tagSet' : ('tags', _tags),
+    })
+
+_IMAGE_SPEC = _ItemSpec('imagesSet', ImageRecord, {
+        'imageId' : ('id', _text),
+        'imageState' : ('state', _interned),
+        'imageLocation' : ('location', _text),
+        'name' : ('name', _text),
+        'isPublic' : ('is_public', _bool),
+        'imageOwnerId' : ('owner_id', _interned),
+        'description' : ('description', _text),
+        'architecture' : ('architecture', _interned),
+        'virtualizationType' : ('virtualization_type', _interned),
+        'hypervisor' : ('hypervisor', _interned),
+        'platform' : ('platform', _interned),
+        'kernelId' : ('kernel_id', _interned),
+        'ramdiskId' : ('ramdisk_id', _interned),
+        'rootDeviceName' : ('root_device_name', _interned),
+        'rootDeviceType' : ('root_device_type', _interned),
+        'blockDeviceMapping' : ('block_devices', _image_block_devices),
+        'tagSet' : ('tags', _tags),
+    })
+
+
+def _response_stream(response):
+    """Returns a file-like object for reading the response body.
+    The body of a boto response is read incrementally, unless it has
+    already been read (and cached) by one of the connection wrappers;
+    the responses served from a recording or from the inventory are
+    already in memory.
+    """
+    if isinstance(response, boto.connection.HTTPResponse) and \
+                                        not response._cached_response:
+        return response
+    return cStringIO.StringIO(response.read())
+
+
+def _iter_items(response, set_tag, result):
+    """Generator that returns the item elements in the response body;
+    each element is cleared once the caller moves to the next one.
+    The value of the nextToken element (if any) is stored in
+    result['next_token'].
+    """
+    depth = 0
+    set_elem = None
+    for event, elem in ElementTree.iterparse(_response_stream(response),
+                                                events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == _ITEM_DEPTH - 1 and _local_name(elem.tag) == set_tag:
+                set_elem = elem
+            continue
+        depth -= 1
+        if depth == _ITEM_DEPTH - 1 and set_elem is not None:
+            yield elem
+            #
+            # The set element holds the items parsed so far
+            #
+            set_elem.clear()
+        elif depth == _ITEM_DEPTH - 2:
+            if elem is set_elem:
+                set_elem = None
+            elif _local_name(elem.tag) == 'nextToken':
+                result['next_token'] = elem.text
+
+
+def _describe(ec2_conn, action, params, item_spec, count_only):
+    """Generator that issues the Describe request (following the
+    pagination tokens) and returns a record for each item, or
+    (if count_only is True) None for each item
+    """
+    params = dict(params)
+    while True:
+        response = ec2_conn.make_request(action, params, '/', 'POST')
+        if response.status != 200:
+            body = response.read()
+            boto.log.error('%s %s' % (response.status, response.reason))
+            boto.log.error('%s' % body)
+            raise ec2_conn.ResponseError(response.status,
+                                                response.reason, body)
+        result = {}
+        for item in _iter_items(response, item_spec.set_tag, result):
+            if count_only:
+                yield None
+            else:
+                yield item_spec.make_record(item)
+        next_token = result.get('next_token')
+        if not next_token:
+            return
+        params['NextToken'] = next_token
+
+
+def _snapshot_params(ec2_conn, snapshot_ids, owner, filters):
+    params = {}
+    if snapshot_ids:
+        ec2_conn.build_list_params(params, snapshot_ids, 'SnapshotId')
+    if owner:
+        ec2_conn.build_list_params(params, owner, 'Owner')
+    if filters:
+        ec2_conn.build_filter_params(params, filters)
+    return params
+
+
+def _image_params(ec2_conn, image_ids, owners, filters):
+    params = {}
+    if image_ids:
+        ec2_conn.build_list_params(params, image_ids, 'ImageId')
+    if owners:
+        ec2_conn.build_list_params(params, owners, 'Owner')
+    if filters:
+        ec2_conn.build_filter_params(params, filters)
+    return params
+
+
+def get_snapshot_records(ec2_conn, snapshot_ids=None, owner=None,
+                                                        filters=None):
+    """Returns a list of SnapshotRecord's; the arguments are those
+    of boto's get_all_snapshots()
+    """
+    params = _snapshot_params(ec2_conn, snapshot_ids, owner, filters)
+    return list(_describe(ec2_conn, 'DescribeSnapshots', params,
+                                                _SNAPSHOT_SPEC, False))
+
+
+def count_snapshots(ec2_conn, snapshot_ids=None, owner=None, filters=None):
+    """Returns the number of snapshots that get_snapshot_records()
+    would return
+    """
+    params = _snapshot_params(ec2_conn, snapshot_ids, owner, filters)
+    return sum(1 for _ in _describe(ec2_conn, 'DescribeSnapshots', params,
+                                                _SNAPSHOT_SPEC, True))
+
+
+def get_image_records(ec2_conn, image_ids=None, owners=None, filters=None):
+    """Returns a list of ImageRecord's; the arguments are those
+    of boto's get_all_images()
+    """
+    params = _image_params(ec2_conn, image_ids, owners, filters)
+    return list(_describe(ec2_conn, 'DescribeImages', params,
+                                                _IMAGE_SPEC, False))
+
+
+def count_images(ec2_conn, image_ids=None, owners=None, filters=None):
+    """Returns the number of images that get_image_records()
+    would return
+    """
+    params = _image_params(ec2_conn, image_ids, owners, filters)
+    return sum(1 for _ in _describe(ec2_conn, 'DescribeImages', params,
+                                                _IMAGE_SPEC, True))
@@ -119,7 +119,7 @@ class IGWCommand(common.BaseCommand):
         cmd_delete = False
         cmd_detach = False
         cmd_attach = False
-        opt_list, args = getopt.getopt(argv, "aCDf:lq:rStv:Xx")
+        opt_list, args = getopt.getopt(argv, "aCDf:lLq:rStv:Xx")
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
@@ -132,6 +132,8 @@ class IGWCommand(common.BaseCommand):
                     selector.add_filter_spec(opt[1])
                 elif opt[0] == '-l':
                     disp.display = DisplayOptions.LONG
+                elif opt[0] == '-L':
+                    self.use_offline_inventory()
                 elif opt[0] == '-q':
                     selector.add_tag_filter_spec(opt[1])
                 elif opt[0] == '-r':
@@ -20,15 +20,23 @@
 
 import base64
 import getopt
+import time
 
 import common
 
+from columns import get_projection
 from common import CommandError
 from common import DisplayOptions
 from common import CommandOutput
 from common import ResourceSelector
 from common import amazon2localtime
+from common import chunk_list
+from common import concurrent_map
 from common import confirm
+from common import describe_ids
+from common import retry_throttled
+from common import use_describe_ids
+from records import instance_records
 
 
 def _preprocess(instance_list, disp):
@@ -42,6 +50,31 @@ def _preprocess(instance_list, disp):
         return instance_list
 
 
+def _parse_count_spec(count_spec):
+    """Parse a count spec of the form [min:]max and return the
+    tuple (min_count, max_count)
+    """
+    try:
+        if ':' in count_spec:
+            min_str, max_str = count_spec.split(':', 1)
+            min_count, max_count = int(min_str), int(max_str)
+        else:
+            min_count = max_count = int(count_spec)
+    except ValueError:
+        raise CommandError("Bad instance count: %s" % (count_spec,))
+    if min_count < 1 or max_count < min_count:
+        raise CommandError("Bad instance count: %s" % (count_spec,))
+    return min_count, max_count
+
+
+def _spread_count(count, n_targets):
+    """Spread count across n_targets as evenly as possible; returns
+    a list of n_targets counts
+    """
+    return [count / n_targets + (1 if i < count % n_targets else 0)
+                                        for i in xrange(n_targets)]
+
+
 class InstCommand(common.BaseCommand):
     """Implementation of the 'inst' command
     """
@@ -49,8 +82,20 @@ class InstCommand(common.BaseCommand):
     DEFAULT_INSTANCE_TYPE = "m1.small"
     DEFAULT_EBS_OPTIMIZED = False
 
+    #
+    # Interval (in seconds) between checks of the state of newly
+    # launched instances
+    #
+    LAUNCH_POLL_INTERVAL = 5
+
+    #
+    # Maximum number of instance ids per describe request
+    #
+    DESCRIBE_BATCH_SIZE = 200
+
     def __inst_display(self, instance, disp, pg, region):
-        """Display information about the specified instance.
+        """Display information about the specified instance
+        (an InstanceRecord).
         """
         res_id_list = [instance.id]
         if disp.display == DisplayOptions.LONG:
@@ -102,21 +147,17 @@ class InstCommand(common.BaseCommand):
                 pg.prt("%15s : %-15s idx=%-2s %-16s SDC=%s",
                                 "Interface",
                                 netif.id,
-                                netif.attachment.device_index,
+                                netif.device_index,
                                 netif.private_ip_address,
                                 "on" if netif.source_dest_check else "off"
                                 )
                 res_id_list.append(netif.id)
-            if instance.groups:
-                group_id_list = [group.id for group in instance.groups]
-                pg.prt("%15s : %s", "Groups", " ".join(group_id_list))
-                res_id_list.extend(group_id_list)
-            bdev_list = instance.block_device_mapping.keys()
-            bdev_list.sort()
-            for bdev in bdev_list:
-                bdev_info = instance.block_device_mapping[bdev]
+            if instance.group_ids:
+                pg.prt("%15s : %s", "Groups", " ".join(instance.group_ids))
+                res_id_list.extend(instance.group_ids)
+            for bdev_info in instance.block_devices:
                 pg.prt("%15s : %-12s %-12s %s dot=%s",
-                        "Device", bdev,
+                        "Device", bdev_info.device,
                         bdev_info.volume_id,
                         bdev_info.status,
                         bdev_info.delete_on_termination)
@@ -146,21 +187,46 @@ class InstCommand(common.BaseCommand):
         for instance_state in state_map:
             print "    %12s : %4d" % (instance_state, state_map[instance_state])
 
+    def __inst_describe(self, region, selector):
+        """Returns the list of the instances selected by selector
+        """
+        ec2_conn = self.get_ec2_conn(region)
+        if use_describe_ids(selector):
+            instance_list = describe_ids(
+                        lambda filter_dict: instance_records(
+                            ec2_conn.get_all_instances(filters=filter_dict)),
+                        'instance-id', selector)
+        else:
+            reservation_list = ec2_conn.get_all_instances(
+                                        instance_ids=selector.resource_id_list,
+                                        filters=selector.get_filter_dict())
+            instance_list = instance_records(reservation_list)
+            del reservation_list
+        self.name_index_insert(region, 'instance', instance_list)
+        return instance_list
+
     def __inst_list_cmd(self, region, selector, disp):
         """Implements the list function of the inst command
         """
+        if not self.pipe_select(region, 'instance', selector):
+            return
         if not selector.has_selection():
             return
-        ec2_conn = self.get_ec2_conn(region)
-        reservation_list = ec2_conn.get_all_instances(
-                                        instance_ids=selector.resource_id_list,
-                                        filters=selector.get_filter_dict())
-        instance_list = []
-        for reservation in reservation_list:
-            instance_list.extend(reservation.instances)
+        if not self.resolve_resource_names(region, 'instance', selector):
+            return
+        instance_list = self.pipe_records('instance', selector)
+        if instance_list is None:
+            instance_list = self.describe_named(region, 'instance', selector,
+                            lambda: self.__inst_describe(region, selector))
+        if self.pipe_output(region, 'instance', instance_list):
+            return
         with CommandOutput(output_path=disp.get_output_file()) as pg:
             if disp.display_count:
                 self.__inst_counts(instance_list)
+            elif disp.columns is not None:
+                disp.columns.display(instance_list, pg)
+                self.cache_insert(region,
+                                [instance.id for instance in instance_list])
             else:
                 disp_instance_list = _preprocess(instance_list, disp)
                 for instance in disp_instance_list:
@@ -183,23 +249,96 @@ class InstCommand(common.BaseCommand):
             print "Instances not terminated: %s" % \
                                         (", ".join(list(not_term_set)),)
 
+    def __zone_subnet(self, region, vpc_id, zone_list):
+        """Returns a list with the ids of the subnets of the VPC to use
+        for launching instances in each of the zones in zone_list; when a
+        VPC has multiple subnets in a zone, the one with the most available
+        IP addresses is used.
+        """
+        if vpc_id is None:
+            raise CommandError(
+                "A VPC (-v option) is required when specifying zones")
+        vpc_conn = self.get_vpc_conn(region)
+        subnet_list = vpc_conn.get_all_subnets(
+                                        filters=[('vpc-id', vpc_id)])
+        #
+        # Key: zone name
+        # Value: subnet
+        #
+        zone_subnet_map = {}
+        for subnet in subnet_list:
+            zone = subnet.availability_zone
+            best_subnet = zone_subnet_map.get(zone)
+            if best_subnet is None or \
+                        int(subnet.available_ip_address_count) > \
+                        int(best_subnet.available_ip_address_count):
+                zone_subnet_map[zone] = subnet
+        subnet_id_list = []
+        for zone in zone_list:
+            if zone not in zone_subnet_map:
+                raise CommandError("No subnet of %s in zone %s" %
+                                                        (vpc_id, zone))
+            subnet_id_list.append(zone_subnet_map[zone].id)
+        return subnet_id_list
+
+    def __inst_wait_running(self, region, instance_list):
+        """Wait until all instances in instance_list are running
+        (or have reached some other final state). We use a single
+        (batched) describe request per polling interval.
+        Returns the updated instance list.
+        """
+        ec2_conn = self.get_ec2_conn(region)
+        instance_map = dict([(instance.id, instance)
+                                        for instance in instance_list])
+        pending_id_list = instance_map.keys()
+        print "Waiting for %d instances to start running..." % (
+                                                        len(pending_id_list),)
+        while pending_id_list:
+            time.sleep(self.LAUNCH_POLL_INTERVAL)
+            for id_batch in chunk_list(pending_id_list,
+                                                self.DESCRIBE_BATCH_SIZE):
+                try:
+                    reservation_list = retry_throttled(
+                                        ec2_conn.get_all_instances,
+                                        instance_ids=id_batch)
+                except Exception, ex:
+                    #
+                    # Newly-launched instances may not be visible yet
+                    #
+                    if getattr(ex, 'error_code', None) == \
+                                        'InvalidInstanceID.NotFound':
+                        continue
+                    raise
+                for reservation in reservation_list:
+                    for instance in reservation.instances:
+                        instance_map[instance.id] = instance
+            pending_id_list = [instance_id for instance_id in pending_id_list
+                        if instance_map[instance_id].state == 'pending']
+        return [instance_map[instance.id] for instance in instance_list]
+
     def __inst_run_cmd(self, region, ebs_optimized, instance_type,
-                keypair_name, user_data, shutdown_action, arg_list):
-        """Launch (run) a new instance
+                keypair_name, user_data, shutdown_action,
+                vpc_id, count_spec, wait, arg_list):
+        """Launch (run) new instances
         """
         #
         # We only launch instances in VPC 
         # We need the following information to launch an instance:
         #       * ami-id
         #       * list of security group ids
-        #       * subnet id
+        #       * subnet id(s), or zone(s) (with the VPC specified via -v)
         #       * instance type
         #
         # Since all of these are identified by self-describing strings
         # that do not collide, we scan the argument list to extract
         # the information we need
         #
-        subnet_id = None
+        # When more than one subnet/zone is specified, the instances are
+        # spread across them, with the per-subnet launch requests issued
+        # concurrently.
+        #
+        subnet_id_list = []
+        zone_list = []
         sg_id_list = []
         ami_id = None
         ok_to_launch = True
@@ -207,6 +346,10 @@ class InstCommand(common.BaseCommand):
             ebs_optimized = self.DEFAULT_EBS_OPTIMIZED
         if instance_type is None:
             instance_type = self.DEFAULT_INSTANCE_TYPE
+        if count_spec is None:
+            min_count = max_count = 1
+        else:
+            min_count, max_count = _parse_count_spec(count_spec)
         for arg in arg_list:
             if ',' in arg:
                 for sg_str in arg.split(','):
@@ -220,13 +363,18 @@ class InstCommand(common.BaseCommand):
                 if res_type == 'ami':
                     ami_id = arg
                 elif res_type == 'subnet':
-                    subnet_id = arg
+                    subnet_id_list.append(arg)
                 elif res_type == 'sg':
                     sg_id_list.append(arg)
+                elif self.is_valid_zone(region, arg):
+                    zone_list.append(arg)
+                else:
+                    print "Unexpected argument: %s" % (arg,)
+                    ok_to_launch = False
             else:
                 print "Unexpected argument: %s" % (arg,)
                 ok_to_launch = False
-        if not subnet_id:
+        if not (subnet_id_list or zone_list):
             print "Missing subnet-id"
             ok_to_launch = False
         if not ami_id:
@@ -237,6 +385,13 @@ class InstCommand(common.BaseCommand):
             ok_to_launch = False
         if not ok_to_launch:
             return
+        if zone_list:
+            subnet_id_list.extend(
+                        self.__zone_subnet(region, vpc_id, zone_list))
+        n_subnets = len(subnet_id_list)
+        if max_count < n_subnets:
+            raise CommandError("Cannot spread %d instances across %d subnets"
+                                        % (max_count, n_subnets))
         if user_data:
             user_data_base64 = base64.b64encode(user_data)
         else:
@@ -244,7 +399,16 @@ class InstCommand(common.BaseCommand):
         ec2_conn = self.get_ec2_conn(region)
         if not shutdown_action:
             shutdown_action = None
-        reservation = ec2_conn.run_instances(ami_id,
+
+        def launch(launch_spec):
+            """Launch instances in a subnet; returns the list of
+            launched instances
+            """
+            subnet_id, subnet_min_count, subnet_max_count = launch_spec
+            try:
+                reservation = retry_throttled(ec2_conn.run_instances, ami_id,
+                        min_count=subnet_min_count,
+                        max_count=subnet_max_count,
                         instance_type=instance_type,
                         key_name=keypair_name,
                         user_data=user_data_base64,
@@ -252,9 +416,36 @@ class InstCommand(common.BaseCommand):
                         security_group_ids=sg_id_list,
                         instance_initiated_shutdown_behavior=shutdown_action,
                         ebs_optimized=ebs_optimized)
-        instance = reservation.instances[0]
-        self.cache_insert(region, [instance.id])
-        print instance.id
+            except Exception, ex:
+                print "Failed to launch instances in %s: %s" % (subnet_id, ex)
+                return []
+            return reservation.instances
+
+        #
+        # EC2 requires a MinCount of at least 1 for each launch, so when
+        # min_count is smaller than the number of subnets each subnet
+        # still gets a minimum of 1 instance
+        #
+        launch_spec_list = zip(subnet_id_list,
+                                [max(1, subnet_min_count) for subnet_min_count
+                                    in _spread_count(min_count, n_subnets)],
+                                _spread_count(max_count, n_subnets))
+        instance_list = []
+        for subnet_instance_list in concurrent_map(launch, launch_spec_list):
+            instance_list.extend(subnet_instance_list)
+        self.cache_insert(region, [instance.id for instance in instance_list])
+        if not instance_list:
+            return
+        if wait:
+            instance_list = self.__inst_wait_running(region, instance_list)
+        elif max_count == 1:
+            print instance_list[0].id
+            return
+        for instance in instance_list:
+            print "%-12s %-12s %-16s %s" % (instance.id,
+                                        instance.placement,
+                                        instance.private_ip_address,
+                                        instance.state)
 
     def __inst_start_cmd(self, region, instance_type, instance_id_list):
         """Terminate the specified instances
@@ -320,8 +511,11 @@ class InstCommand(common.BaseCommand):
         keypair_name = None
         user_data = None
         shutdown_action = 'stop'
+        vpc_id = None
+        count_spec = None
+        wait = False
         opt_list, args = getopt.getopt(argv,
-                                "aABc:ef:K:klO:nq:Rr:Ss:Ttu:v:XxZz:")
+                                "aABc:ef:I:K:klLN:O:nq:Rr:Ss:Ttu:v:wXxy:Zz:")
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
@@ -336,12 +530,18 @@ class InstCommand(common.BaseCommand):
                     ebs_optimized = True
                 elif opt[0] == '-f':
                     selector.add_filter_spec(opt[1])
+                elif opt[0] == '-I':
+                    selector.id_input_path = opt[1]
                 elif opt[0] == '-K':
                     keypair_name = opt[1]
                 elif opt[0] == '-k':
                     disp.display_count = True
                 elif opt[0] == '-l':
                     disp.display = DisplayOptions.LONG
+                elif opt[0] == '-L':
+                    self.use_offline_inventory()
+                elif opt[0] == '-N':
+                    count_spec = opt[1]
                 elif opt[0] == '-O':
                     disp.set_output_file(opt[1])
                 elif opt[0] == '-n':
@@ -363,19 +563,29 @@ class InstCommand(common.BaseCommand):
                 elif opt[0] == '-u':
                     user_data = opt[1]
                 elif opt[0] == '-v':
-                    selector.add_filter('vpc-id', opt[1])
+                    vpc_id = opt[1]
+                    selector.add_filter('vpc-id', vpc_id)
+                elif opt[0] == '-w':
+                    wait = True
                 elif opt[0] == '-x':
                     disp.display = DisplayOptions.EXTENDED
+                elif opt[0] == '-y':
+                    disp.columns = get_projection('instance', opt[1])
                 elif opt[0] == '-Z':
                     cmd_stop_instance = True
                 elif opt[0] == '-z':
                     selector.add_filter('instance-state-name', opt[1])
+        if selector.id_input_path and (cmd_terminate or cmd_run_instance or
+                                cmd_start_instance or cmd_stop_instance or
+                                cmd_reboot_instance or cmd_set_attribute):
+            raise CommandError("-I can only be used when listing instances")
         if cmd_terminate:
             self.__inst_terminate_cmd(region, args)
         elif cmd_run_instance:
             self.__inst_run_cmd(region, ebs_optimized, instance_type,
                                         keypair_name, user_data,
-                                        shutdown_action, args)
+                                        shutdown_action, vpc_id,
+                                        count_spec, wait, args)
         elif cmd_start_instance:
             self.__inst_start_cmd(region, instance_type, args)
         elif cmd_stop_instance:
@@ -398,25 +608,44 @@ Options:
     -c type     : instance type (class) to launch or start; the default
                   is m1.small
     -e          : create an EBS-optimized instance (when used with -R)
+    -I file     : list the instances with the ids in file ('-' for the
+                  standard input); the ids are described in batches
     -k          : display instance counts; the instances are grouped by
                   state (running, stopped, etc.)
     -K key-name : name of keypair to pass to new instance
     -n          : display the Name tag of the instance (when used with -l)
-    -R          : run (launch) a new instance
+    -N count    : number of instances to launch (when used with -R); the
+                  count has the form [min:]max; when the instances
+                  are spread across subnets, at least one instance is
+                  launched in each subnet
+    -R          : run (launch) new instance(s)
     -S          : start the specified instance(s)
     -s action   : specify the shutdown action when launching a new instance;
                   values include: 'stop', 'terminate', ''
     -T          : terminate the specified instance(s)
     -u userdata : user-data string to be passed to new instance
     -v vpc_id   : list all the instances running in the specified VPC
+    -w          : wait for the launched instances to be running
+                  (when used with -R)
+    -y columns  : display only the specified columns; columns is a
+                  comma-separated list of column names (tag:<key> is the
+                  value of a tag), or @name for a saved template
+                  (see 'help columns')
     -z status   : display only instances with this status
     -Z          : stop the specified instance(s)
 
-The command arguments when -R is not specified are instance-ids.
+The command arguments when -R is not specified are instance-ids or
+instance names (i.e. values of the Name tag).
 
 The arguments in the case of the -R option should include the ami-id,
 subnet-id and security-group-id(s); the security-group-ids can be specified
 as multiple arguments or as a comma-separated list (or both). The arguments
 can be specified in any order.
+
+Multiple subnet-ids may be specified, in which case the instances are
+spread evenly across the subnets. Zone names may be used instead of
+subnet-ids, in which case the VPC must be specified via -v. Example:
+        inst -R -N 40:50 -w -v vpc-1234abcd ami-12345678 sg-12345678 \\
+                us-east-1a us-east-1b us-east-1c
         """
         self.dispatch(self.__inst_cmd, ln)
@@ -0,0 +1,756 @@
+#
+# Copyright 2014-2016 CloudVelox Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains the persisted inventory used to answer
+list commands in offline mode.
+
+When saving is enabled, the responses to Describe requests that do not
+select specific resources (no filters or resource ids) are saved locally.
+Such a response is the complete list of the resources of that type, and
+it is used in offline mode to answer any request for resources of that
+type: the filters and resource ids of the request are applied locally
+to the saved response. No other responses are saved, and saved lists
+older than _MAX_INVENTORY_AGE are removed.
+
+The complete lists refreshed by the idle prefetcher (see prefetch.py)
+are always saved; they are also used while online, to answer the
+requests made shortly after they were refreshed.
+"""
+
+import fnmatch
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+import xml.etree.cElementTree as ElementTree
+
+from common import CommandError
+
+_DEFAULT_INVENTORY_DIR = os.path.join(os.environ.get('HOME', '/'),
+                                                ".clsh", "inventory")
+
+_READ_ONLY_ACTION_RE = re.compile(r'^(Describe|List|Get)')
+_FILTER_PARAM_RE = re.compile(r'^Filter\.(\d+)\.(Name|Value\.\d+)$')
+_PAGING_PARAMS = frozenset(['MaxResults', 'NextToken'])
+
+#
+# Saved lists older than this (in seconds) are removed
+#
+_MAX_INVENTORY_AGE = 7 * 86400
+
+
+class _ListSpec(object):
+    """Describes the structure of the response of a Describe action
+    that returns a list of resources
+    """
+    def __init__(self, set_tag, id_param_map, item_set_tag=None,
+                                                filter_path_map=None):
+        #
+        # Tag of the element holding the list of items
+        #
+        self.set_tag = set_tag
+        #
+        # Key: request parameter prefix used to specify resource ids
+        # Value: path of the item element holding the id
+        #
+        self.id_param_map = id_param_map
+        #
+        # When the items are nested within the elements of the set
+        # (e.g. instances within reservations), the tag of the nested set
+        #
+        self.item_set_tag = item_set_tag
+        #
+        # Key: filter name
+        # Value: path of item element(s) holding the value to compare against;
+        #        requests with filters not in this map (other than the
+        #        tag filters) cannot be answered from the inventory
+        #
+        self.filter_path_map = filter_path_map or {}
+
+
+_LIST_SPEC_MAP = {
+    'DescribeAddresses' : _ListSpec('addressesSet',
+                {'PublicIp' : 'publicIp', 'AllocationId' : 'allocationId'},
+                filter_path_map={
+                        'public-ip' : 'publicIp',
+                        'allocation-id' : 'allocationId',
+                        'instance-id' : 'instanceId',
+                        'domain' : 'domain',
+                        }),
+    'DescribeAvailabilityZones' : _ListSpec('availabilityZoneInfo',
+                {'ZoneName' : 'zoneName'},
+                filter_path_map={'zone-name' : 'zoneName',
+                                'state' : 'zoneState'}),
+    'DescribeDhcpOptions' : _ListSpec('dhcpOptionsSet',
+                {'DhcpOptionsId' : 'dhcpOptionsId'}),
+    'DescribeImages' : _ListSpec('imagesSet', {'ImageId' : 'imageId'},
+                filter_path_map={
+                        'image-id' : 'imageId',
+                        'owner-id' : 'imageOwnerId',
+                        'state' : 'imageState',
+                        'is-public' : 'isPublic',
+                        'block-device-mapping.snapshot-id' :
+                                'blockDeviceMapping/item/ebs/snapshotId',
+                        }),
+    'DescribeInstances' : _ListSpec('reservationSet',
+                {'InstanceId' : 'instanceId'},
+                item_set_tag='instancesSet',
+                filter_path_map={
+                        'instance-id' : 'instanceId',
+                        'image-id' : 'imageId',
+                        'vpc-id' : 'vpcId',
+                        'subnet-id' : 'subnetId',
+                        'availability-zone' : 'placement/availabilityZone',
+                        'instance-state-name' : 'instanceState/name',
+                        'instance-state-code' : 'instanceState/code',
+                        'instance.group-id' : 'groupSet/item/groupId',
+                        'group-id' : 'groupSet/item/groupId',
+                        'block-device-mapping.volume-id' :
+                                'blockDeviceMapping/item/ebs/volumeId',
+                        'network-interface.network-interface-id' :
+                                'networkInterfaceSet/item/networkInterfaceId',
+                        'ip-address' : 'ipAddress',
+                        }),
+    'DescribeInternetGateways' : _ListSpec('internetGatewaySet',
+                {'InternetGatewayId' : 'internetGatewayId'},
+                filter_path_map={
+                        'internet-gateway-id' : 'internetGatewayId',
+                        'attachment.vpc-id' : 'attachmentSet/item/vpcId',
+                        }),
+    'DescribeKeyPairs' : _ListSpec('keySet', {'KeyName' : 'keyName'}),
+    'DescribeNetworkAcls' : _ListSpec('networkAclSet',
+                {'NetworkAclId' : 'networkAclId'},
+                filter_path_map={
+                        'network-acl-id' : 'networkAclId',
+                        'vpc-id' : 'vpcId',
+                        'association.subnet-id' :
+                                'associationSet/item/subnetId',
+                        }),
+    'DescribeNetworkInterfaces' : _ListSpec('networkInterfaceSet',
+                {'NetworkInterfaceId' : 'networkInterfaceId'},
+                filter_path_map={
+                        'network-interface-id' : 'networkInterfaceId',
+                        'vpc-id' : 'vpcId',
+                        'subnet-id' : 'subnetId',
+                        'attachment.instance-id' : 'attachment/instanceId',
+                        'group-id' : 'groupSet/item/groupId',
+                        }),
+    'DescribeRouteTables' : _ListSpec('routeTableSet',
+                {'RouteTableId' : 'routeTableId'},
+                filter_path_map={
+                        'route-table-id' : 'routeTableId',
+                        'vpc-id' : 'vpcId',
+                        'association.subnet-id' :
+                                'associationSet/item/subnetId',
+                        }),
+    'DescribeSecurityGroups' : _ListSpec('securityGroupInfo',
+                {'GroupId' : 'groupId', 'GroupName' : 'groupName'},
+                filter_path_map={
+                        'group-id' : 'groupId',
+                        'group-name' : 'groupName',
+                        'vpc-id' : 'vpcId',
+                        }),
+    'DescribeSnapshots' : _ListSpec('snapshotSet',
+                {'SnapshotId' : 'snapshotId'},
+                filter_path_map={
+                        'snapshot-id' : 'snapshotId',
+                        'volume-id' : 'volumeId',
+                        'status' : 'status',
+                        'owner-id' : 'ownerId',
+                        }),
+    'DescribeSubnets' : _ListSpec('subnetSet', {'SubnetId' : 'subnetId'},
+                filter_path_map={
+                        'subnet-id' : 'subnetId',
+                        'vpc-id' : 'vpcId',
+                        'availability-zone' : 'availabilityZone',
+                        }),
+    'DescribeTags' : _ListSpec('tagSet', {},
+                filter_path_map={
+                        'key' : 'key',
+                        'value' : 'value',
+                        'resource-id' : 'resourceId',
+                        'resource-type' : 'resourceType',
+                        }),
+    'DescribeVolumes' : _ListSpec('volumeSet', {'VolumeId' : 'volumeId'},
+                filter_path_map={
+                        'volume-id' : 'volumeId',
+                        'status' : 'status',
+                        'availability-zone' : 'availabilityZone',
+                        'attachment.instance-id' :
+                                'attachmentSet/item/instanceId',
+                        'attachment.status' : 'attachmentSet/item/status',
+                        }),
+    'DescribeVpcs' : _ListSpec('vpcSet', {'VpcId' : 'vpcId'},
+                filter_path_map={
+                        'vpc-id' : 'vpcId',
+                        'state' : 'state',
+                        }),
+}
+
+
+def _strip_namespaces(root):
+    """Remove the XML namespace from the tags of all elements, so that
+    the serialized document has no namespace prefixes
+    """
+    for elem in root.getiterator():
+        if elem.tag[0] == '{':
+            elem.tag = elem.tag.split('}', 1)[1]
+
+
+def _parse_selection(params, list_spec):
+    """Returns the tuple (scope_params, id_selection, filter_list) where
+        scope_params    : the params that do not select among resources
+        id_selection    : list of (element-path, value-set) for resource ids
+        filter_list     : list of (filter-name, value-list)
+    """
+    scope_params = {}
+    id_value_map = {}
+    filter_name_map = {}
+    filter_value_map = {}
+    for key, value in params.iteritems():
+        if key in _PAGING_PARAMS:
+            continue
+        match = _FILTER_PARAM_RE.match(key)
+        if match:
+            if match.group(2) == 'Name':
+                filter_name_map[match.group(1)] = value
+            else:
+                filter_value_map.setdefault(match.group(1), []).append(value)
+            continue
+        prefix = key.split('.', 1)[0]
+        if '.' in key and prefix in list_spec.id_param_map:
+            id_value_map.setdefault(prefix, set()).add(value)
+            continue
+        scope_params[key] = value
+    id_selection = [(list_spec.id_param_map[prefix], value_set)
+                        for prefix, value_set in id_value_map.iteritems()]
+    filter_list = [(name, filter_value_map.get(num, []))
+                        for num, name in filter_name_map.iteritems()]
+    return scope_params, id_selection, filter_list
+
+
+class _FilterEngine(object):
+    """Applies EC2-style filters to the items of an XML response;
+    only the filters accepted by _local_filter() can be applied
+    """
+    def __init__(self, list_spec, id_selection, filter_list):
+        self.__list_spec = list_spec
+        self.__id_selection = id_selection
+        #
+        # List of (match-function, value-list)
+        #
+        self.__matcher_list = [self.__make_matcher(name, value_list)
+                                        for name, value_list in filter_list]
+
+    @staticmethod
+    def __value_matches(value, pattern_list):
+        """AWS filter values may contain * and ? wildcards
+        """
+        for pattern in pattern_list:
+            if value == pattern or fnmatch.fnmatchcase(value, pattern):
+                return True
+        return False
+
+    def __make_matcher(self, name, value_list):
+        """Returns a function that checks if an item matches the
+        filter with the specified name and values
+        """
+        value_matches = self.__value_matches
+        if name.startswith('tag:'):
+            tag_key = name[4:]
+
+            def match_tag(item):
+                for tag in item.findall('tagSet/item'):
+                    if tag.findtext('key') == tag_key and \
+                        value_matches(tag.findtext('value') or '', value_list):
+                        return True
+                return False
+            return match_tag
+        if name in ('tag-key', 'tag-value'):
+            path = 'tagSet/item/' + name[4:]
+        else:
+            path = self.__list_spec.filter_path_map[name]
+
+        def match_path(item):
+            for elem in item.findall(path):
+                if value_matches((elem.text or '').strip(), value_list):
+                    return True
+            return False
+        return match_path
+
+    def matches(self, item):
+        """Returns True if the item is selected by the ids and filters
+        """
+        for path, value_set in self.__id_selection:
+            if item.findtext(path) not in value_set:
+                return False
+        for matcher in self.__matcher_list:
+            if not matcher(item):
+                return False
+        return True
+
+    def apply(self, root):
+        """Remove the items not matching the filters from the response
+        document with the specified root
+        """
+        list_spec = self.__list_spec
+        for item_set in root.findall(list_spec.set_tag):
+            for item in list(item_set):
+                if list_spec.item_set_tag is None:
+                    if not self.matches(item):
+                        item_set.remove(item)
+                    continue
+                for nested_set in item.findall(list_spec.item_set_tag):
+                    for nested_item in list(nested_set):
+                        if not self.matches(nested_item):
+                            nested_set.remove(nested_item)
+                    if len(nested_set) == 0:
+                        item_set.remove(item)
+
+
+def _local_filter(name, list_spec):
+    """Returns True if the filter with the specified name is known to be
+    evaluated locally exactly as AWS evaluates it
+    """
+    return name.startswith('tag:') or name in ('tag-key', 'tag-value') or \
+                                        name in list_spec.filter_path_map
+
+
+def _iter_items(root, list_spec):
+    """Generator that returns the items in the response document
+    with the specified root
+    """
+    for item_set in root.findall(list_spec.set_tag):
+        for item in item_set:
+            if list_spec.item_set_tag is None:
+                yield item
+                continue
+            for nested_set in item.findall(list_spec.item_set_tag):
+                for nested_item in nested_set:
+                    yield nested_item
+
+
+def _select(body, list_spec, id_selection, filter_list):
+    """Returns the response document built from the complete resource
+    list in body by applying the resource ids and filters of a request
+    """
+    if not id_selection and not filter_list:
+        return body
+    root = ElementTree.fromstring(body)
+    _strip_namespaces(root)
+    _FilterEngine(list_spec, id_selection, filter_list).apply(root)
+    return ElementTree.tostring(root)
+
+
+def _has_all_ids(body, list_spec, id_selection):
+    """Returns True if the complete resource list in body contains all
+    the resource ids in id_selection
+    """
+    root = ElementTree.fromstring(body)
+    _strip_namespaces(root)
+    for path, value_set in id_selection:
+        found_set = set([item.findtext(path)
+                                for item in _iter_items(root, list_spec)])
+        if not value_set.issubset(found_set):
+            return False
+    return True
+
+
+class _OfflineResponse(object):
+    """Response served from the inventory; it provides what boto uses
+    from an httplib.HTTPResponse
+    """
+    def __init__(self, body):
+        self.status = 200
+        self.reason = 'OK'
+        self.__body = body
+        self.__offset = 0
+
+    def read(self, amt=None):
+        """Without amt, returns the whole body (on every call, like the
+        boto response, which caches it); otherwise returns the next
+        amt bytes of the body, or '' at the end of the body
+        """
+        if amt is None:
+            return self.__body
+        data = self.__body[self.__offset:self.__offset + amt]
+        self.__offset += len(data)
+        return data
+
+    def getheader(self, name, default=None):
+        return default
+
+    def getheaders(self):
+        return []
+
+
+class Inventory(object):
+    """Persists the responses of read-only API requests, and serves
+    requests from them when offline.
+    """
+    def __init__(self, inventory_dir=_DEFAULT_INVENTORY_DIR):
+        self.__inventory_dir = inventory_dir
+        self.__account_dir = None
+        self.__lock = threading.Lock()
+        #
+        # When True, the complete resource lists obtained by the
+        # commands are saved in the inventory
+        #
+        self.save = False
+        #
+        # When True, all requests are served from the inventory
+        #
+        self.offline = False
+        #
+        # When True, the requests of the current command are served
+        # from the inventory
+        #
+        self.offline_command = False
+        #
+        # The inventory files used for the current command (so that we
+        # display a single banner per file)
+        #
+        self.__banner_path_set = set()
+        #
+        # When not None, read-only requests are served (while online)
+        # from the complete resource lists that were prefetched less than
+        # fresh_max_age seconds ago (see prefetch.py)
+        #
+        self.fresh_max_age = None
+        #
+        # Number of requests served from prefetched resource lists
+        #
+        self.fresh_serve_count = 0
+        #
+        # Key: (service, region, inventory-path) of a prefetched complete
+        #      resource list
+        # Value: time when the list was prefetched
+        #
+        self.__fresh_map = {}
+        #
+        # Key: (service, region)
+        # Value: time of the last request that may have modified AWS state
+        #
+        self.__invalidate_time_map = {}
+
+    def set_account(self, aws_key_id):
+        """Set the account whose inventory we use; we do not use
+        the key id itself in the path name.
+        """
+        self.__account_dir = os.path.join(self.__inventory_dir,
+                                hashlib.sha1(aws_key_id).hexdigest()[:16])
+        with self.__lock:
+            self.__fresh_map = {}
+        self.prune()
+
+    def is_offline(self):
+        """Returns True if requests are currently served from the inventory
+        """
+        return self.offline or self.offline_command
+
+    def needs_complete_lists(self):
+        """Returns True if list requests should ask for the complete
+        list instead of a page of it, since only complete lists are
+        saved to, or served from, the inventory
+        """
+        return self.save or self.is_offline()
+
+    def end_command(self):
+        """Invoked at the end of each command
+        """
+        self.offline_command = False
+        self.__banner_path_set = set()
+
+    @staticmethod
+    def __param_digest(params):
+        """Returns a digest identifying the specified request parameters
+        """
+        param_str = '&'.join(["%s=%s" % (key, params[key])
+                                                for key in sorted(params)])
+        return hashlib.sha1(param_str).hexdigest()[:16]
+
+    def __region_dir(self, service, region):
+        return os.path.join(self.__account_dir, service, region)
+
+    def __full_path(self, service, region, action, scope_params):
+        """Returns the path of the complete resource list obtained
+        via a request with the specified (non-selecting) params
+        """
+        return os.path.join(self.__region_dir(service, region), "%s-%s.xml.gz"
+                                % (action, self.__param_digest(scope_params)))
+
+    def __save(self, inv_path, body):
+        """Atomically save body in inv_path
+        """
+        inv_dir = os.path.dirname(inv_path)
+        with self.__lock:
+            if not os.path.isdir(inv_dir):
+                os.makedirs(inv_dir, 0700)
+        fd, tmp_path = tempfile.mkstemp(dir=inv_dir)
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                with gzip.GzipFile(fileobj=tmp_file, mode="wb",
+                                                compresslevel=1) as gz_file:
+                    gz_file.write(body)
+            os.rename(tmp_path, inv_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def __list_path(self, service, region, action, params):
+        """Returns the inventory path of the response to a request with
+        the specified params if that response is a complete resource
+        list, otherwise None.
+        """
+        list_spec = _LIST_SPEC_MAP.get(action)
+        if list_spec is None:
+            return None
+        scope_params, id_selection, filter_list = \
+                                    _parse_selection(params, list_spec)
+        #
+        # A single page of a paginated list is not a complete list
+        #
+        if id_selection or filter_list or \
+                                _PAGING_PARAMS.intersection(params):
+            return None
+        return self.__full_path(service, region, action, scope_params)
+
+    def __banner(self, action, inv_path):
+        """Display the age of the inventory (once per command); requests
+        may be served concurrently (e.g. by 'tag -S'), so the banners
+        are displayed while holding the lock
+        """
+        with self.__lock:
+            if inv_path in self.__banner_path_set:
+                return
+            self.__banner_path_set.add(inv_path)
+            self.__print_banner(action, inv_path)
+
+    @staticmethod
+    def __print_banner(action, inv_path):
+        mtime = os.path.getmtime(inv_path)
+        age = int(time.time() - mtime)
+        if age < 120:
+            age_str = "%d secs" % (age,)
+        elif age < 7200:
+            age_str = "%d mins" % (age / 60,)
+        elif age < 2 * 86400:
+            age_str = "%d hours" % (age / 3600,)
+        else:
+            age_str = "%d days" % (age / 86400,)
+        print "[offline] %s as of %s (%s old)" % (action,
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime)),
+                age_str)
+
+    @staticmethod
+    def __load(inv_path):
+        with gzip.open(inv_path, "rb") as gz_file:
+            return gz_file.read()
+
+    def __serve(self, service, region, action, params):
+        """Returns the response to a request, built from the inventory
+        """
+        if not _READ_ONLY_ACTION_RE.match(action):
+            raise CommandError("%s is not available offline" % (action,))
+        list_spec = _LIST_SPEC_MAP.get(action)
+        if list_spec is not None:
+            scope_params, id_selection, filter_list = \
+                                        _parse_selection(params, list_spec)
+            for name, _ in filter_list:
+                if not _local_filter(name, list_spec):
+                    raise CommandError("Filter %s cannot be answered offline"
+                                                                % (name,))
+            full_path = self.__full_path(service, region, action,
+                                                        scope_params)
+            if os.path.exists(full_path):
+                self.__banner(action, full_path)
+                return _OfflineResponse(_select(self.__load(full_path),
+                                    list_spec, id_selection, filter_list))
+        raise CommandError("No offline inventory for %s in %s" %
+                                                        (action, region))
+
+    def __serve_fresh(self, service, region, action, params):
+        """Returns the response to a read-only request built from a
+        prefetched complete resource list, or None if there is no such
+        list younger than fresh_max_age. Requests whose answer might
+        differ from the AWS answer (pagination, filters that we cannot
+        evaluate exactly, resource ids not in the list) are not served.
+        """
+        list_spec = _LIST_SPEC_MAP.get(action)
+        if list_spec is None or _PAGING_PARAMS.intersection(params):
+            return None
+        scope_params, id_selection, filter_list = \
+                                    _parse_selection(params, list_spec)
+        for name, _ in filter_list:
+            if not _local_filter(name, list_spec):
+                return None
+        full_path = self.__full_path(service, region, action, scope_params)
+        with self.__lock:
+            fresh_time = self.__fresh_map.get((service, region, full_path))
+        if fresh_time is None or \
+                        time.time() - fresh_time > self.fresh_max_age:
+            return None
+        try:
+            body = self.__load(full_path)
+        except (IOError, OSError):
+            return None
+        if id_selection and not _has_all_ids(body, list_spec, id_selection):
+            return None
+        self.fresh_serve_count += 1
+        return _OfflineResponse(_select(body, list_spec,
+                                                id_selection, filter_list))
+
+    def __mark_fresh(self, service, region, full_path, request_time):
+        """Record the complete resource list in full_path as fresh
+        as of request_time, unless a request that may have modified AWS
+        state was made after that time (the prefetch requests run
+        concurrently with the commands)
+        """
+        with self.__lock:
+            if request_time >= self.__invalidate_time_map.get(
+                                                    (service, region), 0):
+                self.__fresh_map[(service, region, full_path)] = request_time
+
+    def __invalidate_fresh(self, service, region):
+        """Forget the prefetched resource lists of the specified
+        service and region; invoked when a request may modify AWS state
+        """
+        with self.__lock:
+            self.__invalidate_time_map[(service, region)] = time.time()
+            for key in self.__fresh_map.keys():
+                if key[:2] == (service, region):
+                    del self.__fresh_map[key]
+
+    def get_fresh_age(self, service, region, action, params=None):
+        """Returns the age (in seconds) of the prefetched complete
+        resource list obtained via a request with the specified params,
+        or None if there is no such list
+        """
+        full_path = self.__full_path(service, region, action, params or {})
+        with self.__lock:
+            fresh_time = self.__fresh_map.get((service, region, full_path))
+        if fresh_time is None:
+            return None
+        return time.time() - fresh_time
+
+    def instrument(self, conn, service, region, prefetch=False):
+        """Arrange for the complete resource lists obtained through the
+        boto connection conn to be saved (when saving is enabled), and for
+        the requests to be served from the inventory when offline.
+        Returns conn.
+        The requests made through a prefetch connection are never served
+        from the inventory, and the complete resource lists they obtain
+        are recorded as fresh.
+        """
+        make_request = conn.make_request
+
+        def inventory_make_request(action, params=None, *args, **kwargs):
+            """Wrapper of the connection's make_request() method
+            """
+            #
+            # Copy the parameters before boto adds the authentication
+            # information to them
+            #
+            param_copy = dict(params) if params else {}
+            read_only = _READ_ONLY_ACTION_RE.match(action) is not None
+            if not prefetch:
+                if self.offline or self.offline_command:
+                    return self.__serve(service, region, action, param_copy)
+                if not read_only:
+                    self.__invalidate_fresh(service, region)
+                elif self.fresh_max_age is not None and \
+                                        self.__account_dir is not None:
+                    response = self.__serve_fresh(service, region,
+                                                        action, param_copy)
+                    if response is not None:
+                        return response
+            request_time = time.time()
+            response = make_request(action, params, *args, **kwargs)
+            if response.status != 200 or self.__account_dir is None or \
+                                            not (self.save or prefetch):
+                return response
+            full_path = self.__list_path(service, region, action,
+                                                                param_copy)
+            if full_path is None:
+                return response
+            #
+            # boto caches the response body, so reading it here does
+            # not interfere with its later processing by the caller.
+            #
+            try:
+                self.__save(full_path, response.read())
+            except (IOError, OSError):
+                return response
+            if prefetch:
+                self.__mark_fresh(service, region, full_path, request_time)
+            return response
+
+        conn.make_request = inventory_make_request
+        return conn
+
+    def display(self, region_list):
+        """Display the contents of the inventory for the regions in
+        region_list
+        """
+        if self.__account_dir is None or \
+                                not os.path.isdir(self.__account_dir):
+            return
+        for service in sorted(os.listdir(self.__account_dir)):
+            for region in region_list:
+                region_dir = self.__region_dir(service, region)
+                if not os.path.isdir(region_dir):
+                    continue
+                for filename in sorted(os.listdir(region_dir)):
+                    if not filename.endswith('.xml.gz'):
+                        continue
+                    inv_path = os.path.join(region_dir, filename)
+                    action = filename.split('-', 1)[0]
+                    print "%-5s %-14s %-32s %10d %s" % (service, region,
+                        action, os.path.getsize(inv_path),
+                        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(
+                                        os.path.getmtime(inv_path))))
+
+    def prune(self, max_age=_MAX_INVENTORY_AGE):
+        """Remove the files of the inventory of the current account
+        that are older than max_age seconds
+        """
+        if self.__account_dir is None:
+            return
+        now = time.time()
+        for dirpath, _, filename_list in os.walk(self.__account_dir):
+            for filename in filename_list:
+                inv_path = os.path.join(dirpath, filename)
+                try:
+                    if now - os.path.getmtime(inv_path) > max_age:
+                        os.unlink(inv_path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        """Remove the inventory of the current account
+        """
+        if self.__account_dir is None:
+            return
+        with self.__lock:
+            self.__fresh_map = {}
+        for dirpath, _, filename_list in os.walk(self.__account_dir):
+            for filename in filename_list:
+                os.unlink(os.path.join(dirpath, filename))
@@ -80,13 +80,15 @@ class NACLCommand(common.BaseCommand):
         all_network_acls = False
         disp = DisplayOptions()
         region = None
-        opt_list, args = getopt.getopt(argv, "alr:tx")
+        opt_list, args = getopt.getopt(argv, "alLr:tx")
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
                     all_network_acls = True
                 elif opt[0] == '-l':
                     disp.display = DisplayOptions.LONG
+                elif opt[0] == '-L':
+                    self.use_offline_inventory()
                 elif opt[0] == '-r':
                     region = opt[1]
                 elif opt[0] == '-t':
@@ -0,0 +1,920 @@
+#
+# Copyright 2014-2016 CloudVelox Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains a model of the VPC network, used to answer
+questions such as "which route does traffic from subnet-X to 10.4.7.9
+take" or "can instance X reach instance Y on port 443" without going
+through the route tables, network ACLs and security groups by hand.
+
+IPv4 addresses are handled as 32-bit integers, and CIDR blocks as
+(network-address, prefix-length) tuples. The routes of each route table
+are kept in a radix tree, so that the longest prefix match for an
+address takes a few node visits. Network ACL entries and security group
+rules are compiled to tuples of integers when the model is built, so
+that evaluating a query does not parse any strings. The address ranges
+used by the subnets of a VPC are kept in an interval index, to find
+free blocks for new subnets.
+"""
+
+import bisect
+
+from common import CommandError
+from sgcmd import sg_access_map
+
+#
+# Key: protocol name
+# Value: IP protocol number (-1 means all protocols)
+#
+PROTOCOL_NUMBER_MAP = {
+    'all' : -1,
+    'icmp' : 1,
+    'icmpv6' : 58,
+    'tcp' : 6,
+    'udp' : 17,
+    }
+
+#
+# Protocols with ports
+#
+PORT_PROTOCOLS = frozenset([6, 17])
+
+#
+# The source port assumed for the return traffic of a connection; it is
+# in the ephemeral port range of both Linux (32768-60999) and Windows
+# (49152-65535)
+#
+EPHEMERAL_PORT = 49152
+
+
+def parse_ip(ip_str):
+    """Returns the IPv4 address in dotted-quad notation ip_str as an
+    integer; raises a CommandError if ip_str is not a valid address
+    """
+    octet_list = ip_str.split('.')
+    if len(octet_list) != 4:
+        raise CommandError("Bad IP address: %s" % (ip_str,))
+    addr = 0
+    for octet in octet_list:
+        if not octet.isdigit() or int(octet) > 255:
+            raise CommandError("Bad IP address: %s" % (ip_str,))
+        addr = (addr << 8) | int(octet)
+    return addr
+
+
+def format_ip(addr):
+    """Returns the integer IPv4 address addr in dotted-quad notation
+    """
+    return "%d.%d.%d.%d" % ((addr >> 24) & 255, (addr >> 16) & 255,
+                                                (addr >> 8) & 255, addr & 255)
+
+
+def prefix_mask(prefix_len):
+    """Returns the network mask of a prefix of length prefix_len
+    """
+    return (0xffffffff << (32 - prefix_len)) & 0xffffffff
+
+
+def parse_cidr(cidr_str):
+    """Returns the CIDR block cidr_str (e.g. 10.1.0.0/16) as the tuple
+    (network-address, prefix-length); any host bits of the address are
+    cleared. Raises a CommandError if cidr_str is not a valid CIDR block.
+    """
+    if '/' not in cidr_str:
+        raise CommandError("Bad CIDR block: %s" % (cidr_str,))
+    ip_str, len_str = cidr_str.split('/', 1)
+    if not len_str.isdigit() or int(len_str) > 32:
+        raise CommandError("Bad CIDR block: %s" % (cidr_str,))
+    prefix_len = int(len_str)
+    return parse_ip(ip_str) & prefix_mask(prefix_len), prefix_len
+
+
+def format_cidr(net, prefix_len):
+    return "%s/%d" % (format_ip(net), prefix_len)
+
+
+def parse_protocol(proto_str):
+    """Returns the IP protocol number of proto_str, which is either a
+    protocol name (tcp, udp, etc.) or number; raises a CommandError
+    if proto_str is not a protocol
+    """
+    proto_str = proto_str.lower()
+    if proto_str in PROTOCOL_NUMBER_MAP:
+        return PROTOCOL_NUMBER_MAP[proto_str]
+    try:
+        proto = int(proto_str)
+    except ValueError:
+        raise CommandError("Bad protocol: %s" % (proto_str,))
+    if proto < -1 or proto > 255:
+        raise CommandError("Bad protocol: %s" % (proto_str,))
+    return proto
+
+
+def format_protocol(proto):
+    for proto_name, proto_number in PROTOCOL_NUMBER_MAP.items():
+        if proto_number == proto:
+            return proto_name
+    return str(proto)
+
+
+def parse_port_spec(port_spec):
+    """Returns the tuple (protocol, port) for port_spec, which has the
+    form port/proto (e.g. 443/tcp), port (for tcp), or proto for
+    protocols without ports (e.g. icmp); the port is None for protocols
+    without ports. Raises a CommandError if port_spec is not valid.
+    """
+    if '/' in port_spec:
+        port_str, proto_str = port_spec.split('/', 1)
+    elif port_spec.isdigit():
+        port_str, proto_str = port_spec, 'tcp'
+    else:
+        port_str, proto_str = None, port_spec
+    proto = parse_protocol(proto_str)
+    if proto == -1:
+        raise CommandError("Expecting a specific protocol: %s" % (port_spec,))
+    if proto not in PORT_PROTOCOLS:
+        if port_str is not None:
+            raise CommandError("Protocol %s has no ports" % (proto_str,))
+        return proto, None
+    if port_str is None:
+        raise CommandError("Missing port: %s" % (port_spec,))
+    if not port_str.isdigit() or int(port_str) > 65535:
+        raise CommandError("Bad port: %s" % (port_str,))
+    return proto, int(port_str)
+
+
+def _port_matches(proto, port, rule_proto, from_port, to_port):
+    """Returns True if traffic of protocol proto to port is matched by
+    a rule for rule_proto and the port range from_port-to_port; a port
+    range of None matches all ports
+    """
+    if rule_proto != -1 and rule_proto != proto:
+        return False
+    if port is None or from_port is None:
+        return True
+    return from_port <= port <= to_port
+
+
+class _RadixNode(object):
+    """A node of a radix tree; the node holds the prefix (net, prefix_len),
+    and a value if a prefix with that value was inserted in the tree
+    (otherwise it just joins its two subtrees)
+    """
+
+    __slots__ = ('net', 'prefix_len', 'value', 'has_value', 'children')
+
+    def __init__(self, net, prefix_len):
+        self.net = net
+        self.prefix_len = prefix_len
+        self.value = None
+        self.has_value = False
+        #
+        # The subtrees of the prefixes whose next bit (after the first
+        # prefix_len bits) is 0 and 1 respectively
+        #
+        self.children = [None, None]
+
+
+def _common_prefix_len(net1, net2, max_len):
+    """Returns the number of leading bits (up to max_len) that the
+    addresses net1 and net2 have in common
+    """
+    diff = net1 ^ net2
+    if diff == 0:
+        return max_len
+    return min(32 - diff.bit_length(), max_len)
+
+
+class RadixTree(object):
+    """A (path-compressed) binary radix tree that maps IPv4 prefixes to
+    values and supports longest prefix match lookups
+    """
+    def __init__(self):
+        self.__root = _RadixNode(0, 0)
+        self.__n_prefixes = 0
+
+    def __len__(self):
+        return self.__n_prefixes
+
+    def insert(self, net, prefix_len, value):
+        """Map the prefix (net, prefix_len) to value; the value of
+        a prefix that is already in the tree is replaced
+        """
+        net &= prefix_mask(prefix_len)
+        node = self.__root
+        while True:
+            if node.prefix_len == prefix_len:
+                if not node.has_value:
+                    self.__n_prefixes += 1
+                node.value = value
+                node.has_value = True
+                return
+            bit = (net >> (31 - node.prefix_len)) & 1
+            child = node.children[bit]
+            if child is None:
+                new_node = _RadixNode(net, prefix_len)
+                node.children[bit] = new_node
+                break
+            common_len = _common_prefix_len(child.net, net,
+                                        min(child.prefix_len, prefix_len))
+            if common_len == child.prefix_len:
+                node = child
+                continue
+            if common_len == prefix_len:
+                #
+                # The new prefix contains the child's prefix
+                #
+                new_node = _RadixNode(net, prefix_len)
+                new_node.children[(child.net >> (31 - prefix_len)) & 1] = \
+                                                                        child
+                node.children[bit] = new_node
+                break
+            #
+            # The prefixes diverge after common_len bits
+            #
+            join_node = _RadixNode(net & prefix_mask(common_len), common_len)
+            new_node = _RadixNode(net, prefix_len)
+            new_bit = (net >> (31 - common_len)) & 1
+            join_node.children[new_bit] = new_node
+            join_node.children[1 - new_bit] = child
+            node.children[bit] = join_node
+            break
+        new_node.value = value
+        new_node.has_value = True
+        self.__n_prefixes += 1
+
+    def lookup(self, addr):
+        """Returns the tuple (net, prefix_len, value) of the longest prefix
+        in the tree that contains the address addr, or None
+        """
+        node = self.__root
+        match = None
+        while node is not None:
+            prefix_len = node.prefix_len
+            if prefix_len and (addr ^ node.net) >> (32 - prefix_len):
+                break
+            if node.has_value:
+                match = node
+            if prefix_len == 32:
+                break
+            node = node.children[(addr >> (31 - prefix_len)) & 1]
+        if match is None:
+            return None
+        return match.net, match.prefix_len, match.value
+
+    def items(self):
+        """Returns the list of (net, prefix_len, value) tuples of the
+        prefixes in the tree, in address order (a prefix precedes the
+        prefixes it contains)
+        """
+        item_list = []
+        node_stack = [self.__root]
+        while node_stack:
+            node = node_stack.pop()
+            if node.has_value:
+                item_list.append((node.net, node.prefix_len, node.value))
+            for child in reversed(node.children):
+                if child is not None:
+                    node_stack.append(child)
+        return item_list
+
+
+class IntervalIndex(object):
+    """A set of (integer) addresses, kept as sorted lists of the first
+    and last addresses of disjoint address intervals
+    """
+    def __init__(self):
+        self.__first_list = []
+        self.__last_list = []
+
+    def add(self, first, last):
+        """Add the addresses first to last (inclusive); the interval is
+        merged with the intervals that it overlaps or adjoins
+        """
+        i = bisect.bisect_left(self.__last_list, first - 1)
+        j = bisect.bisect_right(self.__first_list, last + 1)
+        if i < j:
+            first = min(first, self.__first_list[i])
+            last = max(last, self.__last_list[j - 1])
+        self.__first_list[i:j] = [first]
+        self.__last_list[i:j] = [last]
+
+    def add_cidr(self, net, prefix_len):
+        self.add(net, net + (1 << (32 - prefix_len)) - 1)
+
+    def free_ranges(self, first, last):
+        """Returns the list of (first, last) tuples of the maximal ranges
+        of addresses between first and last (inclusive) that are not in
+        the set
+        """
+        range_list = []
+        addr = first
+        i = bisect.bisect_left(self.__last_list, first)
+        while addr <= last:
+            if i == len(self.__first_list) or self.__first_list[i] > last:
+                range_list.append((addr, last))
+                break
+            if self.__first_list[i] > addr:
+                range_list.append((addr, self.__first_list[i] - 1))
+            addr = self.__last_list[i] + 1
+            i += 1
+        return range_list
+
+    def find_free_blocks(self, net, prefix_len, block_prefix_len, count):
+        """Returns the list of up to count (net, block_prefix_len) tuples
+        of the first CIDR blocks with a prefix length of block_prefix_len,
+        within the CIDR block (net, prefix_len), with no address in the set
+        """
+        if block_prefix_len < prefix_len:
+            return []
+        block_size = 1 << (32 - block_prefix_len)
+        end = net + (1 << (32 - prefix_len))
+        block_list = []
+        addr = net
+        i = bisect.bisect_left(self.__last_list, addr)
+        while len(block_list) < count:
+            #
+            # Blocks are aligned on their size
+            #
+            addr = (addr + block_size - 1) & ~(block_size - 1)
+            if addr + block_size > end:
+                break
+            while i < len(self.__last_list) and self.__last_list[i] < addr:
+                i += 1
+            if i < len(self.__first_list) and \
+                                self.__first_list[i] < addr + block_size:
+                addr = self.__last_list[i] + 1
+                continue
+            block_list.append((addr, block_prefix_len))
+            addr += block_size
+        return block_list
+
+
+def route_target(route):
+    """Returns the id of the target of route (gateway, instance, etc.)
+    """
+    return route.gateway_id or route.instance_id or route.interface_id or \
+                route.vpc_peering_connection_id or None
+
+
+class RouteIndex(object):
+    """Index of the route tables of a region: the route table used by each
+    subnet, and a radix tree with the (IPv4) routes of each route table
+    """
+    def __init__(self, rtb_list, subnet_list):
+        #
+        # Key: route-table-id
+        # Value: RadixTree mapping the destination CIDR blocks of the
+        #        table's routes to the routes
+        #
+        self.__tree_map = {}
+        #
+        # Key: subnet-id
+        # Value: route-table-id of the explicitly associated route table
+        #
+        self.__subnet_rtb_map = {}
+        #
+        # Key: vpc-id
+        # Value: route-table-id of the main route table of the VPC
+        #
+        self.__main_rtb_map = {}
+        #
+        # Key: subnet-id
+        # Value: vpc-id
+        #
+        self.__subnet_vpc_map = dict([(subnet.id, subnet.vpc_id)
+                                                for subnet in subnet_list])
+        for rtb in rtb_list:
+            tree = RadixTree()
+            for route in rtb.routes:
+                #
+                # Routes to IPv6 blocks or prefix lists have no
+                # destination CIDR block
+                #
+                if route.destination_cidr_block:
+                    net, prefix_len = parse_cidr(route.destination_cidr_block)
+                    tree.insert(net, prefix_len, route)
+            self.__tree_map[rtb.id] = tree
+            for assoc in rtb.associations:
+                if assoc.main:
+                    self.__main_rtb_map[rtb.vpc_id] = rtb.id
+                elif assoc.subnet_id:
+                    self.__subnet_rtb_map[assoc.subnet_id] = rtb.id
+
+    def get_route_table_id(self, subnet_id):
+        """Returns the id of the route table used by the subnet, which is
+        the main route table of its VPC unless a route table has been
+        explicitly associated with the subnet. Raises a CommandError if
+        the subnet is unknown.
+        """
+        rtb_id = self.__subnet_rtb_map.get(subnet_id)
+        if rtb_id is not None:
+            return rtb_id
+        vpc_id = self.__subnet_vpc_map.get(subnet_id)
+        if vpc_id is None:
+            raise CommandError("Unknown subnet: %s" % (subnet_id,))
+        rtb_id = self.__main_rtb_map.get(vpc_id)
+        if rtb_id is None:
+            raise CommandError("No main route table for %s" % (vpc_id,))
+        return rtb_id
+
+    def lookup(self, rtb_id, addr):
+        """Returns the route of the route table rtb_id that applies to
+        (integer) address addr, or None
+        """
+        match = self.__tree_map[rtb_id].lookup(addr)
+        return match[2] if match is not None else None
+
+    def resolve(self, subnet_id, addr):
+        """Returns the tuple (route-table-id, route) for traffic from
+        subnet_id to the (integer) address addr; the route is None if
+        no route applies
+        """
+        rtb_id = self.get_route_table_id(subnet_id)
+        return rtb_id, self.lookup(rtb_id, addr)
+
+
+#
+# The verdicts of a step of a reachability evaluation
+#
+ALLOW = 'allow'
+DENY = 'deny'
+SKIP = 'skip'
+
+
+class ReachStep(object):
+    """A step of a reachability evaluation: the check of the traffic
+    against a route table, network ACL or security group
+    """
+    def __init__(self, stage, resource_id, verdict, rule, detail):
+        #
+        # One of 'sg-egress', 'route', 'nacl-egress', 'nacl-ingress',
+        # 'sg-ingress', 'return-egress', 'return-ingress'
+        #
+        self.stage = stage
+        self.resource_id = resource_id
+        self.verdict = verdict
+        #
+        # The matched route, ACL entry or rule (None if nothing matched);
+        # (resource_id, stage, rule) identifies it
+        #
+        self.rule = rule
+        self.detail = detail
+
+
+class CompiledNacl(object):
+    """The entries of a network ACL, as (rule-number, protocol, from-port,
+    to-port, net, prefix-len, allow) tuples in rule number order
+    """
+    def __init__(self, nacl):
+        self.id = nacl.id
+        self.ingress = []
+        self.egress = []
+        for entry in nacl.network_acl_entries:
+            #
+            # Entries for IPv6 blocks have no (IPv4) CIDR block; ICMP
+            # entries are matched regardless of type/code
+            #
+            if not entry.cidr_block:
+                continue
+            proto = parse_protocol(entry.protocol)
+            from_port = to_port = None
+            if proto in PORT_PROTOCOLS and \
+                                    entry.port_range.from_port is not None:
+                from_port = int(entry.port_range.from_port)
+                to_port = int(entry.port_range.to_port)
+            net, prefix_len = parse_cidr(entry.cidr_block)
+            compiled_entry = (int(entry.rule_number), proto,
+                                from_port, to_port, net, prefix_len,
+                                entry.rule_action == 'allow')
+            if entry.egress == 'true':
+                self.egress.append(compiled_entry)
+            else:
+                self.ingress.append(compiled_entry)
+        self.ingress.sort()
+        self.egress.sort()
+
+    def evaluate(self, egress, proto, port, addr):
+        """Returns the tuple (allowed, rule-number) for traffic of
+        protocol proto to port, to (egress) or from (ingress) the
+        address addr; the first matching entry decides, and the traffic
+        is denied with a rule-number of None if no entry matches
+        """
+        for rule_number, rule_proto, from_port, to_port, \
+                    net, prefix_len, allow in \
+                                (self.egress if egress else self.ingress):
+            if prefix_len and (addr ^ net) >> (32 - prefix_len):
+                continue
+            if _port_matches(proto, port, rule_proto, from_port, to_port):
+                return allow, rule_number
+        return False, None
+
+    def rule_list(self, egress):
+        """Returns the rule numbers (as strings) of the ingress or egress
+        entries, in evaluation order
+        """
+        return [str(entry[0])
+                    for entry in (self.egress if egress else self.ingress)]
+
+
+class CompiledSecurityGroup(object):
+    """The rules of a security group, as (protocol, from-port, to-port,
+    cidr-grant-list, group-grant-list) tuples, built from the
+    sg_access_map() of the ingress and egress permissions; each grant
+    is a (net, prefix-len, rule-description) or (group-id,
+    rule-description) tuple
+    """
+    def __init__(self, sg):
+        self.id = sg.id
+        self.ingress = self.__compile(sg_access_map(sg.rules))
+        self.egress = self.__compile(sg_access_map(sg.rules_egress))
+
+    @staticmethod
+    def __compile(access_map):
+        rule_list = []
+        for (proto_str, from_port, to_port), grant_set in \
+                                                sorted(access_map.items()):
+            proto = parse_protocol(proto_str)
+            #
+            # The from/to ports of ICMP rules are the ICMP type/code;
+            # -1 in the ports of other protocols means all ports
+            #
+            if proto not in PORT_PROTOCOLS or from_port in (None, -1):
+                from_port = to_port = None
+                rule_desc = format_protocol(proto)
+            elif from_port == to_port:
+                rule_desc = "%s:%d" % (format_protocol(proto), from_port)
+            else:
+                rule_desc = "%s:%d-%d" % (format_protocol(proto),
+                                                        from_port, to_port)
+            cidr_grant_list = []
+            group_grant_list = []
+            for grant_id in sorted(grant_set):
+                if grant_id.startswith('sg-'):
+                    group_grant_list.append((grant_id,
+                                        "%s %s" % (rule_desc, grant_id)))
+                    continue
+                if '/' in grant_id:
+                    net, prefix_len = parse_cidr(grant_id)
+                else:
+                    net, prefix_len = parse_ip(grant_id), 32
+                cidr_grant_list.append((net, prefix_len, "%s %s" %
+                                (rule_desc, format_cidr(net, prefix_len))))
+            rule_list.append((proto, from_port, to_port, cidr_grant_list,
+                                                    group_grant_list))
+        return rule_list
+
+    def evaluate(self, egress, proto, port, addr, group_id_set):
+        """Returns a description of the rule that allows traffic of
+        protocol proto to port, to (egress) or from (ingress) the address
+        addr of an interface in the groups of group_id_set; returns None
+        if no rule allows the traffic
+        """
+        for rule_proto, from_port, to_port, cidr_grant_list, \
+                group_grant_list in (self.egress if egress else self.ingress):
+            if not _port_matches(proto, port, rule_proto, from_port, to_port):
+                continue
+            for net, prefix_len, grant_desc in cidr_grant_list:
+                if not prefix_len or not (addr ^ net) >> (32 - prefix_len):
+                    return grant_desc
+            for group_id, grant_desc in group_grant_list:
+                if group_id in group_id_set:
+                    return grant_desc
+        return None
+
+    def rule_list(self, egress):
+        """Returns the descriptions of the ingress or egress rules (one per
+        grant), as returned by evaluate(), in evaluation order
+        """
+        rule_desc_list = []
+        for _, _, _, cidr_grant_list, group_grant_list in \
+                                (self.egress if egress else self.ingress):
+            rule_desc_list.extend([grant[-1] for grant in cidr_grant_list])
+            rule_desc_list.extend([grant[-1] for grant in group_grant_list])
+        return rule_desc_list
+
+
+class Endpoint(object):
+    """An endpoint of the traffic evaluated by a NetModel: an address,
+    and the subnet and security groups of its interface (if any)
+    """
+    def __init__(self, spec, addr, vpc_id=None, subnet_id=None,
+                                        eni_id=None, group_id_list=None):
+        self.spec = spec
+        self.addr = addr
+        #
+        # The vpc_id and subnet_id are None for addresses outside the VPC
+        #
+        self.vpc_id = vpc_id
+        self.subnet_id = subnet_id
+        #
+        # The eni_id is None for VPC addresses not used by an interface
+        #
+        self.eni_id = eni_id
+        self.group_id_list = group_id_list or []
+
+
+class NetModel(object):
+    """A model of the route tables, network ACLs, security groups and
+    network interfaces of a region, used to evaluate whether traffic
+    between two endpoints is allowed
+    """
+    def __init__(self, rtb_list, subnet_list, nacl_list, sg_list, eni_list):
+        self.route_index = RouteIndex(rtb_list, subnet_list)
+        #
+        # Key: vpc-id
+        # Value: RadixTree mapping subnet CIDR blocks to subnet ids
+        #
+        self.__subnet_tree_map = {}
+        for subnet in subnet_list:
+            net, prefix_len = parse_cidr(subnet.cidr_block)
+            tree = self.__subnet_tree_map.setdefault(subnet.vpc_id,
+                                                            RadixTree())
+            tree.insert(net, prefix_len, subnet.id)
+        #
+        # Key: subnet-id
+        # Value: CompiledNacl of the network ACL of the subnet
+        #
+        self.__subnet_nacl_map = {}
+        default_nacl_map = {}
+        for nacl in nacl_list:
+            compiled_nacl = CompiledNacl(nacl)
+            if getattr(nacl, 'default', None) == 'true':
+                default_nacl_map[nacl.vpc_id] = compiled_nacl
+            for assoc in nacl.associations:
+                self.__subnet_nacl_map[assoc.subnet_id] = compiled_nacl
+        #
+        # Subnets without an association use the default network ACL
+        # of their VPC
+        #
+        for subnet in subnet_list:
+            if subnet.id not in self.__subnet_nacl_map and \
+                                    subnet.vpc_id in default_nacl_map:
+                self.__subnet_nacl_map[subnet.id] = \
+                                            default_nacl_map[subnet.vpc_id]
+        #
+        # Key: sg-id
+        # Value: CompiledSecurityGroup
+        #
+        self.__sg_map = dict([(sg.id, CompiledSecurityGroup(sg))
+                                                    for sg in sg_list])
+        #
+        # Key: eni-id, instance-id (of the primary interface), or
+        #      private IP address
+        # Value: network interface
+        #
+        self.__eni_map = {}
+        #
+        # Key: eni-id
+        # Value: (Endpoint, set of the (integer) private IP addresses)
+        #        tuple of the interface
+        #
+        self.__eni_endpoint_map = {}
+        #
+        # Key: (integer) private IP address
+        # Value: (vpc-id, set of sg-ids) tuple of the interface
+        #
+        self.__addr_group_map = {}
+        for eni in eni_list:
+            self.__eni_map[eni.id] = eni
+            addr_set = set([parse_ip(eni.private_ip_address)])
+            for private_ip in eni.private_ip_addresses:
+                addr_set.add(parse_ip(private_ip.private_ip_address))
+            group_id_list = sorted([group.id for group in eni.groups])
+            self.__eni_endpoint_map[eni.id] = (Endpoint(eni.id,
+                                parse_ip(eni.private_ip_address),
+                                eni.vpc_id, eni.subnet_id, eni.id,
+                                group_id_list), addr_set)
+            for addr in addr_set:
+                self.__addr_group_map[addr] = (eni.vpc_id,
+                                                    set(group_id_list))
+            if eni.attachment is not None and \
+                                eni.attachment.instance_id and \
+                                eni.attachment.device_index == 0:
+                self.__eni_map[eni.attachment.instance_id] = eni
+            self.__eni_map[eni.private_ip_address] = eni
+            for private_ip in eni.private_ip_addresses:
+                self.__eni_map[private_ip.private_ip_address] = eni
+
+    def find_subnet(self, vpc_id, addr):
+        """Returns the id of the subnet of vpc_id that contains the
+        (integer) address addr, or None
+        """
+        tree = self.__subnet_tree_map.get(vpc_id)
+        if tree is None:
+            return None
+        match = tree.lookup(addr)
+        return match[2] if match is not None else None
+
+    def endpoint(self, spec, vpc_id=None):
+        """Returns the Endpoint for spec, which is an instance id,
+        a network interface id, or an IP address. An address that is
+        not used by an interface is placed in the subnet of vpc_id (any
+        VPC if vpc_id is None) that contains it.
+        """
+        eni = self.__eni_map.get(spec)
+        if eni is not None and (vpc_id is None or eni.vpc_id == vpc_id):
+            return Endpoint(spec, parse_ip(eni.private_ip_address),
+                                eni.vpc_id, eni.subnet_id, eni.id,
+                                sorted([group.id for group in eni.groups]))
+        if spec.startswith('i-') or spec.startswith('eni-'):
+            raise CommandError("No network interface found for %s" %
+                                                                (spec,))
+        addr = parse_ip(spec)
+        if vpc_id is None:
+            vpc_id_list = sorted(self.__subnet_tree_map)
+        else:
+            vpc_id_list = [vpc_id]
+        for vpc_id in vpc_id_list:
+            subnet_id = self.find_subnet(vpc_id, addr)
+            if subnet_id is not None:
+                return Endpoint(spec, addr, vpc_id, subnet_id)
+        return Endpoint(spec, addr)
+
+    def interface_resources(self, eni_id):
+        """Returns the tuple (nacl, sg-list) of the CompiledNacl of the
+        subnet of the interface eni_id (None if there is none) and the
+        CompiledSecurityGroups of the interface
+        """
+        endpoint = self.__eni_endpoint_map[eni_id][0]
+        sg_list = [self.__sg_map[sg_id] for sg_id in endpoint.group_id_list
+                                                if sg_id in self.__sg_map]
+        return self.__subnet_nacl_map.get(endpoint.subnet_id), sg_list
+
+    def __sg_step(self, stage, endpoint, egress, proto, port, addr,
+                                                        peer_group_id_set):
+        """Returns the ReachStep of the security groups of endpoint
+        """
+        if endpoint.eni_id is None:
+            return ReachStep(stage, None, SKIP, None,
+                                "no interface has this address")
+        for sg_id in endpoint.group_id_list:
+            compiled_sg = self.__sg_map.get(sg_id)
+            if compiled_sg is None:
+                continue
+            rule_desc = compiled_sg.evaluate(egress, proto, port, addr,
+                                                        peer_group_id_set)
+            if rule_desc is not None:
+                return ReachStep(stage, sg_id, ALLOW, rule_desc,
+                                            "allowed by %s" % (rule_desc,))
+        return ReachStep(stage, ",".join(endpoint.group_id_list), DENY,
+                                    None, "no security group rule matches")
+
+    def __nacl_step(self, stage, subnet_id, egress, proto, port, addr):
+        """Returns the ReachStep of the network ACL of subnet_id
+        """
+        compiled_nacl = self.__subnet_nacl_map.get(subnet_id)
+        if compiled_nacl is None:
+            return ReachStep(stage, None, SKIP, None,
+                                "no network ACL for %s" % (subnet_id,))
+        allowed, rule_number = compiled_nacl.evaluate(egress, proto, port,
+                                                                    addr)
+        if rule_number is None:
+            return ReachStep(stage, compiled_nacl.id, DENY, None,
+                                                    "no entry matches")
+        return ReachStep(stage, compiled_nacl.id,
+                            ALLOW if allowed else DENY, str(rule_number),
+                            "%s by rule %d" % (
+                                "allowed" if allowed else "denied",
+                                rule_number))
+
+    def evaluate(self, src, dst, proto, port):
+        """Evaluate traffic of protocol proto to port (None for protocols
+        without ports) from the Endpoint src, which must be in a VPC
+        subnet, to the Endpoint dst. Returns the list of ReachSteps of the
+        path: the security groups of src, the route table of the subnet of
+        src, the network ACLs of the subnets of src and dst, the security
+        groups of dst, and the network ACLs for the return traffic (the
+        ACLs are stateless, unlike the security groups). The traffic is
+        allowed if no step has a DENY verdict.
+        """
+        if src.subnet_id is None:
+            raise CommandError("%s is not in a VPC subnet" % (src.spec,))
+        step_list = []
+        src_group_id_set = set(src.group_id_list)
+        dst_group_id_set = set(dst.group_id_list)
+        step_list.append(self.__sg_step('sg-egress', src, True, proto, port,
+                                        dst.addr, dst_group_id_set))
+        rtb_id, route = self.route_index.resolve(src.subnet_id, dst.addr)
+        if route is None:
+            step_list.append(ReachStep('route', rtb_id, DENY, None,
+                                "no route to %s" % (format_ip(dst.addr),)))
+            return step_list
+        target = route_target(route)
+        route_desc = "%s -> %s" % (route.destination_cidr_block, target)
+        if target != 'local':
+            #
+            # The traffic leaves the VPC (or goes through an appliance);
+            # only the source side of the path is evaluated
+            #
+            step_list.append(ReachStep('route', rtb_id, ALLOW,
+                        route.destination_cidr_block,
+                        "%s, the path beyond %s is not evaluated" %
+                                                    (route_desc, target)))
+            dst_subnet_id = None
+        elif dst.vpc_id != src.vpc_id or dst.subnet_id is None:
+            step_list.append(ReachStep('route', rtb_id, DENY,
+                        route.destination_cidr_block,
+                        "%s, but no subnet contains %s" %
+                                    (route_desc, format_ip(dst.addr))))
+            return step_list
+        else:
+            step_list.append(ReachStep('route', rtb_id, ALLOW,
+                        route.destination_cidr_block, route_desc))
+            dst_subnet_id = dst.subnet_id
+        #
+        # Traffic within a subnet is not subject to the network ACLs
+        #
+        cross_subnet = dst_subnet_id != src.subnet_id
+        if cross_subnet:
+            step_list.append(self.__nacl_step('nacl-egress', src.subnet_id,
+                                        True, proto, port, dst.addr))
+        if dst_subnet_id is not None:
+            if cross_subnet:
+                step_list.append(self.__nacl_step('nacl-ingress',
+                                        dst_subnet_id, False,
+                                        proto, port, src.addr))
+            step_list.append(self.__sg_step('sg-ingress', dst, False,
+                                proto, port, src.addr, src_group_id_set))
+        if cross_subnet:
+            return_port = EPHEMERAL_PORT if proto in PORT_PROTOCOLS \
+                                                                else None
+            if dst_subnet_id is not None:
+                step_list.append(self.__nacl_step('return-egress',
+                                        dst_subnet_id, True,
+                                        proto, return_port, src.addr))
+            step_list.append(self.__nacl_step('return-ingress',
+                                        src.subnet_id, False,
+                                        proto, return_port, dst.addr))
+        return step_list
+
+    def evaluate_flow(self, eni_id, src_addr, dst_addr, proto,
+                                                    src_port, dst_port):
+        """Evaluate a flow log record of the interface eni_id: traffic of
+        protocol proto from src_addr:src_port to dst_addr:dst_port (the
+        ports are None for protocols without ports). Returns the list of
+        ReachSteps of the security groups and network ACL of the
+        interface, in the order in which they are applied. Raises a
+        CommandError if the interface is unknown or is neither the source
+        nor the destination of the traffic.
+
+        The security groups are stateful: traffic from a lower to a higher
+        port (e.g. from 443 to an ephemeral port) that no rule allows, but
+        whose reverse is allowed by a rule, is taken to be the response to
+        a request, and is reported as allowed by that rule.
+        """
+        if eni_id not in self.__eni_endpoint_map:
+            raise CommandError("Unknown network interface: %s" % (eni_id,))
+        endpoint, addr_set = self.__eni_endpoint_map[eni_id]
+        if dst_addr in addr_set:
+            egress = False
+            peer_addr = src_addr
+        elif src_addr in addr_set:
+            egress = True
+            peer_addr = dst_addr
+        else:
+            raise CommandError("%s is neither the source nor the "
+                                "destination of the traffic" % (eni_id,))
+        peer_vpc_id, peer_group_id_set = self.__addr_group_map.get(
+                                                peer_addr, (None, set()))
+        if peer_vpc_id != endpoint.vpc_id:
+            peer_group_id_set = set()
+        direction = 'egress' if egress else 'ingress'
+        sg_step = self.__sg_step('sg-' + direction, endpoint, egress,
+                                proto, dst_port, peer_addr, peer_group_id_set)
+        if sg_step.verdict == DENY and \
+                (dst_port is None or src_port < dst_port):
+            #
+            # The response of an allowed connection is matched against
+            # the rules of the other direction, with the ports swapped
+            #
+            other_direction = 'ingress' if egress else 'egress'
+            reverse_step = self.__sg_step('sg-' + other_direction, endpoint,
+                                    not egress, proto, src_port, peer_addr,
+                                    peer_group_id_set)
+            if reverse_step.verdict == ALLOW:
+                sg_step = reverse_step
+                sg_step.detail = "response, " + sg_step.detail
+        subnet_id = endpoint.subnet_id
+        if self.find_subnet(endpoint.vpc_id, peer_addr) == subnet_id:
+            nacl_step = ReachStep('nacl-' + direction, None, SKIP, None,
+                                    "traffic within %s" % (subnet_id,))
+        else:
+            nacl_step = self.__nacl_step('nacl-' + direction, subnet_id,
+                                    egress, proto, dst_port, peer_addr)
+        if egress:
+            return [sg_step, nacl_step]
+        return [nacl_step, sg_step]
@@ -0,0 +1,260 @@
+#
+# Copyright 2014-2016 CloudVelox Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains the support for command pipelines, e.g.
+    inst -a -z stopped | vol -l
+
+The commands of a pipeline are executed in order. Each command except
+the last passes the resources it selected (the records, not their
+display) to the next command, which selects the resources related to
+them: the volumes of the instances, the snapshots of the volumes, etc.
+The relations are defined by a derivation table; a related resource is
+identified either by its id, or by a filter on the value of one of its
+attributes (e.g. the snapshots of a volume are those with a volume-id
+equal to the volume id).
+"""
+
+import re
+
+from common import CommandError
+
+PIPE_CHAR = '|'
+
+_WORD_RE = re.compile(r'\s*([^\s|]*)')
+
+#
+# Key: command
+# Value: resource type of the resources that the command lists
+#
+_COMMAND_RES_TYPE_MAP = {
+    'ami' : 'image',
+    'elb' : 'load-balancer',
+    'eni' : 'network-interface',
+    'inst' : 'instance',
+    'sg' : 'security-group',
+    'snap' : 'snapshot',
+    'subnet' : 'subnet',
+    'vol' : 'volume',
+    'vpc' : 'vpc',
+    }
+
+
+def _ids(*attr_list):
+    """Returns a function that returns the (not None) values of the
+    specified record attributes
+    """
+    def derive(record):
+        value_list = []
+        for attr in attr_list:
+            value = getattr(record, attr)
+            if value:
+                value_list.append(value)
+        return value_list
+    return derive
+
+
+def _identity(record):
+    return [record.id]
+
+
+def _elb_instance_ids(elb):
+    return [instance_info.id for instance_info in elb.instances]
+
+
+def _eni_instance_ids(eni):
+    if eni.attachment is None or not eni.attachment.instance_id:
+        return []
+    return [eni.attachment.instance_id]
+
+
+#
+# Key: (upstream resource type, downstream resource type)
+# Value: (filter-name, function) tuple; the function returns the list of
+#        values identifying the downstream resources related to an
+#        upstream record. If filter-name is None, the values are resource
+#        ids, otherwise they are values of the named filter.
+#
+_DERIVATION_MAP = {
+    ('image', 'image') : (None, _identity),
+    ('image', 'instance') : ('image-id', _identity),
+    ('image', 'snapshot') : (None, lambda ami: [bdev.snapshot_id
+                                for bdev in ami.block_devices
+                                    if bdev.snapshot_id]),
+    ('instance', 'image') : (None, _ids('image_id')),
+    ('instance', 'instance') : (None, _identity),
+    ('instance', 'load-balancer') : ('instance-id', _identity),
+    ('instance', 'network-interface') : ('attachment.instance-id',
+                                _identity),
+    ('instance', 'security-group') : (None,
+                                lambda inst: list(inst.group_ids)),
+    ('instance', 'subnet') : (None, _ids('subnet_id')),
+    ('instance', 'volume') : (None, lambda inst: [bdev.volume_id
+                                for bdev in inst.block_devices
+                                    if bdev.volume_id]),
+    ('instance', 'vpc') : (None, _ids('vpc_id')),
+    ('load-balancer', 'instance') : (None, _elb_instance_ids),
+    ('load-balancer', 'load-balancer') : (None, lambda elb: [elb.name]),
+    ('network-interface', 'instance') : (None, _eni_instance_ids),
+    ('network-interface', 'network-interface') : ('network-interface-id',
+                                _identity),
+    ('network-interface', 'security-group') : (None,
+                                lambda eni: [grp.id for grp in eni.groups]),
+    ('network-interface', 'subnet') : (None, _ids('subnet_id')),
+    ('security-group', 'instance') : ('instance.group-id', _identity),
+    ('security-group', 'network-interface') : ('group-id', _identity),
+    ('security-group', 'security-group') : (None, _identity),
+    ('snapshot', 'image') : ('block-device-mapping.snapshot-id', _identity),
+    ('snapshot', 'snapshot') : (None, _identity),
+    ('snapshot', 'volume') : (None, _ids('volume_id')),
+    ('subnet', 'instance') : ('subnet-id', _identity),
+    ('subnet', 'network-interface') : ('subnet-id', _identity),
+    ('subnet', 'subnet') : (None, _identity),
+    ('subnet', 'vpc') : (None, _ids('vpc_id')),
+    ('volume', 'instance') : (None, _ids('attach_instance_id')),
+    ('volume', 'snapshot') : ('volume-id', _identity),
+    ('volume', 'volume') : (None, _identity),
+    ('vpc', 'instance') : ('vpc-id', _identity),
+    ('vpc', 'network-interface') : ('vpc-id', _identity),
+    ('vpc', 'security-group') : ('vpc-id', _identity),
+    ('vpc', 'subnet') : ('vpc-id', _identity),
+    ('vpc', 'vpc') : (None, _identity),
+    }
+
+
+def _is_pipe(ln, pos):
+    """Returns True if the (unquoted) pipe character at position pos
+    of the command line ln separates two commands: it is preceded by
+    whitespace, or it is followed by the name of a command that can be
+    used in a pipeline. Otherwise it is part of an argument, e.g. the
+    regular expression of 'snap -m a|b'.
+    """
+    if pos > 0 and ln[pos - 1].isspace():
+        return True
+    return _WORD_RE.match(ln, pos + 1).group(1) in _COMMAND_RES_TYPE_MAP
+
+
+def split_pipeline(ln):
+    """Split the command line ln at the pipe characters that are not
+    quoted and that separate commands (see _is_pipe). Returns the list
+    of commands (a single command if ln is not a pipeline).
+    """
+    stage_list = []
+    quote_char = None
+    start = 0
+    for i, char in enumerate(ln):
+        if quote_char is not None:
+            if char == quote_char:
+                quote_char = None
+        elif char in '"\'':
+            quote_char = char
+        elif char == PIPE_CHAR and _is_pipe(ln, i):
+            stage_list.append(ln[start:i].strip())
+            start = i + 1
+    stage_list.append(ln[start:].strip())
+    return stage_list
+
+
+def check_pipeline(stage_list):
+    """Verify that each command of the pipeline can use the resources
+    of the previous command; raises a CommandError if not
+    """
+    prev_command = None
+    for stage in stage_list:
+        if not stage:
+            raise CommandError("Empty command in pipeline")
+        command = stage.split(None, 1)[0]
+        if command not in _COMMAND_RES_TYPE_MAP:
+            raise CommandError(
+                    "The %s command cannot be used in a pipeline; "
+                    "available commands: %s" %
+                    (command, ", ".join(sorted(_COMMAND_RES_TYPE_MAP))))
+        if prev_command is not None:
+            derivation_key = (_COMMAND_RES_TYPE_MAP[prev_command],
+                                        _COMMAND_RES_TYPE_MAP[command])
+            if derivation_key not in _DERIVATION_MAP:
+                raise CommandError("Cannot derive %s resources from %s "
+                                "resources" % (command, prev_command))
+        prev_command = command
+
+
+class PipeData(object):
+    """The resources passed from a command to the next one
+    """
+    def __init__(self, res_type, region, record_list):
+        self.res_type = res_type
+        self.region = region
+        self.record_list = record_list
+
+    def select(self, res_type, selector):
+        """Add to the selector the ids (or filter values) of the
+        resources of type res_type related to the piped resources.
+        Returns False if there are no such resources.
+        """
+        filter_name, derive = _DERIVATION_MAP[(self.res_type, res_type)]
+        value_list = []
+        value_set = set()
+        for record in self.record_list:
+            for value in derive(record):
+                if value not in value_set:
+                    value_set.add(value)
+                    value_list.append(value)
+        if not value_list:
+            return False
+        if filter_name is not None:
+            selector.add_filter(filter_name, value_list)
+        else:
+            if selector.resource_id_list:
+                selected_id_set = set(selector.resource_id_list)
+                value_list = selector.resource_id_list + [value
+                                for value in value_list
+                                    if value not in selected_id_set]
+            selector.resource_id_list = value_list
+        return True
+
+    def get_records(self, res_type, selector):
+        """Returns the piped records if they are the resources selected
+        by selector (so that they do not need to be described again),
+        otherwise None
+        """
+        if res_type != self.res_type or selector.get_filter_dict() or \
+                selector.resource_name_list or selector.match_pattern:
+            return None
+        record_id_set = set([record.id for record in self.record_list])
+        selected_id_set = set(selector.resource_id_list or [])
+        if not selected_id_set.issubset(record_id_set):
+            return None
+        return [record for record in self.record_list
+                            if record.id in selected_id_set]
+
+
+class Pipe(object):
+    """The pipe state of a command executing as part of a pipeline
+    """
+    def __init__(self, pipe_input, has_next):
+        #
+        # The PipeData passed by the previous command (None for the
+        # first command)
+        #
+        self.input = pipe_input
+        #
+        # True if the command passes its resources to a next command
+        #
+        self.has_next = has_next
+        #
+        # The PipeData passed to the next command
+        #
+        self.output = None
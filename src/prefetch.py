@@ -0,0 +1,327 @@
+#
+# Copyright 2014-2016 CloudVelox Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains the idle prefetcher used by the 'prefetch'
+command.
+
+While the shell waits for input, the prefetcher refreshes the
+inventory (see inventory.py) with the complete resource lists of the
+(command, region) pairs used most frequently according to the command
+history, so that the next list command can be answered locally.
+The number of API calls made during each idle period is bounded by
+a budget.
+"""
+
+import shlex
+import threading
+import time
+
+from boto.exception import BotoServerError
+
+from common import is_throttle_error
+from fastparse import get_image_records
+from fastparse import get_snapshot_records
+
+DEFAULT_BUDGET = 10
+DEFAULT_IDLE_SECS = 2
+DEFAULT_MAX_AGE = 60
+
+#
+# Number of (most recent) history lines considered
+#
+_HISTORY_DEPTH = 500
+
+#
+# Uppercase options that do not modify AWS state
+#
+_READ_ONLY_UPPER_OPTS = frozenset('LO')
+
+
+class _Listing(object):
+    """The request that obtains the complete resource list of a command;
+    it is the request of the command's listing of all resources
+    (e.g. 'inst -a'), so that the command can be answered from the
+    prefetched list.
+    """
+    def __init__(self, action, params, fetch):
+        self.action = action
+        #
+        # Request parameters that do not select among resources
+        #
+        self.params = params
+        #
+        # Function that makes the request given an EC2/VPC connection
+        #
+        self.fetch = fetch
+
+
+_LISTING_MAP = {
+    'ami' : _Listing('DescribeImages', {'Owner.1' : 'self'},
+                lambda conn: get_image_records(conn, owners=['self'])),
+    'eip' : _Listing('DescribeAddresses', {},
+                lambda conn: conn.get_all_addresses()),
+    'eni' : _Listing('DescribeNetworkInterfaces', {},
+                lambda conn: conn.get_all_network_interfaces()),
+    'igw' : _Listing('DescribeInternetGateways', {},
+                lambda conn: conn.get_all_internet_gateways()),
+    'inst' : _Listing('DescribeInstances', {},
+                lambda conn: conn.get_all_instances()),
+    'nacl' : _Listing('DescribeNetworkAcls', {},
+                lambda conn: conn.get_all_network_acls()),
+    'rtb' : _Listing('DescribeRouteTables', {},
+                lambda conn: conn.get_all_route_tables()),
+    'sg' : _Listing('DescribeSecurityGroups', {},
+                lambda conn: conn.get_all_security_groups()),
+    'snap' : _Listing('DescribeSnapshots', {'Owner.1' : 'self'},
+                lambda conn: get_snapshot_records(conn, owner='self')),
+    'subnet' : _Listing('DescribeSubnets', {},
+                lambda conn: conn.get_all_subnets()),
+    'tag' : _Listing('DescribeTags', {},
+                lambda conn: conn.get_all_tags()),
+    'vol' : _Listing('DescribeVolumes', {},
+                lambda conn: conn.get_all_volumes()),
+    'vpc' : _Listing('DescribeVpcs', {},
+                lambda conn: conn.get_all_vpcs()),
+    }
+
+
+def get_listing(command):
+    """Returns the tuple (action, params) of the request that obtains
+    the complete resource list of command
+    """
+    listing = _LISTING_MAP[command]
+    return listing.action, listing.params
+
+
+def _parse_history_line(ln):
+    """Returns the tuple (command, region) for a history line with
+    a command that we can prefetch for; region is None if the line does
+    not specify one. Returns None for other lines, including those
+    with options that modify AWS state.
+    """
+    try:
+        argv = shlex.split(ln)
+    except ValueError:
+        return None
+    if not argv or argv[0] not in _LISTING_MAP:
+        return None
+    region = None
+    for i, arg in enumerate(argv[1:], 1):
+        if not arg.startswith('-') or len(arg) < 2:
+            continue
+        if arg[1].isupper() and arg[1] not in _READ_ONLY_UPPER_OPTS:
+            return None
+        if arg[1] == 'r':
+            if len(arg) > 2:
+                region = arg[2:]
+            elif i + 1 < len(argv):
+                region = argv[i + 1]
+    return argv[0], region
+
+
+def make_plan(history_list, default_region):
+    """Returns the list of (command, region) tuples used in the
+    command lines in history_list (oldest first), most frequent first;
+    ties are broken in favor of the most recently used.
+    """
+    count_map = {}
+    last_use_map = {}
+    for i, ln in enumerate(history_list[-_HISTORY_DEPTH:]):
+        parsed = _parse_history_line(ln)
+        if parsed is None:
+            continue
+        command, region = parsed
+        key = (command, region or default_region)
+        count_map[key] = count_map.get(key, 0) + 1
+        last_use_map[key] = i
+    return sorted(count_map,
+                key=lambda key: (-count_map[key], -last_use_map[key]))
+
+
+class _StopPrefetch(Exception):
+    """Raised to abort the prefetching of the current idle period
+    """
+    pass
+
+
+class IdlePrefetcher(object):
+    """Refreshes the inventory in a background thread while the shell
+    is idle. The owner invokes resume() when it starts waiting for input,
+    and pause() when a command is entered.
+    """
+    def __init__(self, inventory, conn_factory):
+        self.__inventory = inventory
+        #
+        # Function that returns a new EC2/VPC connection for a region,
+        # instrumented (only) by the inventory as a prefetch connection
+        #
+        self.__conn_factory = conn_factory
+        self.budget = DEFAULT_BUDGET
+        self.idle_secs = DEFAULT_IDLE_SECS
+        self.max_age = DEFAULT_MAX_AGE
+        self.__cond = threading.Condition()
+        self.__thread = None
+        #
+        # Incremented on every resume/pause, so that the prefetching
+        # of an idle period stops once the period ends
+        #
+        self.__period = 0
+        #
+        # The idle period being prefetched for
+        #
+        self.__active_period = None
+        self.__idle = False
+        self.__plan = []
+        #
+        # Key: region-name
+        # Value: connection
+        #
+        self.__conn_map = {}
+        #
+        # Number of API calls made during the current idle period
+        #
+        self.__period_calls = 0
+        #
+        # Totals since the prefetcher was created
+        #
+        self.n_calls = 0
+        self.n_refreshed = 0
+        self.last_error = None
+
+    def reset(self):
+        """Discard the connections (e.g. after a change of credentials)
+        """
+        with self.__cond:
+            self.__conn_map = {}
+
+    def __get_conn(self, region):
+        """Returns the connection for region; the requests made through
+        it are counted against the budget, and are not issued once the
+        idle period has ended.
+        """
+        with self.__cond:
+            conn = self.__conn_map.get(region)
+        if conn is not None:
+            return conn
+        conn = self.__conn_factory(region)
+        make_request = conn.make_request
+
+        def budgeted_make_request(action, params=None, *args, **kwargs):
+            """Wrapper of the connection's make_request() method
+            """
+            with self.__cond:
+                if self.__period != self.__active_period or \
+                                        self.__period_calls >= self.budget:
+                    raise _StopPrefetch()
+                self.__period_calls += 1
+                self.n_calls += 1
+            return make_request(action, params, *args, **kwargs)
+
+        conn.make_request = budgeted_make_request
+        with self.__cond:
+            self.__conn_map[region] = conn
+        return conn
+
+    def resume(self, history_list, default_region):
+        """Invoked when the shell starts waiting for input; the
+        prefetching starts after idle_secs seconds
+        """
+        plan = make_plan(history_list, default_region)
+        with self.__cond:
+            self.__period += 1
+            self.__idle = True
+            self.__plan = plan
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run,
+                                                name="idle-prefetch")
+                self.__thread.daemon = True
+                self.__thread.start()
+            self.__cond.notify()
+
+    def pause(self):
+        """Invoked when a command is entered; a request that is in progress
+        is allowed to complete, but no further requests are made
+        """
+        with self.__cond:
+            self.__period += 1
+            self.__idle = False
+            self.__cond.notify()
+
+    def get_plan(self):
+        with self.__cond:
+            return list(self.__plan)
+
+    def __wait_idle(self):
+        """Wait for an idle period to last idle_secs seconds. Returns the
+        tuple (period, plan).
+        """
+        with self.__cond:
+            while True:
+                while not self.__idle:
+                    self.__cond.wait()
+                period = self.__period
+                deadline = time.time() + self.idle_secs
+                while self.__period == period:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return period, list(self.__plan)
+                    self.__cond.wait(remaining)
+
+    def __run(self):
+        """Body of the prefetch thread
+        """
+        while True:
+            period, plan = self.__wait_idle()
+            with self.__cond:
+                self.__active_period = period
+                self.__period_calls = 0
+            self.__prefetch(plan)
+            #
+            # Wait for the next idle period
+            #
+            with self.__cond:
+                while self.__period == period:
+                    self.__cond.wait()
+
+    def __prefetch(self, plan):
+        """Refresh the resource lists in plan that are not fresh enough,
+        until the budget is exhausted or the idle period ends
+        """
+        for command, region in plan:
+            listing = _LISTING_MAP[command]
+            age = self.__inventory.get_fresh_age('ec2', region,
+                                            listing.action, listing.params)
+            #
+            # Lists younger than half of max_age are not refreshed
+            #
+            if age is not None and age < self.max_age / 2.0:
+                continue
+            try:
+                listing.fetch(self.__get_conn(region))
+                self.n_refreshed += 1
+            except _StopPrefetch:
+                return
+            except BotoServerError, serverr:
+                self.last_error = "%s: %s" % (serverr.error_code,
+                                                serverr.error_message)
+                #
+                # Leave the API rate to the commands
+                #
+                if is_throttle_error(serverr):
+                    return
+            except Exception, ex:
+                self.last_error = str(ex)
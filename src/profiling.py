@@ -0,0 +1,133 @@
+#
+# Copyright 2014-2016 CloudVelox Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains the command profiler used by the 'profile' command
+"""
+
+import cProfile
+import os
+import pstats
+import re
+
+DEFAULT_TOP_COUNT = 10
+
+#
+# Time categories; the time of each profiled function is attributed to
+# the first category whose pattern matches the function's file name
+# (or, for built-in functions, the function name).
+#
+_CATEGORY_LIST = [
+    ('network',
+        re.compile(r'(/(socket|httplib|ssl|select)\.py$)|'
+                r'_socket|_ssl|select\.(e?poll|select)|<built-in.*select>')),
+    ('xml-parse',
+        re.compile(r'(/xml/)|pyexpat|<built-in method Parse>|'
+                r'(/boto/handler\.py$)')),
+    ('objects',
+        re.compile(r'/boto/(ec2|vpc|rds|iam|resultset\.py$)')),
+    ('rendering',
+        re.compile(r"(/(common|\w+cmd)\.py$)|<method 'write' of 'file'|"
+                r"<method 'flush' of 'file'")),
+]
+_OTHER_CATEGORY = 'other'
+
+
+def _function_label(func_key):
+    """Returns a (short) printable label for a pstats function key
+    """
+    filename, lineno, funcname = func_key
+    if filename == '~':
+        return funcname
+    return "%s:%d(%s)" % (os.path.basename(filename), lineno, funcname)
+
+
+def _categorize(func_key):
+    """Returns the name of the category of the specified function
+    """
+    filename, _, funcname = func_key
+    name = funcname if filename == '~' else filename
+    for category, pattern in _CATEGORY_LIST:
+        if pattern.search(name):
+            return category
+    return _OTHER_CATEGORY
+
+
+class CommandProfiler(object):
+    """Profiles the execution of commands.
+    """
+    def __init__(self, top_count=DEFAULT_TOP_COUNT, dump_dir=None):
+        self.top_count = top_count
+        self.dump_dir = dump_dir
+        self.__last_stats = None
+        self.__command_number = 0
+
+    def run(self, label, func, *args):
+        """Invoke func(*args) under the profiler and report the results;
+        label identifies the command being executed.
+        """
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(func, *args)
+        finally:
+            self.__last_stats = pstats.Stats(profiler)
+            self.__command_number += 1
+            self.__report()
+            if self.dump_dir is not None:
+                dump_path = os.path.join(self.dump_dir, "%04d-%s.pstats" %
+                                        (self.__command_number, label))
+                self.__last_stats.dump_stats(dump_path)
+
+    def dump(self, dump_path):
+        """Write the profile of the last profiled command to the
+        specified file (in pstats format). Returns False if there is
+        no profile to dump.
+        """
+        if self.__last_stats is None:
+            return False
+        self.__last_stats.dump_stats(dump_path)
+        return True
+
+    def __report(self):
+        """Report how the time was spent
+        """
+        stats = self.__last_stats
+        #
+        # Key: category
+        # Value: time spent in functions of this category
+        #
+        category_time = {}
+        for func_key, func_stats in stats.stats.iteritems():
+            category = _categorize(func_key)
+            category_time[category] = \
+                        category_time.get(category, 0.0) + func_stats[2]
+        total_time = stats.total_tt or 1e-9
+        print "Profile: %.3f secs, %d calls" % (stats.total_tt,
+                                                        stats.total_calls)
+        for category, _ in _CATEGORY_LIST + [(_OTHER_CATEGORY, None)]:
+            cat_time = category_time.get(category, 0.0)
+            print "    %-10s : %8.3f secs %5.1f%%" % \
+                        (category, cat_time, cat_time * 100 / total_time)
+        if not self.top_count:
+            return
+        func_list = sorted(stats.stats.iteritems(),
+                                key=lambda item: item[1][2], reverse=True)
+        print "    %8s %8s %9s  %s" % ("TOTTIME", "CUMTIME", "CALLS",
+                                                                "FUNCTION")
+        for func_key, func_stats in func_list[:self.top_count]:
+            _, n_calls, tottime, cumtime, _ = func_stats
+            print "    %8.3f %8.3f %9d  %s" % (tottime, cumtime, n_calls,
+                                                _function_label(func_key))
@@ -19,17 +19,54 @@
 """
 
 import getopt
+import time
+
+import boto
 
 import common
 
 from common import DisplayOptions
 from common import CommandOutput
+from common import PagePrefetcher
+from common import concurrent_map
 from common import confirm
 from common import amazon2localtime
+from common import retry_throttled
 
 
 class RDSCommand(common.BaseCommand):
 
+    #
+    # Number of records per Describe request (the maximum allowed
+    # by RDS)
+    #
+    PAGE_SIZE = 100
+
+    #
+    # Interval (in seconds) between checks of the state of the
+    # DB instances being deleted
+    #
+    DELETE_POLL_INTERVAL = 15
+
+    @classmethod
+    def __rds_list(cls, list_func, display, disp, **kwargs):
+        """Display the records returned by the (paginated) RDS list
+        function list_func, invoked with the keyword arguments in kwargs;
+        the pages are displayed as they arrive.
+        """
+        def fetch_page(marker):
+            """Returns the tuple (record_list, next_marker)
+            """
+            record_list = retry_throttled(list_func,
+                                max_records=cls.PAGE_SIZE, marker=marker,
+                                **kwargs)
+            return record_list, record_list.marker
+
+        with CommandOutput() as pg, PagePrefetcher(fetch_page) as pages:
+            for record_list in pages:
+                for record in record_list:
+                    display(record, disp, pg)
+
     @staticmethod
     def __rds_inst_display(dbinstance, disp, pg):
         """Display information about the specified RDS instance.
@@ -62,36 +99,88 @@ class RDSCommand(common.BaseCommand):
         """Implements the list function of the 'rds inst' command
         """
         rds_conn = self.get_rds_conn(region)
-        dbinstance_list = rds_conn.get_all_dbinstances(
-                                        instance_id=dbinstance_id,)
-        with CommandOutput() as pg:
-            for dbinstance in dbinstance_list:
-                self.__rds_inst_display(dbinstance, disp, pg)
+        self.__rds_list(rds_conn.get_all_dbinstances,
+                                self.__rds_inst_display, disp,
+                                instance_id=dbinstance_id)
 
-    def __rds_inst_terminate(self, region, rds_instance_list):
-        """Delete a RDS instance
+    def __rds_inst_wait_deleted(self, rds_conn, dbinstance_id_list):
+        """Wait until the DB instances in dbinstance_id_list are deleted,
+        reporting each one as it goes away. The state of all the instances
+        is obtained with a single (paginated) listing per polling interval.
+        """
+        pending_id_list = list(dbinstance_id_list)
+        print "Waiting for %d DB instances to be deleted..." % (
+                                                        len(pending_id_list),)
+        try:
+            while pending_id_list:
+                time.sleep(self.DELETE_POLL_INTERVAL)
+                status_map = {}
+                marker = None
+                while True:
+                    dbinstance_list = retry_throttled(
+                                        rds_conn.get_all_dbinstances,
+                                        max_records=self.PAGE_SIZE,
+                                        marker=marker)
+                    for dbinstance in dbinstance_list:
+                        status_map[dbinstance.id] = dbinstance.status
+                    marker = dbinstance_list.marker
+                    if not marker:
+                        break
+                still_pending_id_list = []
+                for dbinstance_id in pending_id_list:
+                    status = status_map.get(dbinstance_id)
+                    if status is None:
+                        print "Deleted: %s" % (dbinstance_id,)
+                    elif status != 'deleting':
+                        print "Not deleted: %s (status: %s)" % (
+                                                    dbinstance_id, status)
+                    else:
+                        still_pending_id_list.append(dbinstance_id)
+                pending_id_list = still_pending_id_list
+        except KeyboardInterrupt:
+            print "Still being deleted: %s" % (", ".join(pending_id_list),)
+
+    def __rds_inst_terminate(self, region, rds_instance_list, wait):
+        """Delete the specified RDS instances; the delete requests
+        are issued concurrently
         """
         if not rds_instance_list:
             return
         rds_conn = self.get_rds_conn(region)
         if not confirm():
             return
-        for rds_inst_id in rds_instance_list:
-            dbinst = rds_conn.delete_dbinstance(rds_inst_id,
-                                                skip_final_snapshot=True)
+
+        def delete(rds_inst_id):
+            """Returns the tuple (dbinst, error-message)
+            """
+            try:
+                return retry_throttled(rds_conn.delete_dbinstance,
+                                rds_inst_id, skip_final_snapshot=True), None
+            except boto.exception.BotoServerError, serverr:
+                return None, serverr.error_message
+
+        deleting_id_list = []
+        for rds_inst_id, (dbinst, errmsg) in zip(rds_instance_list,
+                            concurrent_map(delete, rds_instance_list)):
             if dbinst:
                 print "Terminated: %s" % dbinst.id
+                deleting_id_list.append(dbinst.id)
+            elif errmsg:
+                print "Failed to terminate: %s (%s)" % (rds_inst_id, errmsg)
             else:
                 print "Failed to terminate: %s" % rds_inst_id
+        if wait and deleting_id_list:
+            self.__rds_inst_wait_deleted(rds_conn, deleting_id_list)
 
     def __rds_inst_cmd(self, argv):
         """Implements the 'rds inst' command
         """
         cmd_terminate = False
         all_instances = False
+        wait = False
         disp = DisplayOptions()
         region = None
-        opt_list, args = getopt.getopt(argv, "alr:Tx")
+        opt_list, args = getopt.getopt(argv, "alr:Twx")
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
@@ -102,10 +191,12 @@ class RDSCommand(common.BaseCommand):
                     region = opt[1]
                 elif opt[0] == '-T':
                     cmd_terminate = True
+                elif opt[0] == '-w':
+                    wait = True
                 elif opt[0] == '-x':
                     disp.display = DisplayOptions.EXTENDED
         if cmd_terminate:
-            self.__rds_inst_terminate(region, args)
+            self.__rds_inst_terminate(region, args, wait)
         else:
             if args:
                 if len(args) != 1:
@@ -141,10 +232,9 @@ class RDSCommand(common.BaseCommand):
         """Implements the list function of the 'rds sg' command
         """
         rds_conn = self.get_rds_conn(region)
-        dbsg_list = rds_conn.get_all_dbsecurity_groups(groupname=groupname)
-        with CommandOutput() as pg:
-            for dbsg in dbsg_list:
-                self.__rds_sg_display(dbsg, disp, pg)
+        self.__rds_list(rds_conn.get_all_dbsecurity_groups,
+                                self.__rds_sg_display, disp,
+                                groupname=groupname)
 
     def __rds_sg_delete_cmd(self, region, args):
         """Implements the delete function of the 'rds sg' command
@@ -210,10 +300,9 @@ class RDSCommand(common.BaseCommand):
         """Implements the list function of the 'rds subnetg' command
         """
         rds_conn = self.get_rds_conn(region)
-        subnetg_list = rds_conn.get_all_db_subnet_groups(name=subnetg_name)
-        with CommandOutput() as pg:
-            for subnetg in subnetg_list:
-                self.__rds_subnetg_display(subnetg, disp, pg)
+        self.__rds_list(rds_conn.get_all_db_subnet_groups,
+                                self.__rds_subnetg_display, disp,
+                                name=subnetg_name)
 
     def __rds_subnetg_delete_cmd(self, region, args):
         """Implements the delete function of the 'rds subnetg' command
@@ -279,7 +368,13 @@ class RDSCommand(common.BaseCommand):
         rds <type> [<options>] [<args>]
 
         The type can be one of 'inst', 'sg', or 'subnetg'
-
+Options:
+    -a          : all DB instances/groups
+    -D          : delete the specified group (sg, subnetg)
+    -l          : long display
+    -T          : terminate the specified DB instances (inst)
+    -w          : with -T, wait until the DB instances are deleted
+    -x          : extended output
         """
         self.dispatch(self.__rds_cmd, ln)
 
@@ -0,0 +1,389 @@
+#
+# Copyright 2014-2016 CloudVelox Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains the implementation of the 'reach' command
+"""
+
+import getopt
+import itertools
+import os
+import sys
+import time
+
+import common
+
+from common import CommandError
+from common import CommandOutput
+from common import concurrent_map
+from netmodel import DENY
+from netmodel import NetModel
+from netmodel import PORT_PROTOCOLS
+from netmodel import SKIP
+from netmodel import format_protocol
+from netmodel import parse_ip
+from netmodel import parse_port_spec
+
+#
+# The fields of the default flow log record format
+#
+_FLOW_FIELD_LIST = ['version', 'account-id', 'interface-id', 'srcaddr',
+                    'dstaddr', 'srcport', 'dstport', 'protocol', 'packets',
+                    'bytes', 'start', 'end', 'action', 'log-status']
+
+#
+# The fields of a flow log record used to evaluate it
+#
+_FLOW_EVAL_FIELD_LIST = ['interface-id', 'srcaddr', 'dstaddr', 'protocol',
+                                            'srcport', 'dstport', 'action']
+
+
+def _read_flow_records(path):
+    """Generator that returns the (interface-id, srcaddr, dstaddr,
+    protocol, srcport, dstport, action) tuples of the flow log records in
+    the file at path ('-' for the standard input), or None for a record
+    with missing fields. The records have the default format, unless the
+    file starts with a header line naming the fields (as the flow log
+    files delivered to S3 do). Records without data are skipped.
+    """
+    if path == '-':
+        flow_file = sys.stdin
+    else:
+        try:
+            flow_file = open(os.path.expanduser(path))
+        except IOError, ioe:
+            raise CommandError("Unable to read %s: %s" % (path, ioe))
+    try:
+        line_iter = iter(flow_file.readline, '')
+        field_list = _FLOW_FIELD_LIST
+        for ln in line_iter:
+            value_list = ln.split()
+            if not value_list:
+                continue
+            if value_list[0].isdigit():
+                line_iter = itertools.chain([ln], line_iter)
+            else:
+                field_list = value_list
+            break
+        for field in _FLOW_EVAL_FIELD_LIST:
+            if field not in field_list:
+                raise CommandError("%s: no %s field in the flow log records"
+                                                        % (path, field))
+        index_list = [field_list.index(field)
+                                    for field in _FLOW_EVAL_FIELD_LIST]
+        if 'log-status' in field_list:
+            status_index = field_list.index('log-status')
+        else:
+            status_index = None
+        for ln in line_iter:
+            value_list = ln.split()
+            if not value_list:
+                continue
+            if len(value_list) != len(field_list):
+                yield None
+                continue
+            if status_index is not None and value_list[status_index] != 'OK':
+                continue
+            yield tuple([value_list[i] for i in index_list])
+    finally:
+        if flow_file is not sys.stdin:
+            flow_file.close()
+
+
+#
+# Maximum number of entries of the cache of parsed addresses
+#
+_ADDR_CACHE_SIZE = 100000
+
+
+def _parse_flow_record(record, addr_cache):
+    """Returns the tuple (interface-id, srcaddr, dstaddr, protocol,
+    srcport, dstport, accepted) for the (string) flow record fields;
+    the addresses and protocol are integers, and the ports are integers
+    or None for protocols without ports. The addresses are looked up in,
+    and added to, the addr_cache dictionary. Raises a CommandError if
+    the record is malformed.
+    """
+    eni_id, src_str, dst_str, proto_str, sport_str, dport_str, action = \
+                                                                    record
+    try:
+        proto = int(proto_str)
+        if proto in PORT_PROTOCOLS:
+            src_port, dst_port = int(sport_str), int(dport_str)
+        else:
+            src_port = dst_port = None
+    except ValueError:
+        raise CommandError("Bad flow record")
+    if action not in ('ACCEPT', 'REJECT'):
+        raise CommandError("Bad flow record action: %s" % (action,))
+    addr_list = []
+    for addr_str in (src_str, dst_str):
+        addr = addr_cache.get(addr_str)
+        if addr is None:
+            if len(addr_cache) >= _ADDR_CACHE_SIZE:
+                addr_cache.clear()
+            addr = addr_cache[addr_str] = parse_ip(addr_str)
+        addr_list.append(addr)
+    return (eni_id, addr_list[0], addr_list[1], proto,
+                                src_port, dst_port, action == 'ACCEPT')
+
+
+class ReachCommand(common.BaseCommand):
+
+    #
+    # Number of seconds that the model of a region is reused
+    #
+    MODEL_MAX_AGE = 300
+
+    #
+    # Number of flow log records evaluated per batch
+    #
+    FLOW_BATCH_SIZE = 10000
+
+    def __init__(self, interp):
+        common.BaseCommand.__init__(self, interp)
+        #
+        # Key: region-name
+        # Value: (load-time, NetModel) tuple
+        #
+        self.__model_map = {}
+
+    def __reach_get_model(self, region, reload_model):
+        """Returns the NetModel of the region; the model is built from
+        the route tables, subnets, network ACLs, security groups and
+        network interfaces of the region, which are requested
+        concurrently, and it is reused for MODEL_MAX_AGE seconds
+        """
+        vpc_conn = self.get_vpc_conn(region)
+        region_name = vpc_conn.region.name
+        now = time.time()
+        if not reload_model and region_name in self.__model_map:
+            load_time, model = self.__model_map[region_name]
+            if now - load_time < self.MODEL_MAX_AGE:
+                return model
+        rtb_list, subnet_list, nacl_list, sg_list, eni_list = \
+                concurrent_map(lambda get_all: get_all(), [
+                                vpc_conn.get_all_route_tables,
+                                vpc_conn.get_all_subnets,
+                                vpc_conn.get_all_network_acls,
+                                vpc_conn.get_all_security_groups,
+                                vpc_conn.get_all_network_interfaces,
+                                ])
+        model = NetModel(rtb_list, subnet_list, nacl_list, sg_list, eni_list)
+        self.__model_map[region_name] = (now, model)
+        return model
+
+    def __reach_eval_cmd(self, region, reload_model, args):
+        """Implements the evaluation function of the reach command
+        """
+        if len(args) != 3:
+            raise CommandError(
+                    "Expecting a source, a destination, and port/proto")
+        src_spec, dst_spec, port_spec = args
+        proto, port = parse_port_spec(port_spec)
+        model = self.__reach_get_model(region, reload_model)
+        src = model.endpoint(src_spec)
+        dst = model.endpoint(dst_spec, src.vpc_id)
+        step_list = model.evaluate(src, dst, proto, port)
+        with CommandOutput() as pg:
+            if port is None:
+                traffic = format_protocol(proto)
+            else:
+                traffic = "%d/%s" % (port, format_protocol(proto))
+            pg.prt("%s -> %s %s", src_spec, dst_spec, traffic)
+            denied_step = None
+            for step in step_list:
+                pg.prt("    %-14s %-22s %-5s %s",
+                        step.stage, step.resource_id or '-',
+                        step.verdict, step.detail)
+                if step.verdict == DENY and denied_step is None:
+                    denied_step = step
+            if denied_step is None:
+                pg.prt("Verdict: allowed")
+            else:
+                pg.prt("Verdict: blocked at %s (%s): %s",
+                            denied_step.stage,
+                            denied_step.resource_id or '-',
+                            denied_step.detail)
+
+    @staticmethod
+    def __reach_flow_report(model, eni_id_set, hit_map, pg):
+        """Display the hit counts of the rules of the network ACLs and
+        security groups of the interfaces in eni_id_set; rules without
+        hits are marked as unused
+        """
+        nacl_map = {}
+        sg_map = {}
+        for eni_id in eni_id_set:
+            nacl, sg_list = model.interface_resources(eni_id)
+            if nacl is not None:
+                nacl_map[nacl.id] = nacl
+            for compiled_sg in sg_list:
+                sg_map[compiled_sg.id] = compiled_sg
+        resource_list = [(nacl_map[nacl_id], 'nacl-')
+                                        for nacl_id in sorted(nacl_map)]
+        resource_list += [(sg_map[sg_id], 'sg-')
+                                        for sg_id in sorted(sg_map)]
+        reported_key_set = set()
+        for resource, stage_prefix in resource_list:
+            for direction, egress in (('ingress', False), ('egress', True)):
+                stage = stage_prefix + direction
+                for rule in resource.rule_list(egress) + [None]:
+                    key = (resource.id, stage, rule)
+                    hits = hit_map.get(key, 0)
+                    if rule is None and not hits:
+                        continue
+                    reported_key_set.add(key)
+                    pg.prt("%-14s %-12s %-34s %10d%s",
+                                resource.id, stage,
+                                rule if rule is not None else "(no match)",
+                                hits, "" if hits else "  unused")
+        #
+        # Traffic that none of the security groups of an interface
+        # allows is reported against the list of groups
+        #
+        for key in sorted(set(hit_map) - reported_key_set):
+            resource_id, stage, rule = key
+            pg.prt("%-14s %-12s %-34s %10d", resource_id, stage,
+                        rule if rule is not None else "(no match)",
+                        hit_map[key])
+
+    def __reach_flow_cmd(self, region, reload_model, args):
+        """Implements the flow log evaluation function of the reach
+        command: find the network ACL entry and security group rule that
+        applies to each record of a flow log file, and report the number
+        of records that each rule applied to
+        """
+        if len(args) != 1:
+            raise CommandError("Expecting a flow log file")
+        model = self.__reach_get_model(region, reload_model)
+        #
+        # Key: (resource-id, stage, rule) tuple (see ReachStep)
+        # Value: number of records
+        #
+        hit_map = {}
+        eni_id_set = set()
+        addr_cache = {}
+        n_records = 0
+        n_malformed = 0
+        n_unevaluated = 0
+        n_accepted = 0
+        n_mismatched = 0
+        record_iter = _read_flow_records(args[0])
+        while True:
+            record_list = list(itertools.islice(record_iter,
+                                                    self.FLOW_BATCH_SIZE))
+            if not record_list:
+                break
+            #
+            # Identical records (e.g. repeated flows between the same
+            # endpoints) are evaluated once per batch
+            #
+            count_map = {}
+            for record in record_list:
+                count_map[record] = count_map.get(record, 0) + 1
+            for record, count in count_map.iteritems():
+                n_records += count
+                if record is None:
+                    n_malformed += count
+                    continue
+                try:
+                    flow = _parse_flow_record(record, addr_cache)
+                except CommandError:
+                    n_malformed += count
+                    continue
+                try:
+                    step_list = model.evaluate_flow(*flow[:-1])
+                except CommandError:
+                    n_unevaluated += count
+                    continue
+                eni_id_set.add(flow[0])
+                accepted = True
+                for step in step_list:
+                    if step.verdict == SKIP:
+                        continue
+                    if step.verdict == DENY:
+                        accepted = False
+                    key = (step.resource_id, step.stage, step.rule)
+                    hit_map[key] = hit_map.get(key, 0) + count
+                if accepted:
+                    n_accepted += count
+                if accepted != flow[-1]:
+                    n_mismatched += count
+        n_evaluated = n_records - n_malformed - n_unevaluated
+        with CommandOutput() as pg:
+            self.__reach_flow_report(model, eni_id_set, hit_map, pg)
+            pg.prt("%d records: %d accepted, %d rejected, %d malformed, "
+                        "%d of unknown interfaces",
+                        n_records, n_accepted, n_evaluated - n_accepted,
+                        n_malformed, n_unevaluated)
+            if n_mismatched:
+                pg.prt("%d records have a different action in the flow log "
+                        "(the configuration may have changed)", n_mismatched)
+
+    def __reach_cmd(self, argv):
+        """Implements the reach command
+        """
+        region = None
+        reload_model = False
+        cmd_flows = False
+        opt_list, args = getopt.getopt(argv, "Er:u")
+        if opt_list:
+            for opt in opt_list:
+                if opt[0] == '-E':
+                    cmd_flows = True
+                elif opt[0] == '-r':
+                    region = opt[1]
+                elif opt[0] == '-u':
+                    reload_model = True
+        if cmd_flows:
+            self.__reach_flow_cmd(region, reload_model, args)
+        else:
+            self.__reach_eval_cmd(region, reload_model, args)
+
+    def do_reach(self, ln):
+        """
+        reach [-r region] [-u] source destination port/proto
+        reach [-r region] [-u] -E flow-log-file
+
+Evaluate whether traffic from source to destination is allowed, by
+following its path: the security groups of the source, the route table
+of the source subnet, the network ACLs of the source and destination
+subnets, the security groups of the destination, and the network ACLs
+for the return traffic (whose source port is assumed to be 49152).
+
+The source and destination are instance ids, network interface ids,
+or IP addresses; the source must be in a VPC subnet. The port/proto
+is e.g. 443/tcp or 53/udp; a port by itself means tcp, and protocols
+without ports are given by name (e.g. icmp).
+
+The route tables, network ACLs, security groups and network interfaces
+of the region are loaded once, and reused by the reach commands of the
+next 5 minutes.
+
+With -E, the network ACL entry and security group rule that applies to
+each record of a VPC flow log file ('-' for the standard input) is
+found, and the number of records per rule is reported; rules that no
+record matched are marked as unused. The records have the default
+format, unless the file starts with a header line naming the fields.
+Responses (e.g. from port 443 to an ephemeral port) are counted against
+the security group rule that allows the request.
+
+Options:
+    -E          : evaluate the records of a flow log file
+    -u          : reload the route tables, network ACLs, etc.
+        """
+        self.dispatch(self.__reach_cmd, ln)
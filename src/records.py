@@ -0,0 +1,226 @@
+#
+# Copyright 2014-2016 CloudVelox Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""This module contains compact record types for the resources that
+the commands list in bulk (instances, volumes, snapshots, images).
+
+A boto resource object has a per-object dictionary, a reference to the
+connection, and nested objects for fields that are never displayed.
+The records keep only the fields that the commands use, in __slots__,
+with the strings of low-cardinality fields (states, zones, types, tag
+keys and values) interned so that they are shared between records.
+"""
+
+import collections
+
+#
+# Shared (and never modified) tag dictionary of untagged resources
+#
+_NO_TAGS = {}
+
+InterfaceRecord = collections.namedtuple('InterfaceRecord',
+                'id device_index private_ip_address source_dest_check')
+
+BlockDeviceRecord = collections.namedtuple('BlockDeviceRecord',
+                'device volume_id status delete_on_termination')
+
+ImageBlockDeviceRecord = collections.namedtuple('ImageBlockDeviceRecord',
+                'device snapshot_id ephemeral_name delete_on_termination')
+
+
+def _str(value):
+    """Returns value as a (byte) string if it only contains ASCII
+    characters; boto returns unicode strings, which take up to 4 times
+    the space.
+    """
+    if value is None:
+        return None
+    try:
+        return str(value)
+    except UnicodeEncodeError:
+        return value
+
+
+def _intern(value):
+    """Returns the interned version of value (see _str)
+    """
+    value = _str(value)
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
+def _tag_dict(tags):
+    """Returns a dictionary with the (interned) tag keys and values
+    """
+    if not tags:
+        return _NO_TAGS
+    return dict([(_intern(key), _intern(value))
+                                        for key, value in tags.iteritems()])
+
+
+class _Record(object):
+    """Base class of the resource records; fields not specified
+    are set to None.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **field_map):
+        for field in self.__slots__:
+            setattr(self, field, field_map.get(field))
+
+
+class InstanceRecord(_Record):
+    """An EC2 instance
+    """
+
+    __slots__ = ('id', 'state', 'placement', 'instance_type', 'launch_time',
+                'architecture', 'virtualization_type', 'hypervisor',
+                'platform', 'image_id', 'kernel', 'ramdisk',
+                'root_device_name', 'root_device_type', 'ebs_optimized',
+                'vpc_id', 'subnet_id', 'ip_address', 'private_ip_address',
+                'interfaces', 'group_ids', 'block_devices', 'tags')
+
+    @classmethod
+    def from_boto(cls, instance):
+        """Returns the record of a boto.ec2.instance.Instance
+        """
+        interface_list = [InterfaceRecord(_str(netif.id),
+                                netif.attachment.device_index
+                                    if netif.attachment else None,
+                                _str(netif.private_ip_address),
+                                netif.source_dest_check)
+                                for netif in instance.interfaces]
+        bdev_list = []
+        if instance.block_device_mapping:
+            for bdev in sorted(instance.block_device_mapping):
+                bdev_info = instance.block_device_mapping[bdev]
+                bdev_list.append(BlockDeviceRecord(_intern(bdev),
+                                        _str(bdev_info.volume_id),
+                                        _intern(bdev_info.status),
+                                        bdev_info.delete_on_termination))
+        return cls(id=_str(instance.id),
+                state=_intern(instance.state),
+                placement=_intern(instance.placement),
+                instance_type=_intern(instance.instance_type),
+                launch_time=_str(instance.launch_time),
+                architecture=_intern(instance.architecture),
+                virtualization_type=_intern(instance.virtualization_type),
+                hypervisor=_intern(instance.hypervisor),
+                platform=_intern(instance.platform),
+                image_id=_intern(instance.image_id),
+                kernel=_intern(instance.kernel),
+                ramdisk=_intern(instance.ramdisk),
+                root_device_name=_intern(instance.root_device_name),
+                root_device_type=_intern(instance.root_device_type),
+                ebs_optimized=bool(instance.ebs_optimized),
+                vpc_id=_intern(instance.vpc_id),
+                subnet_id=_intern(instance.subnet_id),
+                ip_address=_str(instance.ip_address),
+                private_ip_address=_str(instance.private_ip_address),
+                interfaces=tuple(interface_list),
+                group_ids=tuple([_intern(group.id)
+                                        for group in instance.groups]),
+                block_devices=tuple(bdev_list),
+                tags=_tag_dict(instance.tags))
+
+
+class VolumeRecord(_Record):
+    """An EBS volume; the attach_* fields are None if the volume
+    is not attached
+    """
+
+    __slots__ = ('id', 'status', 'zone', 'size', 'snapshot_id',
+                'create_time', 'type', 'iops',
+                'attach_instance_id', 'attach_device', 'attach_status',
+                'attach_time', 'tags')
+
+    @classmethod
+    def from_boto(cls, volume):
+        """Returns the record of a boto.ec2.volume.Volume
+        """
+        record = cls(id=_str(volume.id),
+                status=_intern(volume.status),
+                zone=_intern(volume.zone),
+                size=volume.size,
+                snapshot_id=_str(volume.snapshot_id),
+                create_time=_str(volume.create_time),
+                type=_intern(volume.type),
+                iops=volume.iops,
+                tags=_tag_dict(volume.tags))
+        atd = volume.attach_data
+        if atd:
+            record.attach_instance_id = _str(atd.instance_id)
+            record.attach_device = _intern(atd.device)
+            record.attach_status = _intern(atd.status)
+            record.attach_time = _str(atd.attach_time)
+        return record
+
+
+class SnapshotRecord(_Record):
+    """An EBS snapshot
+    """
+
+    __slots__ = ('id', 'status', 'progress', 'description', 'start_time',
+                'volume_size', 'volume_id', 'tags')
+
+    @classmethod
+    def from_boto(cls, snapshot):
+        """Returns the record of a boto.ec2.snapshot.Snapshot
+        """
+        return cls(id=_str(snapshot.id),
+                status=_intern(snapshot.status),
+                progress=_intern(snapshot.progress),
+                description=_str(snapshot.description),
+                start_time=_str(snapshot.start_time),
+                volume_size=snapshot.volume_size,
+                volume_id=_str(snapshot.volume_id),
+                tags=_tag_dict(snapshot.tags))
+
+
+class ImageRecord(_Record):
+    """An AMI; the records are created by the fast response parser
+    (see fastparse.py)
+    """
+
+    __slots__ = ('id', 'state', 'location', 'name', 'is_public', 'owner_id',
+                'description', 'architecture', 'virtualization_type',
+                'hypervisor', 'platform', 'kernel_id', 'ramdisk_id',
+                'root_device_name', 'root_device_type', 'block_devices',
+                'tags')
+
+
+def instance_records(reservation_list):
+    """Returns a list with the records of the instances in the
+    reservations in reservation_list
+    """
+    return [InstanceRecord.from_boto(instance)
+                                for reservation in reservation_list
+                                    for instance in reservation.instances]
+
+
+def volume_records(volume_list):
+    """Returns a list with the records of the volumes in volume_list
+    """
+    return [VolumeRecord.from_boto(volume) for volume in volume_list]
+
+
+def snapshot_records(snapshot_list):
+    """Returns a list with the records of the snapshots in snapshot_list
+    """
+    return [SnapshotRecord.from_boto(snapshot) for snapshot in snapshot_list]
@@ -19,6 +19,8 @@
 """
 
 import getopt
+import os
+import sys
 
 import common
 
@@ -26,6 +28,41 @@ from common import CommandError
 from common import DisplayOptions
 from common import CommandOutput
 from common import ResourceSelector
+from common import concurrent_map
+from common import optional
+from netmodel import RouteIndex
+from netmodel import parse_ip
+from netmodel import route_target
+
+
+def _read_lookups(path):
+    """Generator that returns the (subnet-id, ip-address, error) tuples
+    for the lines of the file at path ('-' for the standard input), one
+    pair per line; the subnet id and address are separated by whitespace
+    or a comma, and text following a '#' is ignored. For a malformed
+    line, subnet-id and ip-address are None and error describes the
+    problem; otherwise error is None.
+    """
+    if path == '-':
+        lookup_file = sys.stdin
+    else:
+        try:
+            lookup_file = open(os.path.expanduser(path))
+        except IOError, ioe:
+            raise CommandError("Unable to read %s: %s" % (path, ioe))
+    try:
+        for lineno, ln in enumerate(iter(lookup_file.readline, ''), 1):
+            field_list = ln.split('#', 1)[0].replace(',', ' ').split()
+            if not field_list:
+                continue
+            if len(field_list) != 2:
+                yield None, None, ("%s, line %d: expecting a subnet id "
+                                "and an IP address" % (path, lineno))
+                continue
+            yield field_list[0], field_list[1], None
+    finally:
+        if lookup_file is not sys.stdin:
+            lookup_file.close()
 
 
 class RTBCommand(common.BaseCommand):
@@ -40,14 +77,10 @@ class RTBCommand(common.BaseCommand):
             pg.prt("%s", rtb.id)
             pg.prt("%15s : %s", "VPC", rtb.vpc_id)
             for route in rtb.routes:
-                if route.gateway_id:
-                    dest = route.gateway_id 
-                else:
-                    dest = route.instance_id 
                 pg.prt("%15s : %-16s %-12s %s",
                         "Route",
                         route.destination_cidr_block,
-                        dest,
+                        route_target(route),
                         route.state)
             if disp.display_tags:
                 common.display_tags(rtb.tags, pg)
@@ -70,6 +103,66 @@ class RTBCommand(common.BaseCommand):
             for rtb in rtb_list:
                 self.__rtb_display(rtb, disp, pg)
 
+    def __rtb_get_route_index(self, region):
+        """Returns a RouteIndex of the route tables of the region; the
+        route tables and the subnets are requested concurrently
+        """
+        vpc_conn = self.get_vpc_conn(region)
+        rtb_list, subnet_list = concurrent_map(lambda get_all: get_all(),
+                                [vpc_conn.get_all_route_tables,
+                                    vpc_conn.get_all_subnets])
+        return RouteIndex(rtb_list, subnet_list)
+
+    def __rtb_lookup_cmd(self, region, args):
+        """Implements the route lookup function of the rtb command:
+        resolve the route of traffic from a subnet to an IP address,
+        for one (subnet-id, ip-address) pair, or for the pairs in a file
+        """
+        if len(args) == 2:
+            lookup_iter = iter([(args[0], args[1], None)])
+        elif len(args) == 1:
+            lookup_iter = _read_lookups(args[0])
+        else:
+            raise CommandError(
+                "Expecting a subnet id and an IP address, or a file name")
+        bulk_lookup = len(args) == 1
+        route_index = self.__rtb_get_route_index(region)
+        n_lookups = 0
+        n_unrouted = 0
+        n_failed = 0
+        with CommandOutput() as pg:
+            for subnet_id, ip_str, error in lookup_iter:
+                n_lookups += 1
+                if error is not None:
+                    n_failed += 1
+                    pg.prt("%s", error)
+                    continue
+                try:
+                    rtb_id, route = route_index.resolve(subnet_id,
+                                                        parse_ip(ip_str))
+                except CommandError, cmderr:
+                    #
+                    # A bad line does not stop a bulk lookup
+                    #
+                    if not bulk_lookup:
+                        raise
+                    n_failed += 1
+                    pg.prt("%-16s %-16s %s", subnet_id, ip_str, cmderr)
+                    continue
+                if route is None:
+                    n_unrouted += 1
+                    pg.prt("%-16s %-16s %-14s %s",
+                                subnet_id, ip_str, rtb_id, "no-route")
+                    continue
+                pg.prt("%-16s %-16s %-14s %-18s %-22s %s",
+                            subnet_id, ip_str, rtb_id,
+                            route.destination_cidr_block,
+                            optional(route_target(route)),
+                            optional(route.state))
+            if bulk_lookup:
+                pg.prt("%d lookups, %d without a route, %d failed",
+                                        n_lookups, n_unrouted, n_failed)
+
     def __rtb_delete_cmd(self, region, rtb_id_list):
         """Implements the delete function of the rtb command
         """
@@ -133,7 +226,8 @@ class RTBCommand(common.BaseCommand):
         cmd_delete = False
         cmd_delete_route = False
         cmd_add_route = False
-        opt_list, args = getopt.getopt(argv, "aDf:lq:r:Stv:Xx")
+        cmd_lookup = False
+        opt_list, args = getopt.getopt(argv, "aDf:lLPq:r:Stv:Xx")
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
@@ -144,6 +238,10 @@ class RTBCommand(common.BaseCommand):
                     selector.add_filter_spec(opt[1])
                 elif opt[0] == '-l':
                     disp.display = DisplayOptions.LONG
+                elif opt[0] == '-L':
+                    self.use_offline_inventory()
+                elif opt[0] == '-P':
+                    cmd_lookup = True
                 elif opt[0] == '-q':
                     selector.add_tag_filter_spec(opt[1])
                 elif opt[0] == '-r':
@@ -165,6 +263,8 @@ class RTBCommand(common.BaseCommand):
             self.__rtb_add_route_cmd(region, args)
         elif cmd_delete_route:
             self.__rtb_delete_route_cmd(region, args)
+        elif cmd_lookup:
+            self.__rtb_lookup_cmd(region, args)
         else:
             selector.resource_id_list = args
             self.__rtb_list_cmd(region, selector, disp)
@@ -175,6 +275,10 @@ class RTBCommand(common.BaseCommand):
 
 Options:
     -D          : delete the specified route table(s)
+    -P          : resolve the route of traffic from a subnet to an IP
+                  address; the arguments are either a subnet-id and an
+                  IP address, or a file (- for standard input) with one
+                  subnet-id and IP address per line
     -S          : add a route to the route table; the arguments are:
                         rtb-id, instance-id or IGW-id, CIDR
     -X          : delete a route from the route table; the argument is
@@ -194,6 +194,8 @@ class SGCommand(common.BaseCommand):
     def __sg_list_cmd(self, region, selector, disp):
         """List security groups
         """
+        if not self.pipe_select(region, 'security-group', selector):
+            return
         if not selector.has_selection():
             return
         ec2_conn = self.get_ec2_conn(region)
@@ -201,6 +203,8 @@ class SGCommand(common.BaseCommand):
                                         group_ids=selector.resource_id_list,
                                         filters=selector.get_filter_dict())
         self.cache_insert(region, [sg.id for sg in sg_list])
+        if self.pipe_output(region, 'security-group', sg_list):
+            return
         with CommandOutput() as pg:
             if disp.display_count:
                 print "SG count: %d" % (len(sg_list),)
@@ -367,7 +371,7 @@ class SGCommand(common.BaseCommand):
         port_spec = None
         principal_sg_id = None
         vpc_id = None   # used when creating a SG
-        opt_list, args = getopt.getopt(argv, "aACDf:g:kln:p:q:Rr:s:tv:x")
+        opt_list, args = getopt.getopt(argv, "aACDf:g:klLn:p:q:Rr:s:tv:x")
         for opt in opt_list:
             if opt[0] == '-A':
                 cmd_authorize = True
@@ -385,6 +389,8 @@ class SGCommand(common.BaseCommand):
                 disp.display_count = True
             elif opt[0] == '-l':
                 disp.display = DisplayOptions.LONG
+            elif opt[0] == '-L':
+                self.use_offline_inventory()
             elif opt[0] == '-n':
                 selector.add_filter('group-name', opt[1])
             elif opt[0] == '-p':
@@ -22,6 +22,7 @@ import getopt
 
 import common
 
+from columns import get_projection
 from common import amazon2localtime
 from common import amazon2unixtime
 from common import CommandError
@@ -29,6 +30,10 @@ from common import confirm, confirm_aggr
 from common import DisplayOptions
 from common import CommandOutput
 from common import ResourceSelector
+from common import describe_ids
+from common import use_describe_ids
+from fastparse import count_snapshots
+from fastparse import get_snapshot_records
 
 
 class SnapCommand(common.BaseCommand):
@@ -36,7 +41,7 @@ class SnapCommand(common.BaseCommand):
     """
 
     def __snap_display(self, snapshot, disp, pg, region):
-        """Display snapshot info
+        """Display snapshot info; snapshot is a SnapshotRecord
         """
         self.cache_insert(region, [snapshot.id])
         if disp.display_size:
@@ -62,7 +67,9 @@ class SnapCommand(common.BaseCommand):
                 pg.prt("%15s : %s", "Volume", snapshot.volume_id)
                 self.cache_insert(region, [snapshot.volume_id])
                 try:
-                    snapshot_attr_list = snapshot.get_permissions()
+                    ec2_conn = self.get_ec2_conn(region)
+                    snapshot_attr_list = ec2_conn.get_snapshot_attribute(
+                                snapshot.id, 'createVolumePermission').attrs
                     for snapshot_attr in snapshot_attr_list:
                         pg.prt("%15s : %s",
                                 snapshot_attr, 
@@ -76,17 +83,54 @@ class SnapCommand(common.BaseCommand):
                 if disp.display_tags:
                     common.display_tags(snapshot.tags, pg)
 
-    def __snap_list_cmd(self, region, selector, disp):
-        """Implements the list function of the snap command
+    def __snap_list(self, region, selector, disp):
+        """Returns the list of selected snapshots; when only their count
+        is needed, the count is displayed and None is returned
         """
-        if not selector.has_selection():
-            return
         ec2_conn = self.get_ec2_conn(region)
-        snapshot_list = ec2_conn.get_all_snapshots(
+        if use_describe_ids(selector):
+            snapshot_list = describe_ids(
+                        lambda filter_dict: get_snapshot_records(ec2_conn,
+                                        owner='self', filters=filter_dict),
+                        'snapshot-id', selector)
+            self.name_index_insert(region, 'snapshot', snapshot_list)
+            return list(selector.filter_resources(snapshot_list))
+        if disp.display_count and not disp.display_size and \
+                not selector.match_pattern and not self.output_is_piped():
+            #
+            # Only the count is needed
+            #
+            n_snapshots = count_snapshots(ec2_conn,
                                 snapshot_ids=selector.resource_id_list,
                                 owner='self',
                                 filters=selector.get_filter_dict())
-        snapshot_list = selector.filter_resources(snapshot_list)
+            with CommandOutput(output_path=disp.get_output_file()) as pg:
+                pg.prt("Snapshot count: %d", n_snapshots)
+            return None
+        snapshot_list = get_snapshot_records(ec2_conn,
+                                snapshot_ids=selector.resource_id_list,
+                                owner='self',
+                                filters=selector.get_filter_dict())
+        self.name_index_insert(region, 'snapshot', snapshot_list)
+        return list(selector.filter_resources(snapshot_list))
+
+    def __snap_list_cmd(self, region, selector, disp):
+        """Implements the list function of the snap command
+        """
+        if not self.pipe_select(region, 'snapshot', selector):
+            return
+        if not selector.has_selection():
+            return
+        if not self.resolve_resource_names(region, 'snapshot', selector):
+            return
+        snapshot_list = self.pipe_records('snapshot', selector)
+        if snapshot_list is None:
+            snapshot_list = self.describe_named(region, 'snapshot', selector,
+                            lambda: self.__snap_list(region, selector, disp))
+            if snapshot_list is None:
+                return
+        if self.pipe_output(region, 'snapshot', snapshot_list):
+            return
         with CommandOutput(output_path=disp.get_output_file()) as pg:
             if disp.display_count:
                 if disp.display_size:
@@ -97,6 +141,11 @@ class SnapCommand(common.BaseCommand):
                     pg.prt("Snapshot count: %d", len(snapshot_list))
             else:
                 snapshot_list = disp.order_resources(snapshot_list)
+                if disp.columns is not None:
+                    disp.columns.display(snapshot_list, pg)
+                    self.cache_insert(region,
+                            [snapshot.id for snapshot in snapshot_list])
+                    return
                 for snapshot in snapshot_list:
                     self.__snap_display(snapshot, disp, pg, region)
 
@@ -122,7 +171,7 @@ class SnapCommand(common.BaseCommand):
         if selector.is_explicit():
             snapshot_id_list = selector.resource_id_list
         else:
-            snapshot_list = ec2_conn.get_all_snapshots(owner='self',
+            snapshot_list = get_snapshot_records(ec2_conn, owner='self',
                                         filters=selector.get_filter_dict())
             matching_snapshots = selector.filter_resources(snapshot_list)
             snapshot_id_list = [snapshot.id for snapshot in matching_snapshots]
@@ -200,7 +249,7 @@ class SnapCommand(common.BaseCommand):
         disp = DisplayOptions()
         selector = ResourceSelector()
         region = None
-        opt_list, args = getopt.getopt(argv, "aCDd:f:klm:nO:o:q:r:SsxtUz:")
+        opt_list, args = getopt.getopt(argv, "aCDd:f:I:klLm:nO:o:q:r:SsxtUy:z:")
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
@@ -213,10 +262,14 @@ class SnapCommand(common.BaseCommand):
                     description = opt[1]
                 elif opt[0] == '-f':
                     selector.add_filter_spec(opt[1])
+                elif opt[0] == '-I':
+                    selector.id_input_path = opt[1]
                 elif opt[0] == '-k':
                     disp.display_count = True
                 elif opt[0] == '-l':
                     disp.display = DisplayOptions.LONG
+                elif opt[0] == '-L':
+                    self.use_offline_inventory()
                 elif opt[0] == '-m':
                     selector.match_pattern = opt[1]
                 elif opt[0] == '-n':
@@ -237,10 +290,16 @@ class SnapCommand(common.BaseCommand):
                     disp.display_tags = True
                 elif opt[0] == '-x':
                     disp.display = DisplayOptions.EXTENDED
+                elif opt[0] == '-y':
+                    disp.columns = get_projection('snapshot', opt[1])
                 elif opt[0] == '-U':
                     cmd_unshare_snapshot = True
                 elif opt[0] == '-z':
                     selector.add_filter('status', opt[1])
+        if selector.id_input_path and (cmd_create_snapshot or
+                                cmd_delete_snapshot or cmd_share_snapshot or
+                                cmd_unshare_snapshot):
+            raise CommandError("-I can only be used when listing snapshots")
         if cmd_create_snapshot:
             self.__snap_create(region, description, args)
         elif cmd_delete_snapshot:
@@ -251,7 +310,7 @@ class SnapCommand(common.BaseCommand):
         elif cmd_unshare_snapshot:
             self.__snap_share(region, False, args)
         else:
-            selector.resource_id_list = args
+            selector.set_resource_ids(args, 'snap-')
             self.__snap_list_cmd(region, selector, disp)
 
     def do_snap(self, ln):
@@ -262,6 +321,8 @@ Options:
     -C          : create a snapshot for each of the specified volumes
     -D          : delete snapshot(s)
     -d desc     : snapshot description (when creating a snapshot)
+    -I file     : list the snapshots with the ids in file ('-' for the
+                  standard input); the ids are described in batches
     -k          : displays the snapshot count
     -o order    : the order consists of a comma-separated list
                   of attr_spec where the attr_spec is [~]attr. The
@@ -278,8 +339,15 @@ Options:
                   the pattern is a regular expression as per python's
                   re library package
     -U          : unshare a snapshot
+    -y columns  : display only the specified columns; columns is a
+                  comma-separated list of column names (tag:<key> is the
+                  value of a tag), or @name for a saved template
+                  (see 'help columns')
     -z status   : show only snapshots with the specified status
                   (pending, completed, error)
+
+When listing snapshots, the arguments are snapshot-ids or snapshot names
+(i.e. values of the Name tag).
         """
         self.dispatch(self.__snap_cmd, ln)
 
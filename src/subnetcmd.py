@@ -20,16 +20,48 @@
 
 import getopt
 
+import boto
+
 import common
 
 from common import CommandError
 from common import DisplayOptions
 from common import CommandOutput
 from common import ResourceSelector
+from common import concurrent_map
+from common import retry_throttled
+from netmodel import IntervalIndex
+from netmodel import format_cidr
+from netmodel import parse_cidr
+from netmodel import parse_ip
 
 
 class SubnetCommand(common.BaseCommand):
 
+    #
+    # Number of times the creation of a subnet whose CIDR block was
+    # taken by another subnet in the meantime is retried with a new block
+    #
+    CREATE_RETRIES = 3
+
+    #
+    # The prefix lengths allowed by AWS for subnets
+    #
+    MIN_PREFIX_LEN = 16
+    MAX_PREFIX_LEN = 28
+
+    #
+    # AWS reserves the first four and the last address of each subnet
+    #
+    RESERVED_HEAD_COUNT = 4
+    RESERVED_TAIL_COUNT = 1
+
+    #
+    # Default utilization (percentage of the usable addresses in use)
+    # at which a subnet is flagged by the utilization report
+    #
+    DEFAULT_USAGE_THRESHOLD = 80
+
     @staticmethod
     def __subnet_display(subnet, disp, pg):
         """Display subnet info
@@ -56,6 +88,8 @@ class SubnetCommand(common.BaseCommand):
     def __subnet_list_cmd(self, region, selector, disp):
         """Implements the list function of the subnet command
         """
+        if not self.pipe_select(region, 'subnet', selector):
+            return
         if not selector.has_selection():
             return
         vpc_conn = self.get_vpc_conn(region)
@@ -63,6 +97,8 @@ class SubnetCommand(common.BaseCommand):
                                 subnet_ids=selector.resource_id_list,
                                 filters=selector.get_filter_list())
         self.cache_insert(region, [subnet.id for subnet in subnet_list])
+        if self.pipe_output(region, 'subnet', subnet_list):
+            return
         with CommandOutput() as pg:
             for subnet in subnet_list:
                 self.__subnet_display(subnet, disp, pg)
@@ -97,6 +133,206 @@ class SubnetCommand(common.BaseCommand):
         self.cache_insert(region, [subnet.id])
         print subnet.id
 
+    @staticmethod
+    def __subnet_alloc_blocks(vpc, subnet_list, claimed_block_list,
+                                                    prefix_len, count):
+        """Returns the list of up to count free CIDR blocks (as (net,
+        prefix-len) tuples) of the VPC, with the specified prefix length;
+        the blocks of the subnets and the claimed blocks are not free
+        """
+        used_index = IntervalIndex()
+        for subnet in subnet_list:
+            used_index.add_cidr(*parse_cidr(subnet.cidr_block))
+        for block in claimed_block_list:
+            used_index.add_cidr(*block)
+        vpc_net, vpc_prefix_len = parse_cidr(vpc.cidr_block)
+        return used_index.find_free_blocks(vpc_net, vpc_prefix_len,
+                                                    prefix_len, count)
+
+    def __subnet_alloc_create_cmd(self, region, vpc_id, prefix_len, count,
+                                                                args):
+        """Implements the subnet creation functionality of the subnet
+        command when the CIDR blocks are allocated by us: create count
+        subnets with the specified prefix length in the free address
+        space of the VPC, spread over the zones in args (all zones of the
+        region if none); the vpc-id may also be in args. The subnets
+        are created concurrently; the creation of a subnet whose block was
+        taken by another subnet in the meantime is retried with a new
+        block.
+        """
+        zone_list = []
+        for arg in args:
+            if arg.startswith('vpc-'):
+                vpc_id = arg
+            elif self.is_valid_zone(region, arg):
+                zone_list.append(arg)
+            else:
+                raise CommandError("Invalid zone: %s" % (arg,))
+        if vpc_id is None:
+            raise CommandError("No VPC specified")
+        if prefix_len is None:
+            raise CommandError("No subnet size specified")
+        if not self.MIN_PREFIX_LEN <= prefix_len <= self.MAX_PREFIX_LEN:
+            raise CommandError("The subnet size must be between /%d and /%d"
+                            % (self.MIN_PREFIX_LEN, self.MAX_PREFIX_LEN))
+        if not zone_list:
+            zone_list = sorted(self.get_valid_zone_names(region))
+        vpc_conn = self.get_vpc_conn(region)
+        vpc_list, subnet_list = concurrent_map(lambda get_all: get_all(), [
+                    lambda: vpc_conn.get_all_vpcs([vpc_id]),
+                    lambda: vpc_conn.get_all_subnets(
+                                        filters={'vpc-id' : vpc_id}),
+                    ])
+        vpc = vpc_list[0]
+        pending_zone_list = [zone_list[i % len(zone_list)]
+                                                for i in xrange(count)]
+        block_list = self.__subnet_alloc_blocks(vpc, subnet_list, [],
+                                                    prefix_len, count)
+        if len(block_list) < count:
+            raise CommandError("%s has room for %d /%d subnet(s)" %
+                                    (vpc_id, len(block_list), prefix_len))
+
+        def create(block_zone):
+            """Returns the tuple (subnet, error)
+            """
+            block, zone = block_zone
+            try:
+                return retry_throttled(vpc_conn.create_subnet,
+                                vpc_id, format_cidr(*block), zone), None
+            except boto.exception.BotoServerError, serverr:
+                return None, serverr
+
+        #
+        # The blocks of the subnets we created, or that we failed to
+        # create because another subnet got the block first
+        #
+        claimed_block_list = []
+        n_retries = 0
+        while True:
+            retry_zone_list = []
+            for block, zone, (subnet, serverr) in zip(block_list,
+                    pending_zone_list, concurrent_map(create,
+                                    zip(block_list, pending_zone_list))):
+                if subnet is not None:
+                    claimed_block_list.append(block)
+                    self.cache_insert(region, [subnet.id])
+                    print "%-20s %-18s %s" % (subnet.id, subnet.cidr_block,
+                                                subnet.availability_zone)
+                elif serverr.error_code == 'InvalidSubnet.Conflict':
+                    claimed_block_list.append(block)
+                    retry_zone_list.append(zone)
+                else:
+                    print "Failed to create a subnet for %s in %s: %s" % \
+                        (format_cidr(*block), zone, serverr.error_message)
+            if not retry_zone_list:
+                break
+            if n_retries == self.CREATE_RETRIES:
+                print "Gave up creating %d subnet(s) after %d retries" % \
+                                (len(retry_zone_list), self.CREATE_RETRIES)
+                break
+            n_retries += 1
+            pending_zone_list = retry_zone_list
+            subnet_list = vpc_conn.get_all_subnets(
+                                        filters={'vpc-id' : vpc_id})
+            block_list = self.__subnet_alloc_blocks(vpc, subnet_list,
+                                    claimed_block_list, prefix_len,
+                                    len(pending_zone_list))
+            if len(block_list) < len(pending_zone_list):
+                print "No room for %d more /%d subnet(s) in %s" % \
+                        (len(pending_zone_list) - len(block_list),
+                                                    prefix_len, vpc_id)
+                pending_zone_list = pending_zone_list[:len(block_list)]
+                if not block_list:
+                    break
+
+    def __subnet_usage_cmd(self, region, vpc_id, selector, threshold):
+        """Implements the utilization report of the subnet command: the
+        used and free addresses of each subnet, and the fragmentation of
+        its free address space. The used addresses are the private
+        addresses (primary and secondary) of the network interfaces,
+        which are listed with a single request, concurrently with the
+        subnets. Subnets with a utilization at or above threshold percent
+        are flagged.
+        """
+        if not selector.has_selection():
+            selector.select_all = True
+        if selector.resource_id_list:
+            eni_filter_dict = {'subnet-id' : selector.resource_id_list}
+        elif vpc_id is not None:
+            eni_filter_dict = {'vpc-id' : vpc_id}
+        else:
+            eni_filter_dict = None
+        vpc_conn = self.get_vpc_conn(region)
+        subnet_list, eni_list = concurrent_map(lambda get_all: get_all(), [
+                    lambda: vpc_conn.get_all_subnets(
+                                subnet_ids=selector.resource_id_list,
+                                filters=selector.get_filter_list()),
+                    lambda: vpc_conn.get_all_network_interfaces(
+                                filters=eni_filter_dict),
+                    ])
+        #
+        # Key: subnet-id
+        # Value: IntervalIndex of the used addresses of the subnet
+        #
+        addr_index_map = dict([(subnet.id, IntervalIndex())
+                                                for subnet in subnet_list])
+        for eni in eni_list:
+            addr_index = addr_index_map.get(eni.subnet_id)
+            if addr_index is None:
+                continue
+            addr_index.add(parse_ip(eni.private_ip_address),
+                                    parse_ip(eni.private_ip_address))
+            for private_ip in eni.private_ip_addresses:
+                addr = parse_ip(private_ip.private_ip_address)
+                addr_index.add(addr, addr)
+        report_list = []
+        for subnet in subnet_list:
+            net, prefix_len = parse_cidr(subnet.cidr_block)
+            first = net + self.RESERVED_HEAD_COUNT
+            last = net + (1 << (32 - prefix_len)) - 1 - \
+                                            self.RESERVED_TAIL_COUNT
+            n_usable = max(last - first + 1, 0)
+            free_range_list = addr_index_map[subnet.id].free_ranges(first,
+                                                                    last)
+            n_free = sum([range_last - range_first + 1
+                        for range_first, range_last in free_range_list])
+            n_used = n_usable - n_free
+            largest_free = max([range_last - range_first + 1
+                        for range_first, range_last in free_range_list] or
+                                                                        [0])
+            usage_pct = 100.0 * n_used / n_usable if n_usable else 100.0
+            report_list.append((-usage_pct, subnet.id, subnet, n_usable,
+                                n_used, n_free, len(free_range_list),
+                                largest_free))
+        report_list.sort()
+        n_alarms = 0
+        with CommandOutput() as pg:
+            for neg_usage_pct, _, subnet, n_usable, n_used, n_free, \
+                    n_free_ranges, largest_free in report_list:
+                usage_pct = -neg_usage_pct
+                alarm = usage_pct >= threshold
+                if alarm:
+                    n_alarms += 1
+                #
+                # The fragmentation is the fraction of the free addresses
+                # outside the largest free range
+                #
+                if n_free:
+                    fragmentation_pct = 100.0 * (n_free - largest_free) / \
+                                                                    n_free
+                else:
+                    fragmentation_pct = 0.0
+                pg.prt("%-16s %-18s %-11s %6d/%-6d %5.1f%%  "
+                        "free: %d in %d range(s), %.1f%% fragmented%s",
+                        subnet.id, subnet.cidr_block,
+                        subnet.availability_zone, n_used, n_usable,
+                        usage_pct, n_free, n_free_ranges,
+                        fragmentation_pct,
+                        "  ALARM" if alarm else "")
+            pg.prt("%d subnet(s), %d network interface(s); "
+                    "%d subnet(s) at or above %d%% utilization",
+                    len(subnet_list), len(eni_list), n_alarms, threshold)
+
     def __subnet_delete_cmd(self, region, subnet_id_list):
         """Implements the subnet deletion functionality of the subnet command
         The expected arguments are the VPC-id, the zone and the CIDR. 
@@ -111,11 +347,15 @@ class SubnetCommand(common.BaseCommand):
         """
         cmd_create = False
         cmd_delete = False
+        cmd_usage = False
+        threshold = self.DEFAULT_USAGE_THRESHOLD
         selector = ResourceSelector()
         disp = DisplayOptions()
         region = None
-        opt_list, args = getopt.getopt(argv, "aCDf:lq:r:xtv:")
+        opt_list, args = getopt.getopt(argv, "aCDf:lLN:q:r:s:tUv:w:x")
         vpc_id = None
+        prefix_len = None
+        count = None
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
@@ -128,22 +368,49 @@ class SubnetCommand(common.BaseCommand):
                     selector.add_filter_spec(opt[1])
                 elif opt[0] == '-l':
                     disp.display = DisplayOptions.LONG
+                elif opt[0] == '-L':
+                    self.use_offline_inventory()
+                elif opt[0] == '-N':
+                    try:
+                        count = int(opt[1])
+                    except ValueError:
+                        raise CommandError("Bad subnet count: %s" % (opt[1],))
+                    if count <= 0:
+                        raise CommandError("Bad subnet count: %s" % (opt[1],))
                 elif opt[0] == '-q':
                     selector.add_tag_filter_spec(opt[1])
                 elif opt[0] == '-r':
                     region = opt[1]
+                elif opt[0] == '-s':
+                    size = opt[1][1:] if opt[1].startswith('/') else opt[1]
+                    if not size.isdigit():
+                        raise CommandError("Bad subnet size: %s" % (opt[1],))
+                    prefix_len = int(size)
                 elif opt[0] == '-t':
                     disp.display_tags = True
+                elif opt[0] == '-U':
+                    cmd_usage = True
                 elif opt[0] == '-v':
                     vpc_id = opt[1]
                     selector.add_filter('vpc-id', vpc_id)
+                elif opt[0] == '-w':
+                    try:
+                        threshold = int(opt[1].rstrip('%'))
+                    except ValueError:
+                        raise CommandError("Bad threshold: %s" % (opt[1],))
                 elif opt[0] == '-x':
                     disp.display = DisplayOptions.EXTENDED
-        if cmd_create:
+        if cmd_create and (prefix_len is not None or count is not None):
+            self.__subnet_alloc_create_cmd(region, vpc_id, prefix_len,
+                                                count or 1, args)
+        elif cmd_create:
             # the vpc-id may be specified via option, or as an argument
             self.__subnet_create_cmd(region, vpc_id, args)
         elif cmd_delete:
             self.__subnet_delete_cmd(region, args)
+        elif cmd_usage:
+            selector.resource_id_list = args
+            self.__subnet_usage_cmd(region, vpc_id, selector, threshold)
         else:
             selector.resource_id_list = args
             self.__subnet_list_cmd(region, selector, disp)
@@ -151,6 +418,8 @@ class SubnetCommand(common.BaseCommand):
     def do_subnet(self, ln):
         """
         subnet [std-options] [list-options] [-v vpc_id] [-C] [-D]
+        subnet [std-options] -C -v vpc_id -s /prefix-len [-N count] [zone] ...
+        subnet [std-options] -U [-v vpc_id] [-w pct] [subnet-id] ...
 
 The -v option displays the subnets of the specified vpc-id.
 
@@ -158,7 +427,19 @@ The -C option is used to create a subnet; the expected arguments are
     vpc-id, CIDR, zone
 in any order.
 
+With the -s option, -C creates count subnets (1 by default) of the
+specified size (e.g. /24) in the free address space of the VPC; the
+subnets are spread over the specified zones, or over all zones of the
+region if none is specified, and are created concurrently.
+
 The -D option is used to delete subnets; the expected arguments are subnet ids.
+
+The -U option reports the utilization of the specified subnets (all
+subnets, or those of the VPC, if none is specified): the addresses used
+by network interfaces (primary and secondary), the free addresses, and
+the number of ranges of free addresses and the size of the largest one.
+Subnets with a utilization at or above the -w threshold (80% by
+default) are flagged with ALARM.
         """
         self.dispatch(self.__subnet_cmd, ln)
 
@@ -19,12 +19,42 @@
 """
 
 import getopt
+import hashlib
+import math
+import struct
+import sys
+import threading
+
+from boto.ec2.tag import Tag
 
 import common
 
 from common import CommandError
 from common import CommandOutput
+from common import PagePrefetcher
 from common import ResourceSelector
+from common import chunk_list
+from common import concurrent_map
+from common import confirm
+from common import retry_throttled
+from fastparse import get_image_records
+from fastparse import get_snapshot_records
+
+#
+# Maximum number of resource ids in a single CreateTags/DeleteTags request
+#
+_TAG_BATCH_SIZE = 1000
+
+#
+# Number of tags requested per DescribeTags call when streaming tags
+#
+_TAG_PAGE_SIZE = 1000
+
+#
+# Resource types included in the tag statistics report by default
+#
+_DEFAULT_STATS_TYPES = ['ami', 'eni', 'inst', 'sg', 'snap', 'subnet',
+                                                        'vol', 'vpc']
 
 
 def _expand_type(res_type):
@@ -32,6 +62,8 @@ def _expand_type(res_type):
     in the tag command
     """
     EXPANSION_MAP = {   # in alphabetical order
+                        'ami'  :        'image',
+                        'eni'  :        'network-interface',
                         'igw'  :        'internet-gateway',
                         'inst' :        'instance',
                         'nacl' :        'network-acl',
@@ -43,25 +75,404 @@ def _expand_type(res_type):
     return EXPANSION_MAP.get(res_type, res_type)
 
 
+def _flatten_reservations(reservation_list):
+    """Returns the list of instances in reservation_list
+    """
+    instance_list = []
+    for reservation in reservation_list:
+        instance_list.extend(reservation.instances)
+    return instance_list
+
+
+#
+# Key: resource type, as used in a tag query
+# Value: function that returns the list of resources of that type given
+#        an EC2 (or VPC) connection and a filter dictionary
+#
+_QUERY_RESOLVER_MAP = {   # in alphabetical order
+        'ami' : lambda conn, filters: conn.get_all_images(owners=['self'],
+                                                        filters=filters),
+        'eni' : lambda conn, filters: conn.get_all_network_interfaces(
+                                                        filters=filters),
+        'igw' : lambda conn, filters: conn.get_all_internet_gateways(
+                                                        filters=filters),
+        'inst' : lambda conn, filters: _flatten_reservations(
+                                conn.get_all_instances(filters=filters)),
+        'nacl' : lambda conn, filters: conn.get_all_network_acls(
+                                                        filters=filters),
+        'rtb' : lambda conn, filters: conn.get_all_route_tables(
+                                                        filters=filters),
+        'sg' : lambda conn, filters: conn.get_all_security_groups(
+                                                        filters=filters),
+        'snap' : lambda conn, filters: conn.get_all_snapshots(owner='self',
+                                                        filters=filters),
+        'subnet' : lambda conn, filters: conn.get_all_subnets(
+                                                        filters=filters),
+        'vol' : lambda conn, filters: conn.get_all_volumes(filters=filters),
+        'vpc' : lambda conn, filters: conn.get_all_vpcs(filters=filters),
+    }
+
+
+#
+# Key: resource type
+# Value: function that returns the resources of that type (all of them)
+#        given an EC2 (or VPC) connection, for the types where the compact
+#        records of fastparse.py can be used instead of boto objects
+#
+_INVENTORY_MAP = {
+        'ami' : lambda conn: get_image_records(conn, owners=['self']),
+        'snap' : lambda conn: get_snapshot_records(conn, owner='self'),
+    }
+
+
+class _TagQuery(object):
+    """A tag query identifies a set of resources of a particular type.
+    The query spec has the form
+            type[:term[,term]...]
+    where each term is one of
+            name=value      : an EC2 filter (for example, status=completed,
+                              or tag:Env=prod)
+            !key            : resources that lack a tag with this key
+    """
+    def __init__(self, query_spec):
+        if ':' in query_spec:
+            self.res_type, term_str = query_spec.split(':', 1)
+            term_list = [term for term in term_str.split(',') if term]
+        else:
+            self.res_type = query_spec
+            term_list = []
+        if self.res_type not in _QUERY_RESOLVER_MAP:
+            raise CommandError(
+                "Bad resource type in query: %s; available types: %s" %
+                    (self.res_type, ", ".join(sorted(_QUERY_RESOLVER_MAP))))
+        self.filter_dict = {}
+        self.missing_key_list = []
+        for term in term_list:
+            if term.startswith('!'):
+                self.missing_key_list.append(term[1:])
+            elif '=' in term:
+                name, value = term.split('=', 1)
+                self.filter_dict[name] = value
+            else:
+                raise CommandError("Bad query term: %s" % (term,))
+
+    def resolve(self, vpc_conn):
+        """Returns the list of ids of the resources matching the query.
+        The VPC connection is used because it supports both the EC2 and
+        the VPC APIs.
+        """
+        resolver = _QUERY_RESOLVER_MAP[self.res_type]
+        resource_list = retry_throttled(resolver, vpc_conn,
+                                                self.filter_dict or None)
+        res_id_list = []
+        for resource in resource_list:
+            if any(key in resource.tags for key in self.missing_key_list):
+                continue
+            res_id_list.append(resource.id)
+        return res_id_list
+
+
+def _fetch_tag_page(ec2_conn, filter_dict, page_size, next_token):
+    """Returns the tuple (tag_page, next_token) for the page of tags
+    matching the filters in filter_dict identified by next_token;
+    if page_size is None, all the tags are requested at once
+    """
+    params = {}
+    if page_size is not None:
+        params['MaxResults'] = page_size
+    if filter_dict:
+        ec2_conn.build_filter_params(params, filter_dict)
+    if next_token:
+        params['NextToken'] = next_token
+    tag_page = retry_throttled(ec2_conn.get_list, 'DescribeTags',
+                                    params, [('item', Tag)], verb='POST')
+    return tag_page, tag_page.next_token
+
+
+def _tag_pages(ec2_conn, filter_dict, page_size):
+    """Returns a PagePrefetcher for the pages of tags matching the filters
+    in filter_dict. Only a few pages of tags are in memory at any point;
+    the next page is fetched while the caller processes the current one.
+    """
+    return PagePrefetcher(lambda next_token:
+            _fetch_tag_page(ec2_conn, filter_dict, page_size, next_token))
+
+
+def _iter_tags(ec2_conn, filter_dict, page_size):
+    """Generator that returns the tags matching the filters in filter_dict
+    """
+    with _tag_pages(ec2_conn, filter_dict, page_size) as tag_pages:
+        for tag_page in tag_pages:
+            for tag in tag_page:
+                yield tag
+
+
+class _TagKeyStats(object):
+    """Statistics about the values of a particular tag key.
+
+    The values are counted exactly as long as there are at most
+    EXACT_LIMIT distinct values. After that, the number of distinct values
+    is estimated using a HyperLogLog counter, and the most frequent values
+    are tracked with a (Misra-Gries) frequent-items counter, so that the
+    memory used per key is bounded.
+    """
+
+    EXACT_LIMIT = 1024
+    FREQUENT_SIZE = 100
+
+    __HLL_BITS = 12
+    __HLL_REGISTERS = 1 << __HLL_BITS
+    __HLL_ALPHA = 0.7213 / (1 + 1.079 / __HLL_REGISTERS)
+
+    __slots__ = ('count', '__value_map', '__registers')
+
+    def __init__(self):
+        self.count = 0
+        #
+        # Key: tag value
+        # Value: count (exact, or a lower bound once we switch to
+        #        the frequent-items counter)
+        #
+        self.__value_map = {}
+        self.__registers = None
+
+    def is_exact(self):
+        """Returns True if the statistics are exact
+        """
+        return self.__registers is None
+
+    def __hll_add(self, value):
+        """Add value to the HyperLogLog counter
+        """
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        x = struct.unpack('<Q', hashlib.md5(value).digest()[:8])[0]
+        index = x >> (64 - self.__HLL_BITS)
+        rest = x & ((1 << (64 - self.__HLL_BITS)) - 1)
+        rank = (64 - self.__HLL_BITS) - rest.bit_length() + 1
+        if rank > self.__registers[index]:
+            self.__registers[index] = rank
+
+    def __trim_frequent(self):
+        """Misra-Gries step: decrement all counters, dropping the ones
+        that reach 0
+        """
+        value_map = self.__value_map
+        for value in value_map.keys():
+            if value_map[value] == 1:
+                del value_map[value]
+            else:
+                value_map[value] -= 1
+
+    def add(self, value):
+        """Account for a tag with the specified value
+        """
+        self.count += 1
+        value_map = self.__value_map
+        if self.__registers is None:
+            value_map[value] = value_map.get(value, 0) + 1
+            if len(value_map) <= self.EXACT_LIMIT:
+                return
+            self.__registers = bytearray(self.__HLL_REGISTERS)
+            for known_value in value_map:
+                self.__hll_add(known_value)
+            frequent_list = sorted(value_map.iteritems(),
+                            key=lambda item: item[1],
+                            reverse=True)[:self.FREQUENT_SIZE]
+            self.__value_map = dict(frequent_list)
+            return
+        self.__hll_add(value)
+        if value in value_map:
+            value_map[value] += 1
+        elif len(value_map) < self.FREQUENT_SIZE:
+            value_map[value] = 1
+        else:
+            self.__trim_frequent()
+
+    def cardinality(self):
+        """Returns the number of distinct values (possibly estimated)
+        """
+        if self.__registers is None:
+            return len(self.__value_map)
+        n_registers = self.__HLL_REGISTERS
+        estimate = self.__HLL_ALPHA * n_registers * n_registers / \
+                        sum([2.0 ** -reg for reg in self.__registers])
+        n_zero = self.__registers.count(chr(0))
+        if estimate <= 2.5 * n_registers and n_zero:
+            estimate = n_registers * math.log(float(n_registers) / n_zero)
+        return int(round(estimate))
+
+    def top_values(self, n_values):
+        """Returns a list of (value, count) tuples for the most frequent
+        values of this key
+        """
+        return sorted(self.__value_map.iteritems(),
+                        key=lambda item: item[1], reverse=True)[:n_values]
+
+
 class TagCommand(common.BaseCommand):
 
+    def __tag_page_size(self):
+        """Returns the number of tags to request per page, or None to
+        request all the tags at once; the offline inventory only holds
+        (and serves) complete lists
+        """
+        if self.needs_complete_lists():
+            return None
+        return _TAG_PAGE_SIZE
+
     def __tag_list_cmd(self, region, selector):
         """Implements the list function of the tag command
         """
         if not selector.has_selection():
             return
         ec2_conn = self.get_ec2_conn(region)
-        tags_list = ec2_conn.get_all_tags(filters=selector.get_filter_dict())
+        with CommandOutput() as pg, \
+                _tag_pages(ec2_conn, selector.get_filter_dict(),
+                                self.__tag_page_size()) as tag_pages:
+            for tag_page in tag_pages:
+                for tag in tag_page:
+                    pg.prt("%-16s %-16s %-12s %s",
+                                tag.res_id,
+                                tag.res_type,
+                                tag.name,
+                                tag.value)
+
+    @staticmethod
+    def __tag_inventory(vpc_conn, res_type):
+        """Returns the tuple (resource_count, untagged_id_list) for
+        resources of the specified type; only the count and the untagged
+        ids are kept once the resources are retrieved
+        """
+        inventory = _INVENTORY_MAP.get(res_type)
+        if inventory is not None:
+            resource_list = retry_throttled(inventory, vpc_conn)
+        else:
+            resource_list = retry_throttled(_QUERY_RESOLVER_MAP[res_type],
+                                                            vpc_conn, None)
+        untagged_id_list = [resource.id for resource in resource_list
+                                                if not resource.tags]
+        return len(resource_list), untagged_id_list
+
+    def __tag_start_inventories(self, vpc_conn, type_list, result):
+        """Start a thread that retrieves the inventories of the resource
+        types in type_list (concurrently); when the thread terminates,
+        result['inventory_list'] holds the list of (resource_count,
+        untagged_id_list) tuples, in type_list order, or
+        result['exc_info'] the exception that the retrieval raised.
+        Returns the thread.
+        """
+        def fetch_inventories():
+            try:
+                result['inventory_list'] = concurrent_map(
+                    lambda res_type: self.__tag_inventory(vpc_conn, res_type),
+                    type_list)
+            except Exception:
+                result['exc_info'] = sys.exc_info()
+        inventory_thread = threading.Thread(target=fetch_inventories)
+        inventory_thread.daemon = True
+        inventory_thread.start()
+        return inventory_thread
+
+    def __tag_stats_cmd(self, region, type_list, key_list):
+        """Implements the statistics function of the tag command.
+        We make a single streaming pass over all the tags, while the
+        resource inventories (used to compute coverage) are retrieved
+        concurrently by a background thread.
+        """
+        if not type_list:
+            type_list = _DEFAULT_STATS_TYPES
+        for res_type in type_list:
+            if res_type not in _QUERY_RESOLVER_MAP:
+                raise CommandError("Bad resource type: %s" % (res_type,))
+        vpc_conn = self.get_vpc_conn(region)
+        filter_dict = {
+                'resource-type' : [_expand_type(t) for t in type_list],
+                }
+        if key_list:
+            filter_dict['key'] = key_list
+        #
+        # Key: tag key
+        # Value: _TagKeyStats
+        #
+        key_stats_map = {}
+        #
+        # Key: (resource-type, tag key)
+        # Value: number of resources of that type having that key
+        #
+        coverage_map = {}
+        tag_count = 0
+        inventory_result = {}
+        inventory_thread = self.__tag_start_inventories(vpc_conn, type_list,
+                                                        inventory_result)
+        for tag in _iter_tags(vpc_conn, filter_dict, self.__tag_page_size()):
+            tag_count += 1
+            try:
+                key_stats = key_stats_map[tag.name]
+            except KeyError:
+                key_stats = key_stats_map[tag.name] = _TagKeyStats()
+            key_stats.add(tag.value)
+            coverage_key = (tag.res_type, tag.name)
+            coverage_map[coverage_key] = coverage_map.get(coverage_key, 0) + 1
+        #
+        # Join with a timeout so that we remain responsive to
+        # KeyboardInterrupt
+        #
+        while inventory_thread.is_alive():
+            inventory_thread.join(0.5)
+        if 'exc_info' in inventory_result:
+            exc_type, exc_value, exc_tb = inventory_result['exc_info']
+            raise exc_type, exc_value, exc_tb
+        inventory_list = inventory_result['inventory_list']
+        if not key_list:
+            key_list = sorted(key_stats_map,
+                        key=lambda key: key_stats_map[key].count,
+                        reverse=True)[:5]
         with CommandOutput() as pg:
-            for tag in tags_list:
-                pg.prt("%-16s %-16s %-12s %s",
-                            tag.res_id,
-                            tag.res_type,
-                            tag.name,
-                            tag.value)
+            pg.prt("Tags: %d  Keys: %d", tag_count, len(key_stats_map))
+            pg.prt("%-24s %8s %8s  %s", "KEY", "TAGS", "VALUES", "TOP-VALUES")
+            for key in sorted(key_stats_map):
+                key_stats = key_stats_map[key]
+                approx = "" if key_stats.is_exact() else "~"
+                pg.prt("%-24s %8d %8s  %s", key, key_stats.count,
+                        approx + str(key_stats.cardinality()),
+                        " ".join(["%s=%s%d" % (value, approx, count)
+                            for value, count in key_stats.top_values(5)]))
+            pg.prt("Coverage:")
+            for res_type, inventory in zip(type_list, inventory_list):
+                res_count, untagged_id_list = inventory
+                tag_res_type = _expand_type(res_type)
+                pg.prt("%-24s count=%d untagged=%d",
+                        tag_res_type, res_count, len(untagged_id_list))
+                if not res_count:
+                    continue
+                for key in key_list:
+                    n_tagged = coverage_map.get((tag_res_type, key), 0)
+                    pg.prt("%15s : %5.1f%% (%d)", key,
+                                100.0 * n_tagged / res_count, n_tagged)
+            for res_type, inventory in zip(type_list, inventory_list):
+                untagged_id_list = inventory[1]
+                if untagged_id_list:
+                    pg.prt("Untagged %s:", _expand_type(res_type))
+                    for res_id in untagged_id_list:
+                        pg.prt("    %s", res_id)
 
     @staticmethod
-    def __tag_parse_args(arg_list, default_value):
+    def __tag_parse_specs(tag_spec_list, default_value):
+        """Returns a dictionary with the tags in tag_spec_list
+        """
+        tag_dict = { }
+        for tag_spec in tag_spec_list:
+            if '=' in tag_spec:
+                tag_key, tag_value = tag_spec.split('=', 1)
+            else:
+                tag_key, tag_value = tag_spec, default_value
+            tag_dict[tag_key] = tag_value
+        if not tag_dict:
+            raise CommandError("No tags specified")
+        return tag_dict
+
+    def __tag_parse_args(self, arg_list, default_value):
         """Returns the tuple (resource_id_list, tag_dict)
         """
         #
@@ -79,27 +490,61 @@ class TagCommand(common.BaseCommand):
             tag_index += 1
         if not resource_id_list:
             raise CommandError("No resource IDs specified")
-        tag_dict = { }
-        for tag_spec in arg_list[tag_index:]:
-            if '=' in tag_spec:
-                tag_key, tag_value = tag_spec.split('=', 1)
-            else:
-                tag_key, tag_value = tag_spec, default_value
-            tag_dict[tag_key] = tag_value
-        if not tag_dict:
-            raise CommandError("No tags specified")
+        tag_dict = self.__tag_parse_specs(arg_list[tag_index:], default_value)
         return resource_id_list, tag_dict
 
-    def __tag_delete_cmd(self, region, arg_list):
-        """Implements the list function of the tag command
+    def __tag_bulk_update(self, region, query, create, tag_dict):
+        """Create (or delete) the tags in tag_dict on all the resources
+        identified by the query. The resource ids are split into batches
+        which are processed concurrently.
         """
+        vpc_conn = self.get_vpc_conn(region)
+        resource_id_list = query.resolve(vpc_conn)
+        if not resource_id_list:
+            print "No matching resources"
+            return
+        op_name = "Tag" if create else "Untag"
+        if not confirm("%s %d resources" % (op_name, len(resource_id_list))):
+            return
+        update = vpc_conn.create_tags if create else vpc_conn.delete_tags
+
+        def update_batch(batch):
+            """Returns the list of resource ids that failed to update
+            """
+            try:
+                if retry_throttled(update, batch, tag_dict):
+                    return []
+            except Exception, ex:
+                print "Failed to update %d resources: %s" % (len(batch), ex)
+            return batch
+
+        batch_list = chunk_list(resource_id_list, _TAG_BATCH_SIZE)
+        failed_batch_list = concurrent_map(update_batch, batch_list)
+        failed_count = sum([len(failed) for failed in failed_batch_list])
+        print "%s: %d resources updated in %d requests, %d failed" % (
+                        op_name,
+                        len(resource_id_list) - failed_count,
+                        len(batch_list),
+                        failed_count)
+
+    def __tag_delete_cmd(self, region, query, arg_list):
+        """Implements the delete function of the tag command
+        """
+        if query is not None:
+            tag_dict = self.__tag_parse_specs(arg_list, None)
+            self.__tag_bulk_update(region, query, False, tag_dict)
+            return
         resource_id_list, tag_dict = self.__tag_parse_args(arg_list, None)
         ec2_conn = self.get_ec2_conn(region)
         ec2_conn.delete_tags(resource_id_list, tag_dict)
 
-    def __tag_create_cmd(self, region, arg_list):
-        """Implements the list function of the tag command
+    def __tag_create_cmd(self, region, query, arg_list):
+        """Implements the create function of the tag command
         """
+        if query is not None:
+            tag_dict = self.__tag_parse_specs(arg_list, '')
+            self.__tag_bulk_update(region, query, True, tag_dict)
+            return
         resource_id_list, tag_dict = self.__tag_parse_args(arg_list, '')
         ec2_conn = self.get_ec2_conn(region)
         ec2_conn.create_tags(resource_id_list, tag_dict)
@@ -109,9 +554,13 @@ class TagCommand(common.BaseCommand):
         """
         cmd_create_tags = False
         cmd_delete_tags = False
+        cmd_stats = False
         selector = ResourceSelector()
         region = None
-        opt_list, args = getopt.getopt(argv, "aCDf:k:r:t:v:")
+        query = None
+        type_list = []
+        key_list = []
+        opt_list, args = getopt.getopt(argv, "aCDf:k:Lr:St:v:w:")
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
@@ -124,22 +573,35 @@ class TagCommand(common.BaseCommand):
                     selector.add_filter_spec(opt[1])
                 elif opt[0] == '-k':
                     selector.add_filter('key', opt[1])
+                    key_list.append(opt[1])
+                elif opt[0] == '-L':
+                    self.use_offline_inventory()
                 elif opt[0] == '-r':
                     region = opt[1]
+                elif opt[0] == '-S':
+                    cmd_stats = True
                 elif opt[0] == '-t':
                     selector.add_filter('resource-type', _expand_type(opt[1]))
+                    type_list.append(opt[1])
                 elif opt[0] == '-v':
                     selector.add_filter('value', opt[1])
+                elif opt[0] == '-w':
+                    query = _TagQuery(opt[1])
+        if query is not None and not (cmd_create_tags or cmd_delete_tags):
+            raise CommandError("-w requires -C or -D")
         if cmd_create_tags:
-            self.__tag_create_cmd(region, args)
+            self.__tag_create_cmd(region, query, args)
         elif cmd_delete_tags:
-            self.__tag_delete_cmd(region, args)
+            self.__tag_delete_cmd(region, query, args)
+        elif cmd_stats:
+            self.__tag_stats_cmd(region, type_list, key_list)
         else:
             self.__tag_list_cmd(region, selector)
 
     def do_tag(self, ln):
         """
-        tag [std-options] [-f filtspec] [-k key] [-t type] [-v value] [args]
+        tag [std-options] [-f filtspec] [-k key] [-t type] [-v value]
+            [-w query] [args]
 
 Options:
     -a          : show all tags
@@ -148,15 +610,33 @@ Options:
     -f spec     : show tags matching the specified filter spec; the spec
                   has the form: key=value
     -t type     : show tags on resources of the specified type; available
-                  types: igw, inst, nacl, rtb, sg, snap, vol
+                  types: ami, eni, igw, inst, nacl, rtb, sg, snap, vol
     -k key      : show tags having the specified tag key
+    -S          : report tag statistics: per-key number of tags, number of
+                  distinct values and most common values, per-resource-type
+                  coverage, and the list of untagged resources; the -t and -k
+                  options (which may be repeated) limit the report to the
+                  specified resource types and keys
     -v value    : show tags having the specified tag value
+    -w query    : create/delete tags on all resources matching the query
+                  (instead of explicitly specified resource ids)
 
 When creating new tags, the args have the following form:
         res-id ... res-id [-] tag-spec ... tag-spec
 Example:
         tag -C i-deadbeef sg-f00fa00a - NAME=foobar
         tag -D i-deadbeef - NAME=foobar
+
+When the -w option is used, the args are just tag-specs. The query
+has the form:
+        type[:term[,term]...]
+where type is one of ami, eni, igw, inst, nacl, rtb, sg, snap, subnet,
+vol, vpc, and each term is either an EC2 filter spec (name=value), or
+!key to select the resources that do not have a tag with that key.
+The resources are tagged in batches, with the batches issued concurrently.
+Example:
+        tag -C -w 'snap:status=completed,!Owner' Owner=team-x
+        tag -D -w inst:tag:Env=test Owner
         """
         self.dispatch(self.__tag_cmd, ln)
 
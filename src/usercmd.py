@@ -24,6 +24,7 @@ import common
 
 from common import DisplayOptions
 from common import CommandOutput
+from common import PagePrefetcher
 from common import ResourceSelector
 from common import optional
 
@@ -54,10 +55,19 @@ class UserCommand(common.BaseCommand):
         """
         iam_conn = self.get_iam_conn(region)
         if selector.select_all:
-            user_info_list = iam_conn.get_all_users()
-            with CommandOutput() as pg:
-                for user_info in user_info_list:
-                    self.__user_display(user_info, disp, pg)
+
+            def fetch_page(marker):
+                """Returns the tuple (user_info_list, next_marker)
+                """
+                result = iam_conn.get_all_users(marker=marker)
+                next_marker = result.marker \
+                                if result.is_truncated == 'true' else None
+                return result.users, next_marker
+
+            with CommandOutput() as pg, PagePrefetcher(fetch_page) as pages:
+                for user_info_list in pages:
+                    for user_info in user_info_list:
+                        self.__user_display(user_info, disp, pg)
         else:
             with CommandOutput() as pg:
                 for username in selector.resource_id_list:
@@ -23,6 +23,7 @@ import time
 
 import common
 
+from columns import get_projection
 from common import amazon2localtime
 from common import amazon2unixtime
 from common import CommandError
@@ -31,13 +32,16 @@ from common import confirm_aggr
 from common import DisplayOptions
 from common import CommandOutput
 from common import ResourceSelector
+from common import describe_ids
+from common import use_describe_ids
+from records import volume_records
 
 class VolCommand(common.BaseCommand):
     """Implementation of the 'vol' command
     """
 
     def __vol_display(self, vol, disp, pg, region):
-        """Display volume info
+        """Display volume info; vol is a VolumeRecord
         """
         self.cache_insert(region, [vol.id])
         if disp.display_size:
@@ -51,9 +55,9 @@ class VolCommand(common.BaseCommand):
                         vol.id, vol.status, vol.zone, vol.size, snapshot_id)
                 if vol.snapshot_id:
                     self.cache_insert(region, [vol.snapshot_id])
-                if vol.attach_data and vol.attach_data.instance_id:
-                    attach_str = "%s:%s" % (vol.attach_data.instance_id,
-                                                vol.attach_data.device)
+                if vol.attach_instance_id:
+                    attach_str = "%s:%s" % (vol.attach_instance_id,
+                                                vol.attach_device)
                 else:
                     attach_str = "-"
                 pg.wrt(" %-22s", attach_str)
@@ -75,17 +79,15 @@ class VolCommand(common.BaseCommand):
                 pg.prt("%15s : %s", "Type", vol.type)
                 if vol.iops:
                     pg.prt("%15s : %s", "IOPS", vol.iops)
-                if vol.attach_data:
-                    atd = vol.attach_data
-                    if atd.instance_id:
-                        pg.prt("%15s : %s", "Instance-id", atd.instance_id)
-                    if atd.device:
-                        pg.prt("%15s : %s", "Device", atd.device)
-                    if atd.status:
-                        pg.prt("%15s : %s", "Attach-status", atd.status)
-                    if atd.attach_time:
-                        pg.prt("%15s : %s", "Attach-time",
-                                        amazon2localtime(atd.attach_time))
+                if vol.attach_instance_id:
+                    pg.prt("%15s : %s", "Instance-id", vol.attach_instance_id)
+                if vol.attach_device:
+                    pg.prt("%15s : %s", "Device", vol.attach_device)
+                if vol.attach_status:
+                    pg.prt("%15s : %s", "Attach-status", vol.attach_status)
+                if vol.attach_time:
+                    pg.prt("%15s : %s", "Attach-time",
+                                    amazon2localtime(vol.attach_time))
                 if disp.display_tags:
                     common.display_tags(vol.tags, pg)
             else:
@@ -93,15 +95,37 @@ class VolCommand(common.BaseCommand):
                 if disp.display_tags:
                     common.display_tags(vol.tags, pg)
 
+    def __vol_describe(self, region, selector):
+        """Returns the list of the volumes selected by selector
+        """
+        ec2_conn = self.get_ec2_conn(region)
+        if use_describe_ids(selector):
+            vol_list = describe_ids(
+                        lambda filter_dict: volume_records(
+                            ec2_conn.get_all_volumes(filters=filter_dict)),
+                        'volume-id', selector)
+        else:
+            vol_list = volume_records(ec2_conn.get_all_volumes(
+                                        volume_ids=selector.resource_id_list,
+                                        filters=selector.get_filter_dict()))
+        self.name_index_insert(region, 'volume', vol_list)
+        return vol_list
+
     def __vol_list_cmd(self, region, selector, disp):
         """Implements the list function of the vol command
         """
+        if not self.pipe_select(region, 'volume', selector):
+            return
         if not selector.has_selection():
             return
-        ec2_conn = self.get_ec2_conn(region)
-        vol_list = ec2_conn.get_all_volumes(
-                                        volume_ids=selector.resource_id_list,
-                                        filters=selector.get_filter_dict())
+        if not self.resolve_resource_names(region, 'volume', selector):
+            return
+        vol_list = self.pipe_records('volume', selector)
+        if vol_list is None:
+            vol_list = self.describe_named(region, 'volume', selector,
+                                lambda: self.__vol_describe(region, selector))
+        if self.pipe_output(region, 'volume', vol_list):
+            return
         # Key: volume-status
         # Value: volume-list
         vol_use_map = {}
@@ -112,6 +136,10 @@ class VolCommand(common.BaseCommand):
             #
             if not disp.display_count:
                 vol_list = disp.order_resources(vol_list)
+                if disp.columns is not None:
+                    disp.columns.display(vol_list, pg)
+                    self.cache_insert(region, [vol.id for vol in vol_list])
+                    return
                 for vol in vol_list:
                     self.__vol_display(vol, disp, pg, region)
             else:
@@ -136,15 +164,11 @@ class VolCommand(common.BaseCommand):
                 instance_use_map = {}
                 unaccounted_vols = []
                 for vol in vol_use_map.get('in-use', []):
-                    attach_data = vol.attach_data
-                    if attach_data:
-                        instance_id = attach_data.instance_id
-                        if instance_id:
-                            if instance_id not in instance_use_map:
-                                instance_use_map[instance_id] = []
-                            instance_use_map[instance_id].append(vol)
-                        else:
-                            unaccounted_vols.append(vol)
+                    instance_id = vol.attach_instance_id
+                    if instance_id:
+                        if instance_id not in instance_use_map:
+                            instance_use_map[instance_id] = []
+                        instance_use_map[instance_id].append(vol)
                     else:
                         unaccounted_vols.append(vol)
                 pg.prt("Volumes by instance")
@@ -346,7 +370,7 @@ class VolCommand(common.BaseCommand):
         instance_id = None
         # Volume type, when creating a new volume
         vol_type = None
-        opt_list, args = getopt.getopt(argv, "aCc:Df:i:klMnO:o:q:r:SstXxz:")
+        opt_list, args = getopt.getopt(argv, "aCc:Df:I:i:klLMnO:o:q:r:SstXxy:z:")
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
@@ -359,8 +383,12 @@ class VolCommand(common.BaseCommand):
                     cmd_delete = True
                 elif opt[0] == '-f':
                     selector.add_filter_spec(opt[1])
+                elif opt[0] == '-I':
+                    selector.id_input_path = opt[1]
                 elif opt[0] == '-l':
                     disp.display = DisplayOptions.LONG
+                elif opt[0] == '-L':
+                    self.use_offline_inventory()
                 elif opt[0] == '-i':
                     instance_id = opt[1]
                     selector.add_filter('attachment.instance-id', instance_id)
@@ -388,8 +416,13 @@ class VolCommand(common.BaseCommand):
                     cmd_detach = True
                 elif opt[0] == '-x':
                     disp.display = DisplayOptions.EXTENDED
+                elif opt[0] == '-y':
+                    disp.columns = get_projection('volume', opt[1])
                 elif opt[0] == '-z':
                     selector.add_filter('status', opt[1])
+        if selector.id_input_path and (cmd_detach or cmd_attach or
+                                cmd_create or cmd_delete or cmd_move):
+            raise CommandError("-I can only be used when listing volumes")
         if cmd_detach:
             selector.resource_id_list = args
             self.__vol_detach_cmd(region, instance_id, selector)
@@ -403,7 +436,7 @@ class VolCommand(common.BaseCommand):
         elif cmd_move:
             self.__vol_move_cmd(region, args)
         else:
-            selector.resource_id_list = args
+            selector.set_resource_ids(args, 'vol-')
             self.__vol_list_cmd(region, selector, disp)
 
     def do_vol(self, ln):
@@ -427,6 +460,8 @@ Options:
                         'io1:<num>' ==> SSD w/ <num> IOPS
     -D             : delete volume(s)
     -i instance-id : show all the volumes of the specified instance
+    -I file        : list the volumes with the ids in file ('-' for the
+                     standard input); the ids are described in batches
     -k             : display volume count
     -M             : move a volume between instances
     -o order_list  : the order_list consists of a comma-separated list
@@ -440,9 +475,16 @@ Options:
     -X             : detach the specified volumes
     -S             : attach the specified volume
     -s             : display the volume size
+    -y columns     : display only the specified columns; columns is a
+                     comma-separated list of column names (tag:<key> is
+                     the value of a tag), or @name for a saved template
+                     (see 'help columns')
     -z status      : display only volumes with the specified status
                      (creating, available, in-user, deleting, deleted, error)
 
+When listing volumes, the arguments are volume-ids or volume names
+(i.e. values of the Name tag).
+
 Use 'help vol create' for information on how to create a volume.
 Use 'help vol attach' for information on how to attach a volume.
 Use 'help vol move' for information on how to move a volume.
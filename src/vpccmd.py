@@ -67,6 +67,8 @@ class VPCCommand(common.BaseCommand):
     def __vpc_list_cmd(self, region, selector, disp):
         """Implements the list function of the vpc command
         """
+        if not self.pipe_select(region, 'vpc', selector):
+            return
         if not selector.has_selection():
             return
         vpc_conn = self.get_vpc_conn(region)
@@ -74,6 +76,8 @@ class VPCCommand(common.BaseCommand):
                                 vpc_ids=selector.resource_id_list,
                                 filters=selector.get_filter_list())
         self.cache_insert(region, [vpc.id for vpc in vpc_list])
+        if self.pipe_output(region, 'vpc', vpc_list):
+            return
         with CommandOutput() as pg:
             for vpc in vpc_list:
                 self.__vpc_display(vpc, disp, pg)
@@ -107,7 +111,7 @@ class VPCCommand(common.BaseCommand):
         disp = DisplayOptions()
         selector = ResourceSelector()
         region = None
-        opt_list, args = getopt.getopt(argv, "aCDf:lq:r:tx")
+        opt_list, args = getopt.getopt(argv, "aCDf:lLq:r:tx")
         if opt_list:
             for opt in opt_list:
                 if opt[0] == '-a':
@@ -120,6 +124,8 @@ class VPCCommand(common.BaseCommand):
                     selector.add_filter_spec(opt[1])
                 elif opt[0] == '-l':
                     disp.display = DisplayOptions.LONG
+                elif opt[0] == '-L':
+                    self.use_offline_inventory()
                 elif opt[0] == '-q':
                     selector.add_tag_filter_spec(opt[1])
                 elif opt[0] == '-r':